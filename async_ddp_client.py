@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+import asyncio
+
+import ejson
+import websockets
+
+class DDPError(Exception):
+    pass
+
+class AsyncDDPClient():
+    ''' DDP client running on an asyncio event loop
+
+    This client speaks the same messages as ddp_client.DDPClient, but does
+    not block: sub() returns a future that is resolved when the subscription
+    is ready, and method() a future that is resolved with the method result.
+    Many clients can share the same event loop.
+
+    Parameters
+    ==========
+    url : str
+        Websocket url.
+    '''
+    def __init__(self, url):
+        self.url = url
+        self.collections = {}
+        self.ws = None
+        self._request_id = 0
+        self._subs = {}
+        self._methods = {}
+        self._connected = None
+        self._receiver = None
+
+    def _next_id(self):
+        self._request_id += 1
+        return str(self._request_id)
+
+    async def send(self, data):
+        await self.ws.send(ejson.dumps(data))
+
+    async def open(self):
+        ''' Open the websocket, and connect to the DDP server '''
+        loop = asyncio.get_running_loop()
+        self.ws = await websockets.connect(self.url, max_size=None)
+        self._connected = loop.create_future()
+        self._receiver = loop.create_task(self._receive())
+        await self.connect()
+        await self._connected
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+        if self._receiver is not None:
+            await self._receiver
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    # client -> server messages -----------------------------------------------
+
+    async def connect(self):
+        await self.send({'msg': 'connect', 'version': 'pre1',
+                         'support': ['pre1']})
+
+    async def sub(self, name, params):
+        ''' Subscribe to a publication
+
+        Returns
+        =======
+        id_ : str
+            The subscription id.
+        ready : asyncio.Future
+            A future resolved with the subscription id when it is ready.
+        '''
+        id_ = self._next_id()
+        ready = asyncio.get_running_loop().create_future()
+        self._subs[id_] = ready
+        await self.send({'msg': 'sub', 'id': id_,
+                         'name': name, 'params': params})
+        return id_, ready
+
+    async def unsub(self, id_):
+        await self.send({'msg': 'unsub', 'id': id_})
+
+    async def method(self, method, params=[]):
+        ''' Call a method
+
+        Returns
+        =======
+        result : asyncio.Future
+            A future resolved with the method result.
+        '''
+        id_ = self._next_id()
+        result = asyncio.get_running_loop().create_future()
+        self._methods[id_] = result
+        await self.send({'msg': 'method', 'id': id_,
+                         'method': method, 'params': params})
+        return result
+
+    # server -> client messages callbacks -------------------------------------
+
+    def on_added(self, collection, id_, fields):
+        if collection not in self.collections:
+            self.collections[collection] = {}
+        self.collections[collection][id_] = fields
+
+    def on_changed(self, collection, id_, fields, cleared):
+        document = self.collections[collection][id_]
+        document.update(fields)
+        for key in cleared:
+            del document[key]
+
+    def on_removed(self, collection, id_):
+        del self.collections[collection][id_]
+
+    def on_ready(self, subs):
+        for sub in subs:
+            future = self._subs.pop(sub, None)
+            if future is not None and not future.done():
+                future.set_result(sub)
+
+    def on_nosub(self, id_, error):
+        future = self._subs.pop(id_, None)
+        if future is not None and not future.done():
+            future.set_exception(DDPError(error or 'nosub'))
+
+    def on_result(self, id_, error, result):
+        future = self._methods.pop(id_, None)
+        if future is None or future.done():
+            return
+        if error:
+            future.set_exception(DDPError(error))
+        else:
+            future.set_result(result)
+
+    def on_updated(self, methods):
+        pass
+
+    # websocket messages ------------------------------------------------------
+
+    async def _receive(self):
+        try:
+            async for msg in self.ws:
+                msg = ejson.loads(msg)
+                if msg.get('msg') == 'ping':
+                    await self.send({'msg': 'pong', 'id': msg.get('id')})
+                else:
+                    self.on_message(msg)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self._cancel_pending()
+
+    def _cancel_pending(self):
+        ''' Fail all pending requests once the connection is closed '''
+        pending = [self._connected] + list(self._subs.values())
+        pending += list(self._methods.values())
+        for future in pending:
+            if future is not None and not future.done():
+                future.set_exception(DDPError('connection closed'))
+        self._subs = {}
+        self._methods = {}
+
+    def on_message(self, msg):
+        if msg.get('msg') == 'connected':
+            if not self._connected.done():
+                self._connected.set_result(msg.get('session'))
+
+        if msg.get('msg') == 'failed':
+            if not self._connected.done():
+                self._connected.set_exception(DDPError('connection failed'))
+
+        if msg.get('msg') == 'added':
+            self.on_added(msg['collection'], msg['id'], msg.get('fields', {}))
+
+        if msg.get('msg') == 'changed':
+            self.on_changed(msg['collection'], msg['id'],
+                            msg.get('fields', {}), msg.get('cleared', []))
+
+        if msg.get('msg') == 'removed':
+            self.on_removed(msg['collection'], msg['id'])
+
+        if msg.get('msg') == 'ready':
+            self.on_ready(msg['subs'])
+
+        if msg.get('msg') == 'nosub':
+            self.on_nosub(msg['id'], msg.get('error'))
+
+        if msg.get('msg') == 'result':
+            self.on_result(msg['id'], msg.get('error'), msg.get('result', {}))
+
+        if msg.get('msg') == 'updated':
+            self.on_updated(msg['methods'])
+
+        return msg
+
+async def scrape_gym(url, gym):
+    ''' Scrape the boulders of a gym with an AsyncDDPClient
+
+    Returns
+    =======
+    boulders : dict
+        The scraped boulders collection.
+    '''
+    async with AsyncDDPClient(url) as client:
+        _, ready = await client.sub(
+            '_boulders.list', [{'gym': gym, 'isClosed': None}, {}, 10000])
+        await ready
+        return client.collections.get('boulders', {})
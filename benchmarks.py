@@ -0,0 +1,1063 @@
+#!/usr/bin/env python3
+
+import asyncio
+import datetime
+import json
+import os
+import pickle
+import platform
+import random
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import async_ddp_client
+import ddp_client
+import downsample
+import fake_ddp_server
+import manage_data
+import models
+import profiling
+import query
+import reduce_boulders
+import rollup
+import scrape_boulders
+import snapshots
+import store
+import synthetic
+import timeseries
+import view_boulders
+
+def make_snapshots(n_snapshots, n_boulders, interval=300, seed=0):
+    ''' Generate synthetic snapshots in the scrape_boulders.py format
+
+    Parameters
+    ==========
+    n_snapshots : int
+        Number of snapshots.
+    n_boulders : int
+        Number of boulders in each snapshot.
+    interval : int (default: 300)
+        Time between two snapshots, in seconds.
+    seed : int (default: 0)
+        Seed of the random number generator.
+
+    Returns
+    =======
+    yaml_data : dict
+        Mapping between snapshot dates and the boulders scraped at that date,
+        as returned by manage_data.load_snapshots().
+    '''
+    rnd = random.Random(seed)
+    start = datetime.datetime(2019, 1, 1)
+    start_ms = int(start.timestamp() * 1e3)
+    boulders = {}
+    for i in range(n_boulders):
+        b_id = 'boulder{:06d}'.format(i)
+        boulders[b_id] = {
+            'addedAt': {'$date': start_ms - rnd.randint(0, 30) * 86400000},
+            'boulderNum': i,
+            'closedAt': {'$date': start_ms + 60 * 86400000},
+            'comment': '',
+            'createdAt': {'$date': start_ms - 30 * 86400000},
+            'girly': False,
+            'grade': rnd.randint(1, 9),
+            'gym': 'benchmark/gym',
+            'holdsColor': rnd.randint(2, 7),
+            'label': rnd.randint(0, 9),
+            'picture': {
+                'id': 'picture{:06d}'.format(i), 'ratio': 1., 'width': 800,
+                'zoom': 'zoom{:06d}'.format(i),
+                'crop': {'x': 0, 'y': 0, 'width': 800, 'height': 800},
+                },
+            'routeSetter': ['setter{}'.format(rnd.randint(0, 9))],
+            'routeTypes': [],
+            'updatedAt': {'$date': start_ms},
+            'zone': rnd.randint(1, 5),
+            'likesCount': 0,
+            'likesRatio': 0.,
+            'sentsCount': 0,
+            'likesList': [],
+            'sentsList': [],
+            }
+    yaml_data = {}
+    for i in range(n_snapshots):
+        date = start + datetime.timedelta(seconds=i * interval)
+        snapshot = {}
+        for b_id, b in boulders.items():
+            if rnd.random() < 0.1:
+                b['sentsCount'] += 1
+                b['likesCount'] += rnd.randint(0, 1)
+                b['likesRatio'] = b['likesCount'] / b['sentsCount']
+            snapshot[b_id] = dict(b)
+        yaml_data[date.isoformat()] = snapshot
+    return yaml_data
+
+def bench_reduce(n_snapshots, n_boulders):
+    ''' Time manage_data.boulders_snapshots_to_dataframe()
+
+    Returns
+    =======
+    elapsed : float
+        Reduction time, in seconds, excluding data generation.
+    '''
+    yaml_data = make_snapshots(n_snapshots, n_boulders)
+    start = time.perf_counter()
+    manage_data.boulders_snapshots_to_dataframe(yaml_data)
+    return time.perf_counter() - start
+
+def bench_ddp_clients(n_clients, n_boulders):
+    ''' Time concurrent scrapes with the threaded and the asyncio clients
+
+    n_clients scrapes of the same gym are run against a local
+    fake_ddp_server.FakeDDPServer, using one scrape_boulders.BouldersClient
+    thread per scrape, or AsyncDDPClients sharing a single event loop.
+
+    Returns
+    =======
+    elapsed_threaded, elapsed_async : float
+        Time to complete all scrapes, in seconds.
+    '''
+    yaml_data = make_snapshots(1, n_boulders)
+    boulders = list(yaml_data.values())[0]
+    gym = 'benchmark/gym'
+    server = fake_ddp_server.FakeDDPServer(boulders)
+    url = server.start_thread()
+    try:
+        start = time.perf_counter()
+        clients = [scrape_boulders.BouldersClient(url, gym)
+                   for _ in range(n_clients)]
+        threads = [threading.Thread(target=c.run_forever) for c in clients]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed_threaded = time.perf_counter() - start
+
+        async def scrape_all():
+            await asyncio.gather(*[async_ddp_client.scrape_gym(url, gym)
+                                   for _ in range(n_clients)])
+        start = time.perf_counter()
+        asyncio.run(scrape_all())
+        elapsed_async = time.perf_counter() - start
+    finally:
+        server.stop_thread()
+    return elapsed_threaded, elapsed_async
+
+def make_ddp_messages(n_boulders):
+    ''' Generate the DDP messages of a subscription to synthetic boulders
+
+    Returns
+    =======
+    messages : list of str
+        The added messages of all boulders, followed by a ready message.
+    '''
+    yaml_data = make_snapshots(1, n_boulders)
+    boulders = list(yaml_data.values())[0]
+    messages = [
+        ddp_client.ejson.dumps({'msg': 'added', 'collection': 'boulders',
+                                'id': b_id, 'fields': fields})
+        for b_id, fields in boulders.items()]
+    messages.append(ddp_client.ejson.dumps({'msg': 'ready', 'subs': ['1']}))
+    return messages
+
+def bench_ddp_decoders(messages, skip_fields=()):
+    ''' Time the replay of DDP messages through DDPClient.on_message()
+
+    Returns
+    =======
+    elapsed : dict
+        Time to replay all messages, in seconds, for each decoder.
+    '''
+    decoders = {
+        'ejson': ddp_client.EjsonDecoder(),
+        'json': ddp_client.JsonDecoder(),
+        'json+skip': ddp_client.JsonDecoder(skip_fields=skip_fields),
+        }
+    elapsed = {}
+    for name, decoder in decoders.items():
+        client = ddp_client.DDPClient('ws://localhost', decoder=decoder)
+        start = time.perf_counter()
+        for msg in messages:
+            client.on_message(msg)
+        elapsed[name] = time.perf_counter() - start
+    return elapsed
+
+def write_snapshots(yaml_data, output_dir, fmt='jsonl'):
+    ''' Write snapshots to one file per snapshot
+
+    Returns
+    =======
+    filenames : list of str
+        The written files, in date order.
+    '''
+    extension = snapshots.SNAPSHOT_FORMATS[fmt].extension
+    filenames = []
+    for date_str in sorted(yaml_data.keys()):
+        fn = os.path.join(output_dir, 'benchmark_{}{}'.format(
+            date_str, extension))
+        snapshots.write_snapshot(fn, 'w', date_str, yaml_data[date_str])
+        filenames.append(fn)
+    return filenames
+
+def bench_stream_reduce(n_snapshots, n_boulders, max_memory=1):
+    ''' Measure the peak memory of the batch and streaming reductions
+
+    Returns
+    =======
+    peak_batch, peak_stream : float
+        Peak memory allocated during the reductions, in MB, as measured by
+        tracemalloc.
+    '''
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filenames = write_snapshots(
+            make_snapshots(n_snapshots, n_boulders), tmp_dir)
+        peaks = []
+        for reduce in (manage_data.boulders_yaml_to_dataframe,
+                       lambda fns: manage_data.stream_reduce(
+                           fns, max_memory=max_memory)):
+            tracemalloc.start()
+            reduce(filenames)
+            peaks.append(tracemalloc.get_traced_memory()[1] / 2**20)
+            tracemalloc.stop()
+    return tuple(peaks)
+
+def _retained_memory(data):
+    ''' Memory retained by an unpickled copy of data, in MB '''
+    data = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+    tracemalloc.start()
+    copy = pickle.loads(data)
+    retained = tracemalloc.get_traced_memory()[0] / 2**20
+    tracemalloc.stop()
+    del copy
+    return retained
+
+def bench_time_series(n_snapshots, n_boulders):
+    ''' Compare per-boulder dataframes with a timeseries.TimeSeriesArray
+
+    Returns
+    =======
+    results : dict
+        Memory retained by each layout, in MB, and time to compute the age of
+        the boulders at each sample, in seconds.
+    '''
+    boulders = manage_data.boulders_snapshots_to_dataframe(
+        make_snapshots(n_snapshots, n_boulders))
+    time_series = timeseries.TimeSeriesArray.from_frames(
+        boulders.index, boulders.time)
+
+    start = time.perf_counter()
+    for boulder in boulders.itertuples():
+        boulder_age = (boulder.time.date - boulder.addedAt).dt.total_seconds()
+        boulder.time['boulderAge'] = boulder_age / 86400
+    elapsed_frames = time.perf_counter() - start
+    start = time.perf_counter()
+    time_series.add_boulder_age(boulders.addedAt)
+    elapsed_array = time.perf_counter() - start
+
+    for t in boulders.time:
+        del t['boulderAge']
+    del time_series.columns['boulderAge']
+    return {
+        'frames_memory': _retained_memory(list(boulders.time)),
+        'array_memory': _retained_memory(time_series),
+        'frames_age': elapsed_frames,
+        'array_age': elapsed_array,
+        }
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(root, fn))
+               for root, _, files in os.walk(path) for fn in files)
+
+def bench_encoding(n_snapshots, n_boulders):
+    ''' Compare the time series encodings of the parquet store
+
+    Returns
+    =======
+    results : dict
+        For each encoding, the number of stored samples, the size of the
+        time series files in MB, and the time to read them in seconds.
+    '''
+    boulders = manage_data.boulders_snapshots_to_dataframe(
+        make_snapshots(n_snapshots, n_boulders))
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for encoding in timeseries.ENCODINGS:
+            boulder_store = store.BoulderStore(os.path.join(tmp_dir, encoding))
+            boulder_store.write(boulders, encoding=encoding)
+            start = time.perf_counter()
+            n_samples = len(boulder_store.read_time_series())
+            elapsed = time.perf_counter() - start
+            start = time.perf_counter()
+            boulder_store.read_time_series(expand=True)
+            elapsed_expand = time.perf_counter() - start
+            results[encoding] = {
+                'samples': n_samples,
+                'size': _dir_size(boulder_store.time_dir) / 2**20,
+                'read': elapsed,
+                'read_expand': elapsed_expand,
+                }
+    return results
+
+def bench_view(n_snapshots, n_boulders):
+    ''' Compare the rendering modes of view_boulders.py
+
+    Returns
+    =======
+    results : dict
+        For each mode, the size of the html file in MB, the number of bokeh
+        models it contains, which drives the load time in the browser, and
+        the time to build and save the plot in seconds.
+    '''
+    import bokeh.io
+    import bokeh.plotting
+    boulders = manage_data.add_derived_attributes(
+        manage_data.boulders_snapshots_to_dataframe(
+            make_snapshots(n_snapshots, n_boulders)))
+    time_series = timeseries.TimeSeriesArray.from_frames(
+        boulders.index, boulders.time)
+    time_series.add_boulder_age(boulders.addedAt)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for mode in view_boulders.RENDER_MODES:
+            fn = os.path.join(tmp_dir, mode + '.html')
+            start = time.perf_counter()
+            bokeh.io.reset_output()
+            bokeh.plotting.output_file(fn)
+            layout = view_boulders.plot_boulders(
+                boulders, time_series, 'benchmark', mode=mode)
+            bokeh.plotting.save(layout)
+            results[mode] = {
+                'size': os.path.getsize(fn) / 2**20,
+                'models': len(layout.references()),
+                'time': time.perf_counter() - start,
+                }
+    return results
+
+def bench_downsample(n_snapshots, n_boulders, points_per_boulder):
+    ''' Compare the downsampling methods of the plotted time series
+
+    Returns
+    =======
+    results : dict
+        For each method, the number of kept points, the downsampling time in
+        seconds, and the largest difference between the original sentsCount
+        and its linear interpolation between the kept points.
+    '''
+    boulders = manage_data.boulders_snapshots_to_dataframe(
+        make_snapshots(n_snapshots, n_boulders))
+    time_series = timeseries.TimeSeriesArray.from_frames(
+        boulders.index, boulders.time)
+    time_series.add_boulder_age(boulders.addedAt)
+    results = {}
+    for method in downsample.DOWNSAMPLING_METHODS:
+        start = time.perf_counter()
+        downsampled = downsample.downsample(
+            time_series, 'boulderAge', 'sentsCount', method=method,
+            points_per_boulder=points_per_boulder)
+        elapsed = time.perf_counter() - start
+        error = 0
+        for b_id in time_series.ids:
+            full, kept = time_series.view(b_id), downsampled.view(b_id)
+            interpolated = np.interp(
+                full['boulderAge'], kept['boulderAge'], kept['sentsCount'])
+            error = max(error, np.abs(interpolated - full['sentsCount']).max())
+        results[method] = {
+            'points': downsampled.offsets[-1],
+            'time': elapsed,
+            'error': error,
+            }
+    return results
+
+def bench_rollup(n_snapshots, n_boulders):
+    ''' Compare a rollup query with a scan of the boulders time series
+
+    The query is the median number of daily sents of the blue boulders of
+    the zone 3.
+
+    Returns
+    =======
+    results : dict
+        The time to update the rollups, to query them, and to scan the time
+        series of the boulders, in seconds.
+    '''
+    boulders = manage_data.boulders_snapshots_to_dataframe(
+        make_snapshots(n_snapshots, n_boulders))
+
+    start = time.perf_counter()
+    daily_sents = []
+    for boulder in boulders.itertuples():
+        if boulder.holdsColor == 4 and boulder.zone == 3:
+            sents = boulder.time.set_index('date').sentsCount.diff()
+            daily_sents.append(sents.groupby(sents.index.floor('D')).sum())
+    pd.concat(daily_sents).groupby(level=0).sum().median()
+    elapsed_scan = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        rollups = rollup.Rollups(tmp_dir)
+        start = time.perf_counter()
+        rollups.update(boulders)
+        elapsed_update = time.perf_counter() - start
+        rollups = rollup.Rollups(tmp_dir)
+        start = time.perf_counter()
+        rollups.query('day', where={'holdsColor': 4, 'zone': 3}).sents.median()
+        elapsed_query = time.perf_counter() - start
+    return {
+        'update': elapsed_update,
+        'query': elapsed_query,
+        'scan': elapsed_scan,
+        }
+
+def make_attributes(n_boulders, n_gyms, years=5, seed=0):
+    ''' Generate the attributes of an archive of boulders
+
+    Boulders are added uniformly over the years, and stay open between one
+    week and three months.
+    '''
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2019-01-01', 'ns')
+    added = start + rng.integers(
+        0, years * 365 * 86400, n_boulders).astype('timedelta64[s]')
+    closed = added + rng.integers(
+        7 * 86400, 90 * 86400, n_boulders).astype('timedelta64[s]')
+    return pd.DataFrame({
+        'id': ['boulder{:08d}'.format(i) for i in range(n_boulders)],
+        'gym': ['benchmark/gym{}'.format(g)
+                for g in rng.integers(0, n_gyms, n_boulders)],
+        'holdsColor': rng.integers(2, 8, n_boulders),
+        'grade': rng.integers(1, 10, n_boulders),
+        'zone': rng.integers(1, 6, n_boulders),
+        'addedAt': added,
+        'closedAt': closed,
+        }).set_index('id', drop=False)
+
+def bench_query(n_boulders, n_gyms, n_queries=100):
+    ''' Compare indexed queries of boulders with pandas filtering
+
+    The queries are the boulders open at a date in a gym, and the red
+    boulders added in a month.
+
+    Returns
+    =======
+    results : dict
+        The time to build the index, and the mean time of each query with
+        the index and with pandas, in seconds.
+    '''
+    attributes = make_attributes(n_boulders, n_gyms)
+    rnd = random.Random(0)
+    dates = [pd.Timestamp('2019-01-01') + pd.Timedelta(days=rnd.randint(0, 5 * 365))
+             for _ in range(n_queries)]
+    gyms = ['benchmark/gym{}'.format(rnd.randrange(n_gyms))
+            for _ in range(n_queries)]
+
+    start = time.perf_counter()
+    index = query.BoulderIndex(attributes)
+    results = {'build': time.perf_counter() - start}
+
+    def open_in_gym_pandas(date, gym):
+        return attributes.id[(attributes.gym == gym)
+                             & (attributes.addedAt <= date)
+                             & (attributes.closedAt > date)].to_numpy()
+
+    def open_in_gym_index(date, gym):
+        return index.query(gym=gym, open_at=date)
+
+    def red_in_month_pandas(date, gym):
+        month = date.to_period('M')
+        return attributes.id[(attributes.holdsColor == 5)
+                             & (attributes.addedAt >= month.start_time)
+                             & (attributes.addedAt <= month.end_time)
+                             ].to_numpy()
+
+    def red_in_month_index(date, gym):
+        month = date.to_period('M')
+        return index.query(holdsColor=5,
+                           added=(month.start_time, month.end_time))
+
+    queries = {
+        'open in gym': (open_in_gym_pandas, open_in_gym_index),
+        'red in month': (red_in_month_pandas, red_in_month_index),
+        }
+    for name, funcs in queries.items():
+        for method, func in zip(('pandas', 'index'), funcs):
+            start = time.perf_counter()
+            found = [func(date, gym) for date, gym in zip(dates, gyms)]
+            results[(name, method)] = (
+                (time.perf_counter() - start) / n_queries)
+            results[(name, method, 'found')] = sum(map(len, found))
+        assert results[(name, 'pandas', 'found')] == \
+            results[(name, 'index', 'found')]
+    return results
+
+def bench_pictures(n_boulders):
+    ''' Compare the representations of the pictures of boulders
+
+    The pictures are kept as ejson dicts, as models.Picture objects, or as
+    a models.Pictures column.
+
+    Returns
+    =======
+    results : dict
+        For each representation, the memory it retains and the size of its
+        pickle, in bytes per boulder, and the time to get the thumbnail
+        urls of all boulders, in seconds.
+    '''
+    boulders = list(make_snapshots(1, n_boulders).values())[0]
+    ejson_pictures = [b['picture'] for b in boulders.values()]
+    representations = {
+        'ejson': ejson_pictures,
+        'objects': [models.Picture(p) for p in ejson_pictures],
+        'columns': models.Pictures.from_ejson(ejson_pictures),
+        }
+    thumbnails = {
+        'ejson': lambda pictures: [
+            models.get_picture_zoom_url(p['zoom']) for p in pictures],
+        'objects': lambda pictures: [p.zoom for p in pictures],
+        'columns': lambda pictures: models.get_picture_zoom_urls(
+            pictures.columns['pictureZoom']),
+        }
+    results = {}
+    for name, pictures in representations.items():
+        start = time.perf_counter()
+        thumbnails[name](pictures)
+        elapsed = time.perf_counter() - start
+        results[name] = {
+            'memory': _retained_memory(pictures) * 2**20 / n_boulders,
+            'pickle': len(pickle.dumps(
+                pictures, protocol=pickle.HIGHEST_PROTOCOL)) / n_boulders,
+            'thumbnails': elapsed,
+            }
+    return results
+
+# stages of bench_suite()
+SUITE_STAGES = ['scrape', 'reduce', 'update', 'view']
+
+def bench_suite(n_gyms, n_boulders, n_snapshots, interval=3600, churn=0.02,
+                fmt='jsonl', memory=True, seed=0):
+    ''' Run the scrape, reduce, update and view stages on synthetic gyms
+
+    The snapshots of synthetic.make_gym_snapshots() are served one after
+    the other by a fake_ddp_server.FakeDDPServer, scraped by a
+    scrape_boulders.BouldersClient and written as by scrape_boulders.py.
+    The first half of the snapshots is reduced at once, and the second half
+    is then listed from the manifest, reduced and merged with the previous
+    boulders, as by reduce_boulders.py. Finally, the boulders open at the
+    last snapshot are plotted as by view_boulders.py.
+
+    Parameters
+    ==========
+    n_gyms, n_boulders, n_snapshots, interval, churn, seed
+        See synthetic.make_gym_snapshots().
+    fmt : str (default: 'jsonl')
+        Format of the snapshot files.
+    memory : bool (default: True)
+        If True, measure the peak memory of the stages, which slows them
+        down.
+
+    Returns
+    =======
+    stages : dict
+        For each stage of SUITE_STAGES, its time in seconds, the peak memory
+        traced during it, including the fake server for the scrape stage,
+        and the size of its output, in bytes.
+    spans : list of dict
+        The spans recorded during the stages, see profiling.Profiler.
+    '''
+    import bokeh.io
+    import bokeh.plotting
+    sizes = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        snapshot_dir = os.path.join(tmp_dir, 'snapshots')
+        os.makedirs(snapshot_dir)
+        reduced_filename = os.path.join(tmp_dir, 'boulders.pkl')
+        html_filename = os.path.join(tmp_dir, 'boulders.html')
+        server = fake_ddp_server.FakeDDPServer({})
+        url = server.start_thread()
+        generated = synthetic.make_gym_snapshots(
+            n_gyms, n_boulders, n_snapshots, interval=interval, churn=churn,
+            seed=seed)
+
+        def scrape(n):
+            for _ in range(n):
+                gym, timestamp, boulders = next(generated)
+                server.replace_boulders(boulders, gyms=[gym])
+                with profiling.span('scrape'):
+                    client = scrape_boulders.BouldersClient(url, gym)
+                    client.run_forever()
+                    snapshots.write_snapshot(
+                        synthetic.get_snapshot_filename(
+                            snapshot_dir, gym, timestamp, fmt=fmt),
+                        'w', timestamp, client.collections['boulders'])
+            sizes['scrape'] = _dir_size(snapshot_dir)
+
+        n_files = n_gyms * n_snapshots
+        profiler = profiling.start(memory=memory)
+        try:
+            scrape(n_files // 2)
+            with profiling.span('reduce'):
+                files = reduce_boulders.list_files_to_reduce(
+                    snapshot_dir, None)
+                boulders = manage_data.boulders_yaml_to_dataframe(files)
+                pd.to_pickle(boulders, reduced_filename)
+            sizes['reduce'] = os.path.getsize(reduced_filename)
+            del boulders
+
+            scrape(n_files - n_files // 2)
+            with profiling.span('update'):
+                previous_boulders = pd.read_pickle(reduced_filename)
+                latest_date = reduce_boulders.get_reduced_watermark(
+                    manage_data.get_watermarks(previous_boulders))
+                files = reduce_boulders.list_files_to_reduce(
+                    snapshot_dir, latest_date)
+                new_boulders = manage_data.boulders_yaml_to_dataframe(
+                    files, after=latest_date)
+                boulders = manage_data.update_boulders(
+                    previous_boulders, new_boulders)
+                pd.to_pickle(boulders, reduced_filename)
+            sizes['update'] = os.path.getsize(reduced_filename)
+            del previous_boulders, new_boulders, boulders
+
+            with profiling.span('view'):
+                boulders = pd.read_pickle(reduced_filename)
+                index = query.BoulderIndex(boulders)
+                boulders = boulders.loc[index.query(
+                    open_at=reduce_boulders.get_latest_reduced_date(
+                        boulders))]
+                time_series = timeseries.TimeSeriesArray.from_frames(
+                    boulders.index, boulders.time)
+                boulders = manage_data.add_derived_attributes(boulders)
+                time_series.add_boulder_age(boulders.addedAt)
+                time_series = downsample.downsample(
+                    time_series, 'boulderAge', 'sentsCount')
+                bokeh.io.reset_output()
+                bokeh.plotting.output_file(html_filename)
+                bokeh.plotting.save(view_boulders.plot_boulders(
+                    boulders, time_series, index.gyms[0]))
+            sizes['view'] = os.path.getsize(html_filename)
+        finally:
+            profiling.stop()
+            server.stop_thread()
+
+    spans = profiler.report()['spans']
+    stages = {}
+    for span in spans:
+        if span['name'] in SUITE_STAGES:
+            stages[span['name']] = {
+                'time': span['time'],
+                'peak_memory': span['peak_memory'],
+                'size': sizes[span['name']],
+                }
+    return stages, spans
+
+def _get_revision():
+    ''' Get the git revision of the benchmarked code, if available '''
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def read_suite_results(filename):
+    ''' Read the results appended to a file by the suite benchmark '''
+    try:
+        with open(filename) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+def write_suite_result(filename, result):
+    with open(filename, 'a') as f:
+        f.write(json.dumps(result) + '\n')
+
+def find_previous_result(results, params):
+    ''' Get the latest result of a run with the same parameters, if any '''
+    for result in reversed(results):
+        if result['params'] == params:
+            return result
+    return None
+
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Run boulders benchmarks.')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    parser_reduce = subparsers.add_parser(
+        'reduce',
+        help='benchmark the boulders reduction')
+    parser_reduce.add_argument(
+        '--snapshots',
+        type=int,
+        nargs='+',
+        default=[10, 100, 1000],
+        help='numbers of snapshots to benchmark')
+    parser_reduce.add_argument(
+        '--boulders',
+        type=int,
+        nargs='+',
+        default=[100, 300],
+        help='numbers of boulders to benchmark')
+
+    parser_ddp = subparsers.add_parser(
+        'ddp',
+        help='benchmark the threaded and asyncio DDP clients')
+    parser_ddp.add_argument(
+        '--clients',
+        type=int,
+        nargs='+',
+        default=[1, 10, 40],
+        help='numbers of concurrent clients to benchmark')
+    parser_ddp.add_argument(
+        '--boulders',
+        type=int,
+        default=300,
+        help='number of boulders per scrape')
+
+    parser_decode = subparsers.add_parser(
+        'ddp-decode',
+        help='benchmark the decoding of DDP messages')
+    parser_decode.add_argument(
+        '--messages',
+        type=str,
+        help=('file containing DDP messages, as written by '
+              'scrape_boulders.py --record-messages (default: synthetic '
+              'messages)'))
+    parser_decode.add_argument(
+        '--boulders',
+        type=int,
+        default=3000,
+        help='number of boulders in synthetic messages')
+
+    parser_stream = subparsers.add_parser(
+        'stream',
+        help='benchmark the memory use of the streaming reduction')
+    parser_stream.add_argument(
+        '--snapshots',
+        type=int,
+        nargs='+',
+        default=[10, 100, 300],
+        help='numbers of snapshot files to benchmark')
+    parser_stream.add_argument(
+        '--boulders',
+        type=int,
+        default=300,
+        help='number of boulders per snapshot')
+    parser_stream.add_argument(
+        '--max-memory',
+        type=float,
+        default=1,
+        help='memory used by the streaming reduction buffer, in MB')
+
+    parser_time_series = subparsers.add_parser(
+        'timeseries',
+        help='benchmark the layouts of the boulders time series')
+    parser_time_series.add_argument(
+        '--snapshots',
+        type=int,
+        nargs='+',
+        default=[100, 1000],
+        help='numbers of snapshots to benchmark')
+    parser_time_series.add_argument(
+        '--boulders',
+        type=int,
+        default=300,
+        help='number of boulders per snapshot')
+
+    parser_encoding = subparsers.add_parser(
+        'encoding',
+        help='benchmark the time series encodings of the parquet store')
+    parser_encoding.add_argument(
+        '--snapshots',
+        type=int,
+        nargs='+',
+        default=[100, 1000],
+        help='numbers of snapshots to benchmark')
+    parser_encoding.add_argument(
+        '--boulders',
+        type=int,
+        default=300,
+        help='number of boulders per snapshot')
+
+    parser_view = subparsers.add_parser(
+        'view',
+        help='benchmark the rendering modes of view_boulders.py')
+    parser_view.add_argument(
+        '--snapshots',
+        type=int,
+        default=300,
+        help='number of snapshots')
+    parser_view.add_argument(
+        '--boulders',
+        type=int,
+        nargs='+',
+        default=[100, 300],
+        help='numbers of boulders to benchmark')
+
+    parser_downsample = subparsers.add_parser(
+        'downsample',
+        help='benchmark the downsampling of the plotted time series')
+    parser_downsample.add_argument(
+        '--snapshots',
+        type=int,
+        default=3000,
+        help='number of snapshots')
+    parser_downsample.add_argument(
+        '--boulders',
+        type=int,
+        default=300,
+        help='number of boulders per snapshot')
+    parser_downsample.add_argument(
+        '--points-per-boulder',
+        type=int,
+        nargs='+',
+        default=[100, 1000],
+        help='budgets of points per boulder to benchmark')
+
+    parser_rollup = subparsers.add_parser(
+        'rollup',
+        help='benchmark queries on the rollup tables')
+    parser_rollup.add_argument(
+        '--snapshots',
+        type=int,
+        nargs='+',
+        default=[1000, 3000],
+        help='numbers of snapshots to benchmark')
+    parser_rollup.add_argument(
+        '--boulders',
+        type=int,
+        default=300,
+        help='number of boulders per snapshot')
+
+    parser_query = subparsers.add_parser(
+        'query',
+        help='benchmark indexed queries of boulders against pandas filtering')
+    parser_query.add_argument(
+        '--boulders',
+        type=int,
+        nargs='+',
+        default=[10000, 100000, 1000000],
+        help='numbers of boulders in the archive to benchmark')
+    parser_query.add_argument(
+        '--gyms',
+        type=int,
+        default=20,
+        help='number of gyms in the archive')
+
+    parser_pictures = subparsers.add_parser(
+        'pictures',
+        help='benchmark the representations of the pictures of boulders')
+    parser_pictures.add_argument(
+        '--boulders',
+        type=int,
+        nargs='+',
+        default=[1000, 10000, 100000],
+        help='numbers of boulders to benchmark')
+
+    parser_suite = subparsers.add_parser(
+        'suite',
+        help=('benchmark the scrape, reduce, update and view stages on '
+              'synthetic gyms, and record the results'))
+    parser_suite.add_argument(
+        '--gyms',
+        type=int,
+        default=3,
+        help='number of gyms (default: 3)')
+    parser_suite.add_argument(
+        '--boulders',
+        type=int,
+        nargs='+',
+        default=[100, 300],
+        help='numbers of open boulders per gym to benchmark')
+    parser_suite.add_argument(
+        '--snapshots',
+        type=int,
+        nargs='+',
+        default=[24, 96],
+        help='numbers of snapshots per gym to benchmark')
+    parser_suite.add_argument(
+        '--interval',
+        type=float,
+        default=3600,
+        help='time between two snapshots of a gym, in seconds (default: 3600)')
+    parser_suite.add_argument(
+        '--churn',
+        type=float,
+        default=0.02,
+        help='fraction of the boulders replaced each day (default: 0.02)')
+    parser_suite.add_argument(
+        '--format',
+        type=str,
+        choices=[f for f in snapshots.SNAPSHOT_FORMATS if f != 'deltas'],
+        default='jsonl',
+        help='format of the snapshot files (default: jsonl)')
+    parser_suite.add_argument(
+        '--no-memory',
+        dest='memory',
+        action='store_false',
+        help="don't measure the peak memory, which slows down the stages")
+    parser_suite.add_argument(
+        '--results',
+        type=str,
+        default='benchmark_results.jsonl',
+        help=('file to which the results are appended, and with which they '
+              'are compared (default: benchmark_results.jsonl)'))
+    args = parser.parse_args()
+
+    if args.benchmark == 'reduce':
+        print('{:>10} {:>10} {:>10}'.format(
+            'snapshots', 'boulders', 'time [s]'))
+        for n_boulders in args.boulders:
+            for n_snapshots in args.snapshots:
+                elapsed = bench_reduce(n_snapshots, n_boulders)
+                print('{:>10} {:>10} {:>10.3f}'.format(
+                    n_snapshots, n_boulders, elapsed))
+
+    if args.benchmark == 'ddp':
+        print('{:>10} {:>14} {:>14}'.format(
+            'clients', 'threaded [s]', 'asyncio [s]'))
+        for n_clients in args.clients:
+            elapsed_threaded, elapsed_async = bench_ddp_clients(
+                n_clients, args.boulders)
+            print('{:>10} {:>14.3f} {:>14.3f}'.format(
+                n_clients, elapsed_threaded, elapsed_async))
+
+    if args.benchmark == 'ddp-decode':
+        if args.messages is not None:
+            with open(args.messages) as f:
+                messages = [line.rstrip('\n') for line in f if line.strip()]
+        else:
+            messages = make_ddp_messages(args.boulders)
+        elapsed = bench_ddp_decoders(
+            messages, skip_fields=manage_data.BOULDER_PROPS_USE['discard'])
+        print('{:>10} {:>10}'.format('decoder', 'time [s]'))
+        for name, t in elapsed.items():
+            print('{:>10} {:>10.3f}'.format(name, t))
+
+    if args.benchmark == 'stream':
+        print('{:>10} {:>16} {:>16}'.format(
+            'snapshots', 'batch peak [MB]', 'stream peak [MB]'))
+        for n_snapshots in args.snapshots:
+            peak_batch, peak_stream = bench_stream_reduce(
+                n_snapshots, args.boulders, max_memory=args.max_memory)
+            print('{:>10} {:>16.1f} {:>16.1f}'.format(
+                n_snapshots, peak_batch, peak_stream))
+
+    if args.benchmark == 'timeseries':
+        print('{:>10} {:>12} {:>12} {:>12} {:>12}'.format(
+            'snapshots', 'frames [MB]', 'array [MB]',
+            'frames [s]', 'array [s]'))
+        for n_snapshots in args.snapshots:
+            r = bench_time_series(n_snapshots, args.boulders)
+            print('{:>10} {:>12.1f} {:>12.1f} {:>12.3f} {:>12.3f}'.format(
+                n_snapshots, r['frames_memory'], r['array_memory'],
+                r['frames_age'], r['array_age']))
+
+    if args.benchmark == 'encoding':
+        print('{:>10} {:>10} {:>10} {:>10} {:>10} {:>12}'.format(
+            'snapshots', 'encoding', 'samples', 'size [MB]', 'read [s]',
+            'expand [s]'))
+        for n_snapshots in args.snapshots:
+            results = bench_encoding(n_snapshots, args.boulders)
+            for encoding, r in results.items():
+                print('{:>10} {:>10} {:>10} {:>10.2f} {:>10.3f} {:>12.3f}'.format(
+                    n_snapshots, encoding, r['samples'], r['size'], r['read'],
+                    r['read_expand']))
+
+    if args.benchmark == 'view':
+        print('{:>10} {:>12} {:>10} {:>10} {:>10}'.format(
+            'boulders', 'mode', 'size [MB]', 'models', 'time [s]'))
+        for n_boulders in args.boulders:
+            results = bench_view(args.snapshots, n_boulders)
+            for mode, r in results.items():
+                print('{:>10} {:>12} {:>10.2f} {:>10} {:>10.3f}'.format(
+                    n_boulders, mode, r['size'], r['models'], r['time']))
+
+    if args.benchmark == 'downsample':
+        print('{:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+            'budget', 'method', 'points', 'time [s]', 'max error'))
+        for points_per_boulder in args.points_per_boulder:
+            results = bench_downsample(
+                args.snapshots, args.boulders, points_per_boulder)
+            for method, r in results.items():
+                print('{:>10} {:>10} {:>10} {:>10.3f} {:>10.1f}'.format(
+                    points_per_boulder, method, r['points'], r['time'],
+                    r['error']))
+
+    if args.benchmark == 'rollup':
+        print('{:>10} {:>12} {:>12} {:>12}'.format(
+            'snapshots', 'update [s]', 'query [s]', 'scan [s]'))
+        for n_snapshots in args.snapshots:
+            r = bench_rollup(n_snapshots, args.boulders)
+            print('{:>10} {:>12.3f} {:>12.4f} {:>12.3f}'.format(
+                n_snapshots, r['update'], r['query'], r['scan']))
+
+    if args.benchmark == 'query':
+        print('{:>10} {:>10} {:>14} {:>12} {:>12}'.format(
+            'boulders', 'build [s]', 'query', 'pandas [ms]', 'index [ms]'))
+        for n_boulders in args.boulders:
+            r = bench_query(n_boulders, args.gyms)
+            for name in ('open in gym', 'red in month'):
+                print('{:>10} {:>10.3f} {:>14} {:>12.3f} {:>12.3f}'.format(
+                    n_boulders, r['build'], name, r[(name, 'pandas')] * 1e3,
+                    r[(name, 'index')] * 1e3))
+
+    if args.benchmark == 'pictures':
+        print('{:>10} {:>10} {:>14} {:>14} {:>16}'.format(
+            'boulders', 'layout', 'memory [B/b]', 'pickle [B/b]',
+            'thumbnails [s]'))
+        for n_boulders in args.boulders:
+            results = bench_pictures(n_boulders)
+            for name, r in results.items():
+                print('{:>10} {:>10} {:>14.0f} {:>14.0f} {:>16.4f}'.format(
+                    n_boulders, name, r['memory'], r['pickle'],
+                    r['thumbnails']))
+
+    if args.benchmark == 'suite':
+        previous_results = read_suite_results(args.results)
+        print('{:>10} {:>10} {:>8} {:>10} {:>12} {:>12} {:>10}'.format(
+            'boulders', 'snapshots', 'stage', 'time [s]', 'memory [MB]',
+            'size [MB]', 'time [%]'))
+        for n_boulders in args.boulders:
+            for n_snapshots in args.snapshots:
+                params = {
+                    'gyms': args.gyms, 'boulders': n_boulders,
+                    'snapshots': n_snapshots, 'interval': args.interval,
+                    'churn': args.churn, 'format': args.format,
+                    'memory': args.memory,
+                    }
+                stages, spans = bench_suite(
+                    args.gyms, n_boulders, n_snapshots,
+                    interval=args.interval, churn=args.churn,
+                    fmt=args.format, memory=args.memory)
+                previous = find_previous_result(previous_results, params)
+                for stage, r in stages.items():
+                    change = ''
+                    if previous is not None and stage in previous['stages']:
+                        change = '{:+.1f}'.format(
+                            100 * (r['time'] / previous['stages'][stage]['time']
+                                   - 1))
+                    print('{:>10} {:>10} {:>8} {:>10.3f} {:>12} {:>12.2f} '
+                          '{:>10}'.format(
+                              n_boulders, n_snapshots, stage, r['time'],
+                              '{:.1f}'.format(r['peak_memory'] / 2**20)
+                              if r['peak_memory'] is not None else '-',
+                              r['size'] / 2**20, change))
+                write_suite_result(args.results, {
+                    'date': datetime.datetime.now().isoformat(),
+                    'revision': _get_revision(),
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'params': params,
+                    'stages': stages,
+                    'spans': spans,
+                    })
+        print('Results appended to:', args.results)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import glob
+import hashlib
+import os
+import pickle
+
+# increment when the format of cached records changes
+CACHE_VERSION = 1
+
+def _file_hash(filename):
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+class SnapshotCache():
+    ''' On-disk cache of parsed snapshot records
+
+    Each snapshot file is cached in an entry identified by its path and the
+    parsing options. An entry is valid if the file has the same size and
+    mtime as when it was cached, or else the same content hash. Least
+    recently used entries are evicted when the cache grows larger than
+    max_size.
+
+    Parameters
+    ==========
+    path : str
+        Directory of the cache.
+    max_size : int (default: 2**30)
+        Maximum size of the cache, in bytes.
+    '''
+    def __init__(self, path, max_size=2**30):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def _entry_filename(self, filename, options):
+        key = repr((CACHE_VERSION, os.path.abspath(filename), options))
+        key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, key + '.pkl')
+
+    def get(self, filename, options=None):
+        ''' Get the cached records of a file, or None if they are not valid
+
+        Parameters
+        ==========
+        filename : str
+            The snapshot file.
+        options : hashable (default: None)
+            Options with which the records were parsed.
+        '''
+        entry_filename = self._entry_filename(filename, options)
+        try:
+            with open(entry_filename, 'rb') as f:
+                header = pickle.load(f)
+                stat = os.stat(filename)
+                valid = (header['version'] == CACHE_VERSION
+                         and header['size'] == stat.st_size)
+                if valid and header['mtime'] != stat.st_mtime:
+                    valid = header['hash'] == _file_hash(filename)
+                if valid:
+                    records = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            valid = False
+        if not valid:
+            self.misses += 1
+            return None
+        os.utime(entry_filename)  # mark as recently used
+        self.hits += 1
+        return records
+
+    def put(self, filename, records, options=None):
+        ''' Cache the records of a file '''
+        os.makedirs(self.path, exist_ok=True)
+        stat = os.stat(filename)
+        header = {
+            'version': CACHE_VERSION,
+            'path': os.path.abspath(filename),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'hash': _file_hash(filename),
+            }
+        entry_filename = self._entry_filename(filename, options)
+        with open(entry_filename + '.tmp', 'wb') as f:
+            pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(records, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(entry_filename + '.tmp', entry_filename)
+
+    def evict(self):
+        ''' Remove least recently used entries until the cache fits max_size '''
+        entries = []
+        for fn in glob.glob(os.path.join(self.path, '*.pkl')):
+            stat = os.stat(fn)
+            entries.append((stat.st_mtime, stat.st_size, fn))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, fn in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            os.remove(fn)
+            total_size -= size
+
+    @property
+    def stats(self):
+        return 'cache: {} hits, {} misses'.format(self.hits, self.misses)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+''' Bulk conversion of raw boulder fields to reduced columns
+
+Each converter takes a pandas.Series of raw values, in which missing values
+are None or NaN, and returns the converted column along with the number of
+values that could not be converted. Missing values are not failures.
+'''
+
+import dateutil.tz
+import numpy as np
+import pandas as pd
+
+import models
+
+# local time zone, in which ejson dates are converted, as by
+# datetime.datetime.fromtimestamp()
+_LOCAL_TZ = dateutil.tz.tzlocal()
+
+# columns holding the fields of pictures
+PICTURE_COLUMNS = models.PICTURE_COLUMNS
+
+def _missing(values):
+    return pd.isna(values).to_numpy()
+
+def _count_failures(values, converted):
+    ''' Count the values that are not missing, but were not converted '''
+    return int((~_missing(values) & pd.isna(converted).to_numpy()).sum())
+
+def to_str(values):
+    missing = _missing(values)
+    converted = values.astype(object).where(~missing, None)
+    converted[~missing] = converted[~missing].astype(str)
+    return converted, 0
+
+def to_int(values):
+    numbers = pd.to_numeric(values, errors='coerce')
+    numbers = numbers.where(numbers == np.round(numbers))
+    if not numbers.isna().any():
+        numbers = numbers.astype(np.int64)
+    return numbers, _count_failures(values, numbers)
+
+def to_bool(values):
+    # missing values are False, as bool(None), but astype(bool) maps NaN to
+    # True
+    return values.notna() & values.astype(bool), 0
+
+def to_list(values):
+    converted = []
+    failures = 0
+    for v in values:
+        if isinstance(v, list) or v is None:
+            converted.append(v)
+        elif isinstance(v, (tuple, np.ndarray)):
+            converted.append(list(v))
+        else:
+            converted.append(None)
+            failures += not pd.isna(v)
+    return pd.Series(converted, index=values.index, dtype=object), failures
+
+def ejson_to_datetime64(values):
+    ''' Convert ejson dates {'$date': <ms since epoch>} to local datetimes '''
+    ms = pd.to_numeric(
+        pd.Series([v.get('$date') if isinstance(v, dict) else None
+                   for v in values], index=values.index, dtype=object),
+        errors='coerce')
+    # only convert the valid dates, as casting NaN warns
+    valid = ms.notna()
+    dates = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    dates[valid] = pd.to_datetime(ms[valid], unit='ms', utc=True).dt.tz_convert(
+        _LOCAL_TZ).dt.tz_localize(None)
+    return dates, _count_failures(values, dates)
+
+def pictures_to_columns(values):
+    ''' Convert ejson pictures to the columns PICTURE_COLUMNS
+
+    models.Picture objects, as found in boulders reduced by earlier
+    versions, are also accepted.
+
+    Returns
+    =======
+    columns : pandas.DataFrame
+        The fields of the pictures, with NaN or None for missing pictures
+        and fields.
+    failures : int
+        Number of pictures that are not dicts, or lack a field.
+    '''
+    valid = np.array([isinstance(p, (dict, models.Picture)) for p in values],
+                     dtype=bool)
+    columns = models.Pictures.from_ejson(values).to_frame(index=values.index)
+    incomplete = columns.isna().any(axis=1).to_numpy()
+    failures = int((~valid & ~_missing(values)).sum()
+                   + (incomplete & valid).sum())
+    return columns, failures
+
+# pictures_to_columns() returns several columns
+pictures_to_columns.columns = list(PICTURE_COLUMNS)
+
+def upgrade_attributes(attributes):
+    ''' Convert attributes of boulders reduced by earlier versions
+
+    The 'picture' column of models.Picture objects or ejson dicts is split
+    into PICTURE_COLUMNS, and the 'url' column, which is now derived when
+    needed, is dropped.
+    '''
+    if 'picture' in attributes:
+        pictures, _ = pictures_to_columns(attributes.picture)
+        position = attributes.columns.get_loc('picture')
+        attributes = attributes.drop(columns='picture')
+        for i, (column, values) in enumerate(pictures.items()):
+            attributes.insert(position + i, column, values.to_numpy())
+    if 'url' in attributes:
+        attributes = attributes.drop(columns='url')
+    return attributes
+
+def get_boulder_page_urls(ids, gyms):
+    ''' Get the urls of the pages of boulders, as models.get_boulder_page_url '''
+    ids = pd.Series(ids, dtype=object).astype(str).to_numpy(dtype=object)
+    gyms = pd.Series(gyms, dtype=object).astype(str).to_numpy(dtype=object)
+    return models.BoulderPage.host + '/' + gyms + '?b=' + ids
+
+def apply(func):
+    ''' Get a converter applying a function to each value
+
+    This is used for the converters of props_use that have no bulk
+    equivalent. Missing values are passed to func too.
+    '''
+    def convert(values):
+        converted = []
+        failures = 0
+        for v in values.astype(object).where(~_missing(values), None):
+            try:
+                converted.append(func(v))
+            except Exception:
+                converted.append(None)
+                failures += v is not None
+        return pd.Series(converted, index=values.index), failures
+    return convert
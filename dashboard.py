@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+
+import datetime
+import glob
+import os
+import threading
+import time
+
+import bokeh as bk
+import bokeh.layouts
+import bokeh.models
+from dateutil.parser import parse as parse_date
+import numpy as np
+import pandas as pd
+
+import downsample
+import manage_data
+import scrape_boulders
+import snapshots
+import timeseries
+import view_boulders
+
+class LiveBoulders():
+    ''' Reduced boulders kept in memory, and updated one snapshot at a time
+
+    Each update gets a new version number. Each boulder keeps the version of
+    the last update that added a sample to its time series, and the version
+    of the last update that changed its attributes. Dashboards only send the
+    new samples, and the changed attributes, to the browser.
+
+    Parameters
+    ==========
+    props_use : dict (default: manage_data.BOULDER_PROPS_USE)
+        Description of the properties to extract.
+    '''
+    def __init__(self, props_use=manage_data.BOULDER_PROPS_USE):
+        self.props_use = props_use
+        self.static_props = [p for p, _ in props_use['attribute'] if p != 'id']
+        self.ts_props = [p for p, _ in props_use['time_series'] if p != 'date']
+        self.raw_attributes = {}
+        self.times = {}
+        self.versions = {}
+        self.attribute_versions = {}
+        self.version = 0
+
+    def add_snapshot(self, date_str, boulders):
+        ''' Add a snapshot
+
+        Samples that are not more recent than the last sample of their
+        boulder are ignored.
+
+        Returns
+        =======
+        modified : set of str
+            The ids of the boulders to which a sample was added.
+        '''
+        date = parse_date(date_str)
+        self.version += 1
+        modified = set()
+        for b_id, b in boulders.items():
+            time = self.times.setdefault(
+                b_id, {p: [] for p in ['date'] + self.ts_props})
+            if time['date'] and date <= time['date'][-1]:
+                continue
+            changed = b_id not in self.raw_attributes
+            raw_attributes = self.raw_attributes.setdefault(b_id, {})
+            for prop in self.static_props:
+                value = b.get(prop)
+                if value is not None and raw_attributes.get(prop) != value:
+                    raw_attributes[prop] = value
+                    changed = True
+            time['date'].append(date)
+            for prop in self.ts_props:
+                time[prop].append(b.get(prop))
+            if changed:
+                self.attribute_versions[b_id] = self.version
+            self.versions[b_id] = self.version
+            modified.add(b_id)
+        return modified
+
+    def modified_since(self, version):
+        ''' Get the ids of the boulders with samples added after a version '''
+        return [b_id for b_id, v in self.versions.items() if v > version]
+
+    def attributes_modified_since(self, version):
+        ''' Get the ids of the boulders with attributes changed after a
+        version '''
+        return [b_id for b_id, v in self.attribute_versions.items()
+                if v > version]
+
+    def get_attributes(self, ids):
+        ''' Get the attributes of boulders in the format of view_boulders.py
+
+        Returns
+        =======
+        boulders : pandas.DataFrame
+            The boulders attributes, indexed by id.
+        '''
+        raw_attributes = pd.DataFrame(
+            [self.raw_attributes[b_id] for b_id in ids], index=list(ids),
+            columns=self.static_props)
+        return manage_data.add_derived_attributes(
+            manage_data.convert_attributes(raw_attributes, self.props_use),
+            self.props_use)
+
+    def get_time_series(self, ids, starts=None):
+        ''' Get the time series of boulders
+
+        Parameters
+        ==========
+        ids : list of str
+            The boulder ids.
+        starts : dict or None (default: None)
+            The number of samples of each boulder to skip, eg because they
+            were already plotted. If None, get all samples.
+
+        Returns
+        =======
+        time_series : timeseries.TimeSeriesArray
+            The boulders time series.
+        '''
+        if starts is None:
+            starts = {}
+        times = [self.times[b_id] for b_id in ids]
+        starts = [starts.get(b_id, 0) for b_id in ids]
+        counts = [len(time['date']) - start
+                  for time, start in zip(times, starts)]
+        time_columns = {}
+        for prop in ['date'] + self.ts_props:
+            time_columns[prop] = [v for time, start in zip(times, starts)
+                                  for v in time[prop][start:]]
+        return timeseries.TimeSeriesArray(
+            list(ids), np.concatenate([[0], np.cumsum(counts)]), time_columns)
+
+class Dashboard():
+    ''' Bokeh document plotting live boulders
+
+    The boulders are drawn with a single multi_line glyph, as by
+    view_boulders.py, with the samples they had when the document was
+    created. The samples added since are drawn as segments from the last
+    plotted point of each boulder, so that updates only stream the new
+    samples to the browser. New boulders are streamed to the multi_line
+    data source.
+
+    Boulders are shown or hidden by the 'visible' column of both data
+    sources, so that only the rows of the boulders whose visibility changed
+    are patched.
+
+    Parameters
+    ==========
+    doc : bokeh.document.Document
+        The document of a session.
+    live : LiveBoulders
+        The boulders to plot.
+    title : str
+        The plot title.
+    update_interval : float (default: 5)
+        Time between two updates of the document, in seconds.
+    points_per_boulder : int or None (default: 1000)
+        Maximum number of plotted points per boulder, when the document is
+        created.
+    '''
+    segment_columns = ['x0', 'y0', 'x1', 'y1', 'lineColor', 'visible']
+
+    def __init__(self, doc, live, title, update_interval=5,
+                 points_per_boulder=1000):
+        self.live = live
+        self.points_per_boulder = points_per_boulder
+        self.version = live.version
+        # rows of each boulder in the data sources
+        self.rows = {}
+        self.segment_rows = {}
+        # number of plotted samples, and last plotted point, of each boulder
+        self.n_samples = {}
+        self.last_points = {}
+        self.added_at = {}
+        self.colors = {}
+        self.closed_at = {}
+        self.visible = {}
+
+        self.checkbox_group = view_boulders.make_color_checkboxes(
+            active=list(range(len(view_boulders.PlotData.holds_colors))))
+        self.checkbox_group.on_change(
+            'active', lambda attr, old, new: self.update_visible(self.rows))
+
+        ids = sorted(live.raw_attributes)
+        self.source = bk.models.ColumnDataSource(self.get_boulders_data(ids))
+        self.segments = bk.models.ColumnDataSource(
+            {key: [] for key in self.segment_columns})
+        p = view_boulders.make_figure(title)
+        lines = p.multi_line(
+            'boulderAge',
+            'sentsCount',
+            line_color='lineColor',
+            source=self.source,
+            view=self._make_view(self.source),
+            )
+        p.segment(
+            'x0', 'y0', 'x1', 'y1',
+            line_color='lineColor',
+            source=self.segments,
+            view=self._make_view(self.segments),
+            )
+        # segments do not have the attributes shown by the tooltips
+        p.select_one(bk.models.HoverTool).renderers = [lines]
+
+        doc.title = title
+        doc.add_root(bk.layouts.row(self.checkbox_group, p))
+        doc.add_periodic_callback(self.update, update_interval * 1000)
+
+    @staticmethod
+    def _make_view(source):
+        visible_filter = bk.models.CustomJSFilter(
+            code='return source.data.visible;')
+        return bk.models.CDSView(source=source, filters=[visible_filter])
+
+    def is_visible(self, b_id, now):
+        ''' Whether a boulder is open, and of a selected color
+
+        As in query.BoulderIndex, boulders without closedAt are open.
+        '''
+        closed_at = self.closed_at[b_id]
+        return bool((self.colors[b_id] - 2) in self.checkbox_group.active
+                    and (pd.isna(closed_at) or closed_at > now))
+
+    def set_attributes(self, boulders):
+        ''' Record the attributes of boulders that decide how they are drawn
+        '''
+        for b_id, added_at, color, closed_at in zip(
+                boulders.index, boulders.addedAt, boulders.holdsColor,
+                boulders.closedAt):
+            self.added_at[b_id] = added_at
+            self.colors[b_id] = color
+            self.closed_at[b_id] = closed_at
+
+    def get_boulders_data(self, ids):
+        ''' Get the rows of boulders in the multi_line data source '''
+        boulders = self.live.get_attributes(ids)
+        self.set_attributes(boulders)
+        time_series = self.live.get_time_series(ids)
+        for b_id, count in zip(ids, time_series.counts):
+            self.n_samples[b_id] = count
+        time_series.add_boulder_age(boulders.addedAt)
+        time_series = downsample.downsample(
+            time_series, 'boulderAge', 'sentsCount',
+            points_per_boulder=self.points_per_boulder)
+        self._set_last_points(time_series)
+        data = view_boulders.get_boulders_data_source(
+            boulders, time_series).data
+        data = dict(data)
+        now = pd.Timestamp.now()
+        for b_id in ids:
+            self.rows[b_id] = len(self.rows)
+            self.segment_rows[b_id] = []
+            self.visible[b_id] = self.is_visible(b_id, now)
+        data['visible'] = [self.visible[b_id] for b_id in ids]
+        return data
+
+    def _set_last_points(self, time_series):
+        counts = time_series.counts
+        last = time_series.offsets[1:][counts > 0] - 1
+        x = time_series.columns['boulderAge'][last]
+        y = timeseries.hide_missing(time_series.columns['sentsCount'])[last]
+        for b_id, point in zip(time_series.ids[counts > 0], zip(x, y)):
+            self.last_points[b_id] = point
+
+    def get_segments_data(self, ids):
+        ''' Get the segments to the samples of boulders not yet plotted '''
+        time_series = self.live.get_time_series(ids, starts=self.n_samples)
+        time_series.add_boulder_age(pd.Series(self.added_at))
+        x = time_series.columns['boulderAge']
+        y = timeseries.hide_missing(time_series.columns['sentsCount'])
+        # each sample is joined to the previous one, and the first sample of
+        # each boulder to its last plotted point
+        x0 = np.concatenate([[np.nan], x[:-1]])
+        y0 = np.concatenate([[np.nan], y[:-1]])
+        counts = time_series.counts
+        for b_id, i in zip(time_series.ids[counts > 0],
+                           time_series.offsets[:-1][counts > 0]):
+            x0[i], y0[i] = self.last_points[b_id]
+        self._set_last_points(time_series)
+        segment_ids = np.repeat(time_series.ids, counts)
+        first_row = len(self.segments.data['x0'])
+        for row, b_id in enumerate(segment_ids, first_row):
+            self.segment_rows[b_id].append(row)
+        for b_id, count in zip(time_series.ids, counts):
+            self.n_samples[b_id] += count
+        return {
+            'x0': x0, 'y0': y0, 'x1': x, 'y1': y,
+            'lineColor': [self._line_color(b_id) for b_id in segment_ids],
+            'visible': [self.visible[b_id] for b_id in segment_ids],
+            }
+
+    def _line_color(self, b_id):
+        return view_boulders.PlotData.holds_colors.get(
+            self.colors[b_id], '#777777')
+
+    def update(self):
+        ''' Send the samples and attributes modified since the last update '''
+        modified = self.live.modified_since(self.version)
+        changed_ids = [b_id for b_id in
+                       self.live.attributes_modified_since(self.version)
+                       if b_id in self.rows]
+        self.version = self.live.version
+        if changed_ids:
+            self.patch_attributes(changed_ids)
+        new_ids = [b_id for b_id in modified if b_id not in self.rows]
+        extended_ids = [b_id for b_id in modified if b_id in self.rows]
+        if extended_ids:
+            self.segments.stream(self.get_segments_data(extended_ids))
+        if new_ids:
+            self.source.stream(self.get_boulders_data(new_ids))
+        # boulders closed in the future are hidden when their time comes
+        now = pd.Timestamp.now()
+        closing = [b_id for b_id, closed_at in self.closed_at.items()
+                   if self.visible[b_id] and not pd.isna(closed_at)
+                   and closed_at <= now]
+        self.update_visible(changed_ids + closing)
+
+    def patch_attributes(self, ids):
+        ''' Patch the attributes of boulders, and the color of their
+        segments '''
+        boulders = self.live.get_attributes(ids)
+        self.set_attributes(boulders)
+        data = view_boulders.get_boulders_data_source(
+            boulders, self.live.get_time_series(ids, starts=self.n_samples),
+            time_columns=()).data
+        rows = [self.rows[b_id] for b_id in ids]
+        self.source.patch({key: list(zip(rows, values))
+                           for key, values in data.items()})
+        segment_patch = [(row, self._line_color(b_id))
+                         for b_id in ids for row in self.segment_rows[b_id]]
+        if segment_patch:
+            self.segments.patch({'lineColor': segment_patch})
+
+    def update_visible(self, ids):
+        ''' Show the open boulders of the selected colors
+
+        Only the rows of the boulders whose visibility changed are patched.
+        '''
+        now = pd.Timestamp.now()
+        changed = []
+        for b_id in ids:
+            visible = self.is_visible(b_id, now)
+            if visible != self.visible[b_id]:
+                self.visible[b_id] = visible
+                changed.append(b_id)
+        if not changed:
+            return
+        self.source.patch({'visible': [
+            (self.rows[b_id], self.visible[b_id]) for b_id in changed]})
+        segment_patch = [(row, self.visible[b_id])
+                         for b_id in changed for row in self.segment_rows[b_id]]
+        if segment_patch:
+            self.segments.patch({'visible': segment_patch})
+
+class SnapshotDirFeed():
+    ''' Read the snapshots written to a directory by scrape_boulders.py
+
+    Parameters
+    ==========
+    input_dir : str
+        The directory containing the snapshot files.
+    gym : str or None (default: None)
+        If not None, only read the snapshots of this gym.
+    '''
+    def __init__(self, input_dir, gym=None):
+        self.input_dir = input_dir
+        self.gym = gym
+        self.readers = {}
+
+    def poll(self):
+        ''' Get the snapshots written since the last call
+
+        Only the end of the files that were appended to is read.
+        '''
+        pattern = '*'
+        if self.gym is not None:
+            pattern = self.gym.replace('/', '+') + '*'
+        new_snapshots = []
+        for fn in sorted(glob.glob(os.path.join(self.input_dir, pattern))):
+            if not snapshots.is_snapshot_file(fn):
+                continue
+            if fn not in self.readers:
+                self.readers[fn] = snapshots.SnapshotFileReader(fn)
+            new_snapshots += self.readers[fn].read()
+        return new_snapshots
+
+class DDPFeed():
+    ''' Sample the boulders of a gym from a live DDP subscription
+
+    Parameters
+    ==========
+    url : str
+        Websocket url.
+    gym : str
+        Gym name.
+    interval : float (default: 60)
+        Time between two snapshots, in seconds.
+    '''
+    def __init__(self, url, gym, interval=60):
+        self.client = scrape_boulders.LiveBouldersClient(url, gym)
+        self.interval = interval
+        self.last_snapshot = None
+        # the client reconnects, and keeps its boulders, until the process
+        # exits
+        self.thread = threading.Thread(target=self.client.run, daemon=True)
+        self.thread.start()
+
+    def poll(self):
+        ''' Get a snapshot of the subscription, if one is due '''
+        now = time.monotonic()
+        if not self.client.ready:
+            return []
+        if (self.last_snapshot is not None
+                and now - self.last_snapshot < self.interval):
+            return []
+        self.last_snapshot = now
+        date_str = datetime.datetime.now().isoformat()
+        return [(date_str, self.client.snapshot())]
+
+def serve(live, feeds, title, port=5006, poll_interval=5, update_interval=5,
+          points_per_boulder=1000):
+    ''' Serve a dashboard of live boulders until interrupted
+
+    Parameters
+    ==========
+    live : LiveBoulders
+        The boulders to plot.
+    feeds : list of SnapshotDirFeed or DDPFeed
+        Sources of new snapshots, polled every poll_interval seconds.
+    title : str
+        The plot title.
+    port : int (default: 5006)
+        The port of the bokeh server.
+    poll_interval, update_interval : float (default: 5)
+        Time between two polls of the feeds, and between two updates of the
+        documents, in seconds.
+    points_per_boulder : int or None (default: 1000)
+        Maximum number of plotted points per boulder.
+    '''
+    from bokeh.server.server import Server
+    from tornado.ioloop import PeriodicCallback
+
+    def poll():
+        for feed in feeds:
+            for date_str, boulders in feed.poll():
+                live.add_snapshot(date_str, boulders)
+
+    def make_document(doc):
+        Dashboard(doc, live, title, update_interval=update_interval,
+                  points_per_boulder=points_per_boulder)
+
+    poll()
+    server = Server({'/': make_document}, port=port)
+    server.start()
+    PeriodicCallback(poll, poll_interval * 1000).start()
+    print('Serving dashboard at: http://localhost:{}/'.format(server.port))
+    server.io_loop.start()
+
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Serve a live dashboard of boulders sents.')
+    parser.add_argument(
+        '--snapshot-dir',
+        type=str,
+        help='directory containing scrape_boulders.py outputs')
+    parser.add_argument(
+        '--url',
+        type=str,
+        help='websocket url of a DDP server to subscribe to')
+    parser.add_argument(
+        '--gym',
+        type=str,
+        help=('gym to plot; required with --url, and otherwise filters the '
+              'snapshot files'))
+    parser.add_argument(
+        '--interval',
+        type=float,
+        default=60,
+        help=('with --url, time between two snapshots of the subscription, '
+              'in seconds (default: 60)'))
+    parser.add_argument(
+        '--update-interval',
+        type=float,
+        default=5,
+        help='time between two updates of the dashboard, in seconds (default: 5)')
+    parser.add_argument(
+        '--points-per-boulder',
+        type=int,
+        default=1000,
+        help='maximum number of plotted points per boulder (default: 1000)')
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=5006,
+        help='port of the dashboard server (default: 5006)')
+    args = parser.parse_args()
+    if args.snapshot_dir is None and args.url is None:
+        parser.error('at least one of --snapshot-dir and --url is required')
+    if args.url is not None and args.gym is None:
+        parser.error('--gym is required with --url')
+
+    feeds = []
+    if args.snapshot_dir is not None:
+        feeds.append(SnapshotDirFeed(args.snapshot_dir, gym=args.gym))
+    if args.url is not None:
+        feeds.append(DDPFeed(args.url, args.gym, interval=args.interval))
+    serve(LiveBoulders(), feeds, args.gym or 'Boulders', port=args.port,
+          poll_interval=args.update_interval,
+          update_interval=args.update_interval,
+          points_per_boulder=args.points_per_boulder)
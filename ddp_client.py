@@ -1,8 +1,71 @@
 #!/usr/bin/env python3
 
+import base64
+import collections
+import datetime
+import json
+import threading
+import time
+
 import ejson
 import websocket
 
+import profiling
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+def ejson_to_python(value):
+    ''' Convert EJSON special types to python objects
+
+    {'$date': ms} becomes a datetime.datetime, and {'$binary': b64} becomes
+    bytes. Dicts and lists are converted recursively.
+    '''
+    if isinstance(value, dict):
+        if len(value) == 1 and '$date' in value:
+            return datetime.datetime.fromtimestamp(value['$date'] / 1e3)
+        if len(value) == 1 and '$binary' in value:
+            return base64.b64decode(value['$binary'])
+        return {k: ejson_to_python(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [ejson_to_python(v) for v in value]
+    return value
+
+class EjsonDecoder():
+    ''' Decode DDP messages with ejson '''
+    def decode(self, msg):
+        return ejson.loads(msg)
+
+class JsonDecoder():
+    ''' Decode DDP messages with the fastest available json parser
+
+    EJSON special types, such as {'$date': ...} or {'$binary': ...}, are
+    kept as is, and can be converted when needed with ejson_to_python().
+
+    Parameters
+    ==========
+    skip_fields : iterable of str (default: ())
+        Document fields that are removed from added and changed messages.
+    '''
+    def __init__(self, skip_fields=()):
+        self.skip_fields = frozenset(skip_fields)
+
+    def decode(self, msg):
+        msg = _json_loads(msg)
+        if self.skip_fields:
+            fields = msg.get('fields')
+            if fields:
+                for key in self.skip_fields.intersection(fields):
+                    del fields[key]
+            cleared = msg.get('cleared')
+            if cleared:
+                msg['cleared'] = [k for k in cleared
+                                  if k not in self.skip_fields]
+        return msg
+
 class DDPClient(websocket.WebSocketApp):
     def __init__(self, url, header=None,
                  on_open=None, on_message=None, on_error=None,
@@ -10,7 +73,8 @@ class DDPClient(websocket.WebSocketApp):
                  on_cont_message=None,
                  keep_running=True, get_mask_key=None, cookie=None,
                  subprotocols=None,
-                 on_data=None):
+                 on_data=None, decoder=None, record=None,
+                 heartbeat_interval=None, heartbeat_timeout=15):
         """
         url: websocket url.
         header: custom header for websocket handshake.
@@ -18,6 +82,15 @@ class DDPClient(websocket.WebSocketApp):
         get_mask_key: a callable to produce new mask keys,
           see the WebSocket.set_mask_key's docstring for more information
         subprotocols: array of available sub protocols. default is None.
+        decoder: object decoding received messages with its decode()
+          method. default is JsonDecoder().
+        record: file object to which received messages are written, one
+          per line. default is None.
+        heartbeat_interval: if not None, send a DDP ping when no message was
+          received for this time, in seconds. default is None.
+        heartbeat_timeout: with heartbeat_interval, close the connection when
+          no message is received this time after a ping, in seconds.
+          default is 15.
         """
         self.url = url
         self.header = header if header is not None else []
@@ -31,6 +104,33 @@ class DDPClient(websocket.WebSocketApp):
         self.subprotocols = subprotocols
 
         self.collections = {}
+        # messages_sent, bytes_sent, messages_received, bytes_received
+        self.stats = collections.Counter()
+        self._run_time = None
+        self._open_time = None
+        self._send_lock = threading.Lock()
+
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.last_message_time = None
+        self._last_ping_time = None
+        self._heartbeat_stopped = None
+
+        self.decoder = decoder if decoder is not None else JsonDecoder()
+        self.record = record
+        self._handlers = {
+            'added': self._handle_added,
+            'changed': self._handle_changed,
+            'removed': self._handle_removed,
+            'ready': self._handle_ready,
+            'connected': self._handle_connected,
+            'addedBefore': self._handle_not_implemented,
+            'movedBefore': self._handle_not_implemented,
+            'result': self._handle_result,
+            'updated': self._handle_updated,
+            'ping': self._handle_ping,
+            'pong': self._handle_pong,
+            }
 
         self._request_id = 0
 
@@ -38,8 +138,57 @@ class DDPClient(websocket.WebSocketApp):
         self._request_id += 1
         return str(self._request_id)
 
+    def _count(self, name, value=1):
+        self.stats[name] += value
+        profiling.count('ddp/' + name, value)
+
+    def run_forever(self, *args, **kwargs):
+        self._run_time = time.perf_counter()
+        try:
+            return super().run_forever(*args, **kwargs)
+        finally:
+            self._stop_heartbeat()
+
     def send(self, data):
-        super().send(ejson.dumps(data))
+        data = ejson.dumps(data)
+        self._count('messages_sent')
+        self._count('bytes_sent', len(data.encode('utf-8')))
+        # the heartbeat thread also sends messages
+        with self._send_lock:
+            super().send(data)
+
+    def _start_heartbeat(self):
+        self._stop_heartbeat()
+        self._heartbeat_stopped = threading.Event()
+        thread = threading.Thread(
+            target=self._heartbeat, args=(self._heartbeat_stopped,),
+            daemon=True)
+        thread.start()
+
+    def _stop_heartbeat(self):
+        if self._heartbeat_stopped is not None:
+            self._heartbeat_stopped.set()
+            self._heartbeat_stopped = None
+
+    def _heartbeat(self, stopped):
+        ''' Ping the server when the connection is idle, and close the
+        connection when the server does not answer '''
+        tick = min(self.heartbeat_interval, self.heartbeat_timeout) / 2
+        while not stopped.wait(tick):
+            now = time.monotonic()
+            idle = now - self.last_message_time
+            if idle > self.heartbeat_interval + self.heartbeat_timeout:
+                self._count('heartbeat_timeouts')
+                self.close()
+                return
+            if idle > self.heartbeat_interval and (
+                    self._last_ping_time is None
+                    or self._last_ping_time < self.last_message_time):
+                self._last_ping_time = now
+                try:
+                    self.ping()
+                except Exception:
+                    return  # the connection is closing
 
     # client -> server messages -----------------------------------------------
 
@@ -59,6 +208,9 @@ class DDPClient(websocket.WebSocketApp):
         self.send({'msg': 'method', 'id': self._next_id(),
                    'method': method, 'params': params})
 
+    def ping(self):
+        self.send({'msg': 'ping', 'id': self._next_id()})
+
 
     # server -> client messages callbacks -------------------------------------
 
@@ -76,6 +228,9 @@ class DDPClient(websocket.WebSocketApp):
     def on_removed(self, collection, id_):
         del self.collections[collection][id_]
 
+    def on_connected(self, session):
+        pass
+
     def on_ready(self, subs):
         pass
 
@@ -88,39 +243,64 @@ class DDPClient(websocket.WebSocketApp):
     # websocket callbacks -----------------------------------------------------
 
     def on_open(self):
+        self._open_time = time.perf_counter()
+        if self._run_time is not None:
+            profiling.add_span('websocket_handshake',
+                               self._open_time - self._run_time)
+        self.last_message_time = time.monotonic()
+        if self.heartbeat_interval is not None:
+            self._start_heartbeat()
         self.connect()
 
     def on_message(self, msg):
-        msg = ejson.loads(msg)
-
-        if msg.get('msg') == 'added':
-            self.on_added(msg['collection'], msg['id'], msg.get('fields', {}))
+        self.last_message_time = time.monotonic()
+        self._count('messages_received')
+        self._count('bytes_received', len(msg.encode('utf-8')))
+        if self.record is not None:
+            self.record.write(msg + '\n')
+        msg = self.decoder.decode(msg)
+        handler = self._handlers.get(msg.get('msg'))
+        if handler is not None:
+            handler(msg)
+        return msg
 
-        if msg.get('msg') == 'changed':
-            self.on_changed(msg['collection'], msg['id'],
-                            msg.get('fields', {}), msg.get('cleared', []))
+    def _handle_added(self, msg):
+        self.on_added(msg['collection'], msg['id'], msg.get('fields', {}))
 
-        if msg.get('msg') == 'removed':
-            self.on_removed(msg['collection'], msg['id'])
+    def _handle_changed(self, msg):
+        self.on_changed(msg['collection'], msg['id'],
+                        msg.get('fields', {}), msg.get('cleared', []))
 
-        if msg.get('msg') == 'ready':
-            self.on_ready(msg['subs'])
+    def _handle_removed(self, msg):
+        self.on_removed(msg['collection'], msg['id'])
 
-        if msg.get('msg') == 'addedBefore':
-            raise NotImplementedError
+    def _handle_connected(self, msg):
+        if self._open_time is not None:
+            profiling.add_span('ddp_handshake',
+                               time.perf_counter() - self._open_time)
+        self.on_connected(msg.get('session'))
 
-        if msg.get('msg') == 'movedBefore':
-            raise NotImplementedError
+    def _handle_ready(self, msg):
+        self.on_ready(msg['subs'])
 
+    def _handle_ping(self, msg):
+        # the server closes connections that do not answer its pings
+        pong = {'msg': 'pong'}
+        if 'id' in msg:
+            pong['id'] = msg['id']
+        self.send(pong)
 
-        if msg.get('msg') == 'result':
-            self.on_result(msg['id'], msg.get('error'), msg.get('result', {}))
+    def _handle_pong(self, msg):
+        pass
 
-        if msg.get('msg') == 'updated':
-            self.on_updated(msg['methods'])
+    def _handle_not_implemented(self, msg):
+        raise NotImplementedError
 
+    def _handle_result(self, msg):
+        self.on_result(msg['id'], msg.get('error'), msg.get('result', {}))
 
-        return msg
+    def _handle_updated(self, msg):
+        self.on_updated(msg['methods'])
 
     def on_data(self, data, type_, continued):
         pass
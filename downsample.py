@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+def lttb(x, y, n_out):
+    ''' Select points with the Largest-Triangle-Three-Buckets algorithm
+
+    The first and last points are kept. The other points are split into
+    n_out - 2 buckets, and in each bucket the point forming the largest
+    triangle with the previously selected point and the mean of the next
+    bucket is kept.
+
+    Parameters
+    ==========
+    x, y : numpy.ndarray
+        The coordinates of the points, sorted by x.
+    n_out : int
+        The number of points to keep.
+
+    Returns
+    =======
+    indices : numpy.ndarray
+        The indices of the kept points, in increasing order.
+    '''
+    n = len(x)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1])
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        if i + 2 < n_out - 1:
+            next_start, next_stop = edges[i + 1], edges[i + 2]
+            next_x = x[next_start:next_stop].mean()
+            next_y = y[next_start:next_stop].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        a = indices[i]
+        area = np.abs(
+            (x[a] - next_x) * (y[start:stop] - y[a])
+            - (x[a] - x[start:stop]) * (next_y - y[a]))
+        indices[i + 1] = start + np.argmax(area)
+    return indices
+
+def minmax(x, y, n_out):
+    ''' Select the minimum and maximum points of buckets of equal width
+
+    The x range is split into n_out // 2 buckets of equal width, which
+    matches pixel columns when the plot spans the x range. In each bucket,
+    the points with the smallest and largest y are kept, so that peaks are
+    never lost. The first and last points are always kept.
+
+    Parameters
+    ==========
+    x, y : numpy.ndarray
+        The coordinates of the points, sorted by x.
+    n_out : int
+        The maximum number of points to keep.
+
+    Returns
+    =======
+    indices : numpy.ndarray
+        The indices of the kept points, in increasing order.
+    '''
+    n = len(x)
+    n_buckets = (n_out - 2) // 2
+    if n_out >= n or n_buckets < 1:
+        return lttb(x, y, n_out)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    bucket = np.floor((x - x[0]) / (x[-1] - x[0] or 1) * n_buckets)
+    bucket = np.clip(bucket, 0, n_buckets - 1).astype(np.int64)
+    starts = np.flatnonzero(np.diff(bucket, prepend=-1))
+    order = np.lexsort((y, bucket))  # sorted by bucket, then y
+    ends = np.append(starts[1:], n)
+    kept = np.concatenate([order[starts], order[ends - 1], [0, n - 1]])
+    return np.unique(kept)
+
+DOWNSAMPLING_METHODS = {
+    'lttb': lttb,
+    'minmax': minmax,
+    }
+
+def get_budgets(counts, points_per_boulder=None, points_per_plot=None):
+    ''' Split a budget of points between boulders
+
+    The plot budget is shared in proportion to the number of samples of each
+    boulder, so that long-lived boulders keep more points.
+
+    Parameters
+    ==========
+    counts : numpy.ndarray
+        The number of samples of each boulder.
+    points_per_boulder : int or None (default: None)
+        Maximum number of points of each boulder.
+    points_per_plot : int or None (default: None)
+        Maximum total number of points.
+
+    Returns
+    =======
+    budgets : numpy.ndarray
+        The maximum number of points of each boulder.
+    '''
+    budgets = np.asarray(counts, dtype=np.int64).copy()
+    if points_per_boulder is not None:
+        budgets = np.minimum(budgets, points_per_boulder)
+    total = budgets.sum()
+    if points_per_plot is not None and total > points_per_plot:
+        budgets = np.floor(budgets * (points_per_plot / total))
+        budgets = np.maximum(budgets.astype(np.int64), 3)
+    return np.minimum(budgets, counts)
+
+def downsample(time_series, x, y, method='lttb', points_per_boulder=None,
+               points_per_plot=None):
+    ''' Downsample the time series of boulders for plotting
+
+    Parameters
+    ==========
+    time_series : timeseries.TimeSeriesArray
+        The boulders time series.
+    x, y : str
+        The plotted columns. Samples are assumed to be sorted by x.
+    method : str (default: 'lttb')
+        One of DOWNSAMPLING_METHODS.
+    points_per_boulder, points_per_plot : int or None (default: None)
+        Budgets of points, see get_budgets().
+
+    Returns
+    =======
+    time_series : timeseries.TimeSeriesArray
+        The kept samples.
+    '''
+    select = DOWNSAMPLING_METHODS[method]
+    counts = time_series.counts
+    budgets = get_budgets(counts, points_per_boulder, points_per_plot)
+    mask = np.ones(time_series.offsets[-1], dtype=bool)
+    x_values = time_series.columns[x]
+    y_values = time_series.columns[y]
+    for i in np.flatnonzero(budgets < counts):
+        start, stop = time_series.offsets[i], time_series.offsets[i + 1]
+        mask[start:stop] = False
+        indices = select(x_values[start:stop], y_values[start:stop],
+                         budgets[i])
+        mask[start + indices] = True
+    return time_series.select(mask)
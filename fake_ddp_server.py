@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+import asyncio
+import os
+import threading
+
+import ejson
+import websockets
+
+import snapshots
+
+class FakeDDPServer():
+    ''' Local stand-in for the boulders DDP server
+
+    The server publishes a boulders collection through the '_boulders.list'
+    subscription, filtered by gym, answers pings, and echoes the parameters
+    of method calls.
+
+    The collection can be replaced while the server runs, eg to replay
+    scraped snapshots: new subscriptions get the new collection, and the
+    clients that stay subscribed receive the added, changed and removed
+    boulders, as from the real server.
+
+    Parameters
+    ==========
+    boulders : dict
+        The boulders collection, as saved in snapshots by scrape_boulders.py.
+    host : str (default: 'localhost')
+    port : int (default: 0)
+        The port to listen to. If 0, a free port is chosen.
+    '''
+    def __init__(self, boulders, host='localhost', port=0):
+        self.boulders = boulders
+        self.host = host
+        self.port = port
+        self._server = None
+        self._loop = None
+        self._thread = None
+        # websocket -> {subscription id: gym}
+        self._subscriptions = {}
+
+    @property
+    def url(self):
+        return 'ws://{}:{}/websocket'.format(self.host, self.port)
+
+    async def _send(self, ws, data):
+        await ws.send(ejson.dumps(data))
+
+    async def _publish(self, ws, id_, name, params):
+        if name != '_boulders.list':
+            await self._send(ws, {
+                'msg': 'nosub', 'id': id_,
+                'error': {'error': 404, 'reason': 'Subscription not found'}})
+            return
+        gym = params[0].get('gym') if params else None
+        for b_id, fields in self.boulders.items():
+            if _in_gym(fields, gym):
+                await self._send(ws, {
+                    'msg': 'added', 'collection': 'boulders', 'id': b_id,
+                    'fields': fields})
+        await self._send(ws, {'msg': 'ready', 'subs': [id_]})
+        self._subscriptions.setdefault(ws, {})[id_] = gym
+
+    async def _replace_boulders(self, boulders, gyms=None):
+        old = self.boulders
+        if gyms is None:
+            new = dict(boulders)
+        else:
+            new = {b_id: fields for b_id, fields in old.items()
+                   if fields.get('gym') not in gyms}
+            new.update(boulders)
+        self.boulders = new
+        for ws, subs in list(self._subscriptions.items()):
+            for gym in set(subs.values()):
+                try:
+                    for msg in _diff_messages(old, new, gym):
+                        await self._send(ws, msg)
+                except websockets.ConnectionClosed:
+                    self._subscriptions.pop(ws, None)
+                    break
+
+    def replace_boulders(self, boulders, gyms=None):
+        ''' Replace the served boulders collection
+
+        This must be called from another thread than the one of the server,
+        eg after start_thread().
+
+        Parameters
+        ==========
+        boulders : dict
+            The new boulders collection.
+        gyms : iterable of str or None (default: None)
+            If not None, only replace the boulders of these gyms, and keep
+            the boulders of the other gyms.
+        '''
+        gyms = set(gyms) if gyms is not None else None
+        asyncio.run_coroutine_threadsafe(
+            self._replace_boulders(boulders, gyms), self._loop).result()
+
+    async def replay(self, snapshots, interval):
+        ''' Serve snapshots one after the other
+
+        Each snapshot replaces the boulders of the gyms it contains.
+
+        Parameters
+        ==========
+        snapshots : iterable of (str, dict)
+            Timestamps and boulders collections, as read by
+            snapshots.read_snapshots().
+        interval : float
+            Time during which each snapshot is served, in seconds.
+        '''
+        for timestamp, boulders in snapshots:
+            gyms = {fields.get('gym') for fields in boulders.values()}
+            await self._replace_boulders(boulders, gyms)
+            await asyncio.sleep(interval)
+
+    async def handler(self, ws, path=None):
+        try:
+            async for msg in ws:
+                msg = ejson.loads(msg)
+                if msg.get('msg') == 'connect':
+                    await self._send(ws, {'msg': 'connected', 'session': 'fake'})
+                elif msg.get('msg') == 'sub':
+                    await self._publish(
+                        ws, msg['id'], msg['name'], msg.get('params', []))
+                elif msg.get('msg') == 'unsub':
+                    self._subscriptions.get(ws, {}).pop(msg['id'], None)
+                    await self._send(ws, {'msg': 'nosub', 'id': msg['id']})
+                elif msg.get('msg') == 'method':
+                    await self._send(ws, {
+                        'msg': 'result', 'id': msg['id'],
+                        'result': msg.get('params', [])})
+                    await self._send(ws, {'msg': 'updated',
+                                          'methods': [msg['id']]})
+                elif msg.get('msg') == 'ping':
+                    await self._send(ws, {'msg': 'pong', 'id': msg.get('id')})
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self._subscriptions.pop(ws, None)
+
+    async def start(self):
+        self._server = await websockets.serve(
+            self.handler, self.host, self.port, max_size=None)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def start_thread(self):
+        ''' Run the server in a background thread, and return its url '''
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self.stop())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.url
+
+    def stop_thread(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+def _in_gym(fields, gym):
+    return gym is None or fields.get('gym', gym) == gym
+
+def _diff_messages(old, new, gym=None):
+    ''' Get the DDP messages turning the boulders of a gym from old to new '''
+    for b_id, fields in new.items():
+        if not _in_gym(fields, gym):
+            continue
+        old_fields = old.get(b_id)
+        if old_fields is None or not _in_gym(old_fields, gym):
+            yield {'msg': 'added', 'collection': 'boulders', 'id': b_id,
+                   'fields': fields}
+            continue
+        changed = {k: v for k, v in fields.items() if old_fields.get(k) != v}
+        cleared = [k for k in old_fields if k not in fields]
+        if changed or cleared:
+            msg = {'msg': 'changed', 'collection': 'boulders', 'id': b_id}
+            if changed:
+                msg['fields'] = changed
+            if cleared:
+                msg['cleared'] = cleared
+            yield msg
+    for b_id, fields in old.items():
+        if _in_gym(fields, gym) and (b_id not in new
+                                     or not _in_gym(new[b_id], gym)):
+            yield {'msg': 'removed', 'collection': 'boulders', 'id': b_id}
+
+def read_snapshots(path):
+    ''' Read the snapshots of a file, or of a directory in manifest order '''
+    if not os.path.isdir(path):
+        yield from snapshots.read_snapshots(path)
+        return
+    manifest = snapshots.SnapshotManifest(path)
+    if not manifest.exists():
+        manifest.rebuild()
+    for fn in manifest.list_files():
+        yield from snapshots.read_snapshots(fn)
+
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Serve scraped boulders through a local DDP server.')
+    parser.add_argument(
+        'input',
+        type=str,
+        help=('snapshot file written by scrape_boulders.py, or directory '
+              'of snapshot files'))
+    parser.add_argument(
+        '--host',
+        type=str,
+        default='localhost',
+        help='host to listen to (default: localhost)')
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=3000,
+        help='port to listen to (default: 3000)')
+    parser.add_argument(
+        '--replay-interval',
+        type=float,
+        help=('replay the snapshots one after the other, serving each one '
+              'during this time in seconds, instead of only serving the '
+              'latest snapshot of each gym'))
+    args = parser.parse_args()
+
+    server = FakeDDPServer({}, host=args.host, port=args.port)
+
+    async def main():
+        await server.start()
+        print('Serving boulders at:', server.url)
+        # without replay, the snapshots are loaded at once
+        await server.replay(read_snapshots(args.input),
+                            args.replay_interval or 0)
+        print('Serving the latest {} boulders'.format(len(server.boulders)))
+        await asyncio.Future()
+
+    asyncio.run(main())
@@ -1,66 +1,320 @@
 #!/usr/bin/env python3
 
+import concurrent.futures
 import datetime
+import functools
+import os
+import tempfile
 import warnings
 
 from dateutil.parser import parse as parse_date
+import numpy as np
 import pandas as pd
 import tqdm
-import yaml
 
+import conversion
 import models
+import profiling
+import schema
+import snapshots
+import timeseries
 
 def ejson_date_to_datetime(d):
     ''' Parse an ejson date, and return a datetime.datetime object '''
     return datetime.datetime.fromtimestamp(d['$date'] / 1e3)
 
-def _get_all_prop_values(yaml_data, dates, b_id, prop, func=None):
-    ''' Extract values at all sampled dates for a given property and boulder
+BOULDER_PROPS_USE = {
+    'attribute': (
+        ('id', str),
+        ('addedAt', ejson_date_to_datetime),
+        ('boulderNum', int),
+        ('closedAt', ejson_date_to_datetime),
+        ('comment', str),
+        ('createdAt', ejson_date_to_datetime),
+        ('girly', bool),
+        ('grade', int),
+        ('gym', str),
+        ('holdsColor', int),
+        ('label', int),
+        ('picture', models.Picture),
+        ('routeSetter', list),
+        ('routeTypes', list),
+        ('updatedAt', ejson_date_to_datetime),
+        ('zone', int),
+        ),
+    'derived_attributes': ( # properties derived from above processed attributes
+        ('url', ('id', 'gym'), models.get_boulder_page_url),
+        ),
+    'time_series': (
+        ('date', None),
+        ('likesCount', None),
+        ('likesRatio', None),
+        ('sentsCount', None),
+        ),
+    'discard': schema.DISCARDED_FIELDS,
+    }
 
-    Roughly equivalent to returning:
+# bulk equivalents of the converters of props_use, see conversion.py; other
+# converters are applied to each value
+COLUMN_CONVERTERS = {
+    str: conversion.to_str,
+    int: conversion.to_int,
+    bool: conversion.to_bool,
+    list: conversion.to_list,
+    ejson_date_to_datetime: conversion.ejson_to_datetime64,
+    models.Picture: conversion.pictures_to_columns,
+    }
 
-        [func(yaml_data[d][b_id][prop]) for d in dates]
+# bulk equivalents of the functions of derived attributes
+DERIVED_CONVERTERS = {
+    models.get_boulder_page_url: conversion.get_boulder_page_urls,
+    }
 
-    but without raising an exception on boulders that are added or removed
-    during the sampling period.
+# approximate size of a time series sample buffered by StreamingReducer
+_BUFFERED_ROW_SIZE = 400
+
+def _get_converter(func):
+    if func is None:
+        return None
+    return COLUMN_CONVERTERS.get(func) or conversion.apply(func)
+
+def compile_props_use(props_use=BOULDER_PROPS_USE):
+    ''' Get the bulk converter of each attribute of props_use
+
+    Returns
+    =======
+    converters : list of (str, function or None)
+        Each attribute, and its converter.
+    '''
+    return [(prop, _get_converter(func))
+            for prop, func in props_use['attribute']]
+
+def get_attribute_columns(props_use=BOULDER_PROPS_USE):
+    ''' Get the columns of the converted attributes '''
+    columns = []
+    for prop, converter in compile_props_use(props_use):
+        columns += getattr(converter, 'columns', [prop])
+    return columns
+
+def _report_failures(prop, failures):
+    if failures:
+        warnings.warn('could not convert {} values of {}'.format(
+            failures, prop))
+        profiling.count('conversion_failures/' + prop, failures)
+
+def convert_attributes(raw_attributes, props_use=BOULDER_PROPS_USE):
+    ''' Convert the raw attributes of boulders, one column at a time
+
+    Values that cannot be converted are replaced with None or NaN, and
+    counted in a warning.
+
+    Parameters
+    ==========
+    raw_attributes : pandas.DataFrame
+        The raw attributes, indexed by boulder id. Missing columns are
+        considered to be missing values.
+    props_use : dict (default: BOULDER_PROPS_USE)
+        Description of the properties to extract.
+
+    Returns
+    =======
+    attributes : pandas.DataFrame
+        The columns get_attribute_columns(props_use), indexed by boulder id.
+    '''
+    columns = {}
+    for prop, converter in compile_props_use(props_use):
+        if prop == 'id':
+            values = pd.Series(raw_attributes.index, index=raw_attributes.index,
+                               dtype=object)
+        elif prop in raw_attributes:
+            values = raw_attributes[prop]
+        else:
+            values = pd.Series(None, index=raw_attributes.index, dtype=object)
+        if converter is not None:
+            values, failures = converter(values)
+            _report_failures(prop, failures)
+        if isinstance(values, pd.DataFrame):
+            columns.update(values.items())
+        else:
+            columns[prop] = values
+    return pd.DataFrame(columns, index=raw_attributes.index)
+
+def add_derived_attributes(boulders, props_use=BOULDER_PROPS_USE):
+    ''' Add the derived attributes of props_use to boulders
+
+    Derived attributes are not stored with the reduced boulders, and are
+    computed when needed, eg by view_boulders.py.
+    '''
+    derived = {}
+    for new_prop, src_props, func in props_use['derived_attributes']:
+        src_props_values = [boulders[p] for p in src_props]
+        if func in DERIVED_CONVERTERS:
+            derived[new_prop] = DERIVED_CONVERTERS[func](*src_props_values)
+        else:
+            derived[new_prop] = [func(*v) for v in zip(*src_props_values)]
+    return boulders.assign(**derived)
+
+def load_snapshots(snapshot_files):
+    ''' Load snapshot files from scrape_boulders.py into a single dict
 
     Parameters
     ==========
-    yaml_data : dict
+    snapshot_files : list of str
+        A list of snapshot filenames written by scrape_boulders.py, in any
+        format supported by the snapshots module.
+
+    Returns
+    =======
+    yaml_data : dict
+        Mapping between snapshot dates and the boulders scraped at that date.
+    '''
+    yaml_data = {}
+    for fn in tqdm.tqdm(snapshot_files, desc='Loading snapshots'):
+        for k, v in snapshots.read_snapshots(fn):
+            if k not in yaml_data:
+                yaml_data[k] = v
+            else:
+                warnings.warn('ignoring duplicate date in yaml_data')
+    return yaml_data
+
+def _snapshot_records(date_str, boulders, discard):
+    ''' Convert the boulders of a snapshot to rows of a long dataframe '''
+    date = parse_date(date_str)
+    records = []
+    for b_id, b in boulders.items():
+        row = {k: v for k, v in b.items() if k not in discard}
+        row['id'] = b_id
+        row['date'] = date
+        records.append(row)
+    return records
+
+def _read_snapshot_records(filename, discard=()):
+    ''' Read a snapshot file, and return its rows for a long dataframe
+
+    Returns
+    =======
+    snapshot_records : list of (str, list of dict)
+        The date and the rows of each snapshot in the file.
+    '''
+    discard = set(discard)
+    return [(date_str, _snapshot_records(date_str, boulders, discard))
+            for date_str, boulders in snapshots.read_snapshots(filename)]
+
+@profiling.profiled()
+def load_snapshot_records(snapshot_files, discard=(), jobs=1, cache=None,
+                          after=None):
+    ''' Load snapshot files as rows of a long dataframe
+
+    Parameters
+    ==========
+    snapshot_files : list of str
+        A list of snapshot filenames written by scrape_boulders.py, in any
+        format supported by the snapshots module.
+    discard : iterable of str (default: ())
+        Boulder properties that are not kept.
+    jobs : int (default: 1)
+        Number of processes used to parse the files.
+    cache : cache.SnapshotCache or None (default: None)
+        If not None, files found in this cache are not parsed again, and
+        parsed files are added to it.
+    after : datetime.datetime or None (default: None)
+        If not None, only load the snapshots dated after this date, eg
+        those that were appended to a file since it was last reduced.
+
+    Returns
+    =======
+    records : dict
+        Mapping between snapshot dates and the rows of the boulders scraped
+        at that date, as returned by _snapshot_records().
+    '''
+    discard = tuple(discard)
+    files_records = [None] * len(snapshot_files)
+    if cache is not None:
+        for i, fn in enumerate(snapshot_files):
+            files_records[i] = cache.get(fn, options=discard)
+    to_parse = [i for i, r in enumerate(files_records) if r is None]
+
+    read = functools.partial(_read_snapshot_records, discard=discard)
+    progress = functools.partial(
+        tqdm.tqdm, total=len(to_parse), desc='Loading snapshots')
+    files_to_parse = [snapshot_files[i] for i in to_parse]
+    if jobs > 1 and len(files_to_parse) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            chunksize = max(1, len(files_to_parse) // (4 * jobs))
+            parsed = list(progress(
+                pool.map(read, files_to_parse, chunksize=chunksize)))
+    else:
+        parsed = [read(fn) for fn in progress(files_to_parse)]
+    for i, file_records in zip(to_parse, parsed):
+        files_records[i] = file_records
+        if cache is not None:
+            cache.put(snapshot_files[i], file_records, options=discard)
+    if cache is not None:
+        cache.evict()
+
+    records = {}
+    for file_records in files_records:
+        for date_str, snapshot_records in file_records:
+            if after is not None and parse_date(date_str) <= after:
+                continue
+            if date_str not in records:
+                records[date_str] = snapshot_records
+            else:
+                warnings.warn('ignoring duplicate date in yaml_data')
+    return records
+
+@profiling.profiled('long_dataframe')
+def records_to_long_dataframe(records):
+    ''' Build a long dataframe from rows returned by load_snapshot_records()
+
+    Returns
+    =======
+    long_df : pandas.DataFrame
+        A dataframe with columns 'id', 'date', and one column per boulder
+        property, sorted by date.
+    '''
+    rows = [row for date_str in sorted(records.keys())
+            for row in records[date_str]]
+    return pd.DataFrame.from_records(rows)
+
+def snapshots_to_long_dataframe(yaml_data, discard=()):
+    ''' Flatten snapshots into a long dataframe with one row per sample
+
+    Parameters
+    ==========
+    yaml_data : dict
         Data loaded from yaml files written by scrape_boulders.py.
-    dates : list of str
-        The sample dates, which are keys of yaml_data.
-    b_id : str
-        The id of the boulder from which to extract the property.
-    prop : str
-        The key of the property to extract.
-    func : callable or None (default: None)
-        If not None, apply this function to all elements before returning them.
+    discard : iterable of str (default: ())
+        Boulder properties that are not copied to the dataframe.
 
     Returns
     =======
-    values : list
-    '''
-    values = []
-    for date in dates:
-        boulder = yaml_data[date].get(b_id)
-        if boulder:
-            value = boulder.get(prop)
-            if func is not None:
-                try:
-                    value = func(value)
-                except:
-                    value = None
-            values.append(value)
-    return values
-
-def boulders_yaml_to_dataframe(yaml_files):
-    ''' Convert yaml files from scrape_boulders.py to a single dataframe
+    long_df : pandas.DataFrame
+        A dataframe with columns 'id', 'date', and one column per boulder
+        property, sorted by date.
+    '''
+    discard = set(discard)
+    records = {date_str: _snapshot_records(date_str, boulders, discard)
+               for date_str, boulders in yaml_data.items()}
+    return records_to_long_dataframe(records)
+
+@profiling.profiled('reduce_boulders')
+def long_dataframe_to_boulders(long_df, props_use=BOULDER_PROPS_USE,
+                               encoding='samples'):
+    ''' Reduce a long dataframe of samples to one row per boulder
+
+    Static attributes are set to their values in the last snapshot of each
+    boulder, even if they are missing from it, and the time series are
+    split into one dataframe per boulder.
 
     Parameters
     ==========
-    yaml_files : list of str
-        A list of yaml filenames written by scrape_boulders.py
+    long_df : pandas.DataFrame
+        A dataframe returned by snapshots_to_long_dataframe().
+    props_use : dict (default: BOULDER_PROPS_USE)
+        Description of the properties to extract.
+    encoding : str (default: 'samples')
+        Encoding of the time series, one of timeseries.ENCODINGS.
 
     Returns
     =======
@@ -68,97 +322,351 @@ def boulders_yaml_to_dataframe(yaml_files):
         A dataframe containing all the boulders properties, including time
         resolved values of sentsCount, likesCount, and likesRatio.
     '''
-    yaml_data = {}
-    for fn in tqdm.tqdm(yaml_files, desc='Loading yaml data'):
-        with open(fn) as f:
-            f_data = yaml.load(f)
-            for k, v in f_data.items():
-                if k not in yaml_data:
-                    yaml_data[k] = v
-                else:
-                    warnings.warn('ignoring duplicate date in yaml_data')
-
-    # extract date and boulder_id keys
-    boulders_id = set([k for d in yaml_data.values() for k in d.keys()])
-    dates_str = sorted([d for d in yaml_data.keys()])
-    dates_datetime = [parse_date(d) for d in dates_str]
-    # add these keys to the boulder data
-    for date_str, date_datetime in zip(dates_str, dates_datetime):
-        for id_ in boulders_id:
-            b = yaml_data[date_str].get(id_)
-            if b:
-                b['id'] = id_
-                b['date'] = date_datetime
-
-    boulder_props_use = {
-        'attribute': (
-            ('id', str),
-            ('addedAt', ejson_date_to_datetime),
-            ('boulderNum', int),
-            ('closedAt', ejson_date_to_datetime),
-            ('comment', str),
-            ('createdAt', ejson_date_to_datetime),
-            ('girly', bool),
-            ('grade', int),
-            ('gym', str),
-            ('holdsColor', int),
-            ('label', int),
-            ('picture', models.Picture),
-            ('routeSetter', list),
-            ('routeTypes', list),
-            ('updatedAt', ejson_date_to_datetime),
-            ('zone', int),
-            ),
-        'derived_attributes': ( # properties derived from above processed attributes
-            ('url', ('id', 'gym'), models.get_boulder_page_url),
-            ),
-        'time_series': (
-            ('date', None),
-            ('likesCount', None),
-            ('likesRatio', None),
-            ('sentsCount', None),
-            ),
-        'discard': (
-            'dislikesList',
-            'likesList',
-            'projectsList',
-            'sentsList',
-            ),
-        }
-
-    boulders_df = pd.DataFrame()
-    for b_id in boulders_id:
-        boulder_props = {}
-        for prop, func in boulder_props_use['attribute']:
-            values = _get_all_prop_values(yaml_data, dates_str, b_id, prop)
-            try:
-                value = values[-1]
-                if func:
-                    value = func(value)
-            except:
-                value = None
-            boulder_props[prop] = value
-        for new_prop, src_props, func in boulder_props_use['derived_attributes']:
-            src_props_values = [boulder_props[p] for p in src_props]
-            value = func(*src_props_values)
-            boulder_props[new_prop] = value
-        time_data = {}
-        for prop, func in boulder_props_use['time_series']:
-            time_data[prop] = _get_all_prop_values(yaml_data, dates_str, b_id, prop, func=func)
-        boulder_props['time'] = pd.DataFrame(time_data)
-        boulders_df = boulders_df.append([boulder_props])
-    boulders_df = boulders_df.set_index(boulders_df.id)
+    attr_props = [prop for prop, _ in props_use['attribute']]
+    ts_props = [prop for prop, _ in props_use['time_series']]
+    if long_df.empty:
+        return _build_boulders(None, None, props_use, encoding=encoding)
+    long_df = long_df.reindex(
+        columns=list(dict.fromkeys(['id', 'date'] + attr_props + ts_props)))
+
+    # static attributes: values in the last snapshot of each boulder, as
+    # long_df is sorted by date
+    static_props = [p for p in attr_props if p != 'id']
+    last_values = long_df.drop_duplicates('id', keep='last').set_index(
+        'id')[static_props].sort_index()
+    time_df = long_df[['id'] + ts_props]
+    return _build_boulders(last_values, time_df, props_use, encoding=encoding)
+
+@profiling.profiled('build_boulders')
+def _build_boulders(last_values, time_df, props_use, encoding='samples'):
+    ''' Build reduced boulders from their raw attributes and time series
+
+    Parameters
+    ==========
+    last_values : pandas.DataFrame or None
+        The raw values of the static attributes in the last snapshot of
+        each boulder, indexed by boulder id.
+    time_df : pandas.DataFrame or None
+        The raw time series of all boulders in long format, in any order.
+    props_use : dict
+        Description of the properties to extract.
+    encoding : str (default: 'samples')
+        Encoding of the time series, one of timeseries.ENCODINGS. Unless it
+        is 'samples', the dates of the samples of each gym are kept in the
+        'dates' item of the attrs of the returned dataframe, so that the
+        time series can be expanded with timeseries.resample_gyms().
+    '''
+    columns = get_attribute_columns(props_use) + ['time']
+    if last_values is None or last_values.empty:
+        return pd.DataFrame(columns=columns)
+
+    boulders_df = convert_attributes(last_values, props_use)
+
+    # time series: split the long table into one dataframe per boulder
+    for prop, func in props_use['time_series']:
+        converter = _get_converter(func)
+        if converter is not None:
+            values, failures = converter(time_df[prop])
+            time_df = time_df.assign(**{prop: values})
+            _report_failures(prop, failures)
+    if encoding != 'samples':
+        dates = timeseries.get_gym_dates(time_df, pd.Series(
+            boulders_df.gym.to_numpy(), index=boulders_df.id.to_numpy()))
+    time_df = timeseries.encode(time_df, encoding)
+    # the samples of each boulder are contiguous once sorted by id
+    time_df = time_df.sort_values(['id', 'date'], kind='mergesort')
+    ids = time_df.id.to_numpy()
+    starts = np.flatnonzero(np.concatenate([[True], ids[1:] != ids[:-1]]))
+    stops = np.append(starts[1:], len(ids))
+    time_df = time_df.drop(columns='id')
+    time = {ids[start]: time_df.iloc[start:stop].reset_index(drop=True)
+            for start, stop in zip(starts, stops)}
+    del time_df
+    boulders_df['time'] = timeseries.frames_column(
+        [time[b_id] for b_id in boulders_df.index])
+
+    boulders_df = boulders_df.set_index(boulders_df.id)[columns]
+    if encoding != 'samples':
+        boulders_df.attrs['dates'] = dates
     return boulders_df
 
+class StreamingReducer():
+    ''' Reduce snapshots one at a time, with a bounded memory use
+
+    Only the attributes of the last snapshot of each boulder are kept in
+    memory. Time series samples are buffered, and flushed to temporary
+    files on disk when the buffer holds more than chunk_rows samples.
+
+    This bounds the memory used while snapshots are added. result() then
+    loads all the samples back to build the time series of each boulder,
+    and needs a few times the memory of its output.
+
+    Parameters
+    ==========
+    props_use : dict (default: BOULDER_PROPS_USE)
+        Description of the properties to extract.
+    chunk_rows : int (default: 1000000)
+        Maximum number of time series samples kept in memory.
+    tmp_dir : str or None (default: None)
+        Directory in which temporary files are created.
+    encoding : str (default: 'samples')
+        Encoding of the time series, one of timeseries.ENCODINGS.
+    '''
+    def __init__(self, props_use=BOULDER_PROPS_USE, chunk_rows=1000000,
+                 tmp_dir=None, encoding='samples'):
+        self.props_use = props_use
+        self.encoding = encoding
+        self.chunk_rows = chunk_rows
+        self.static_props = [p for p, _ in props_use['attribute'] if p != 'id']
+        self.ts_props = [p for p, _ in props_use['time_series']]
+        self.attributes = {}
+        # the buffered samples share a single copy of each id
+        self._ids = {}
+        self._dates = set()
+        self._rows = []
+        self._chunks = []
+        self._tmp_dir = tempfile.TemporaryDirectory(dir=tmp_dir)
+
+    def add_snapshot(self, date_str, boulders):
+        if date_str in self._dates:
+            warnings.warn('ignoring duplicate date in yaml_data')
+            return
+        self._dates.add(date_str)
+        date = parse_date(date_str)
+        for b_id, b in boulders.items():
+            b_id = self._ids.setdefault(b_id, b_id)
+            # snapshots may be added out of date order
+            previous_date, _ = self.attributes.get(b_id, (None, None))
+            if previous_date is None or date >= previous_date:
+                self.attributes[b_id] = (
+                    date, [b.get(prop) for prop in self.static_props])
+            row = [b_id]
+            for prop in self.ts_props:
+                row.append(date if prop == 'date' else b.get(prop))
+            self._rows.append(row)
+        if len(self._rows) >= self.chunk_rows:
+            self._flush()
+
+    def add_file(self, filename, after=None):
+        ''' Add the snapshots of a file, or those dated after a date '''
+        for date_str, boulders in snapshots.read_snapshots(filename):
+            if after is not None and parse_date(date_str) <= after:
+                continue
+            self.add_snapshot(date_str, boulders)
+
+    def _rows_to_dataframe(self, rows):
+        return pd.DataFrame(rows, columns=['id'] + self.ts_props)
+
+    def _flush(self):
+        if not self._rows:
+            return
+        fn = os.path.join(self._tmp_dir.name,
+                          'chunk-{:06d}.pkl'.format(len(self._chunks)))
+        self._rows_to_dataframe(self._rows).to_pickle(fn)
+        self._chunks.append(fn)
+        self._rows = []
+
+    def result(self):
+        ''' Get the reduced boulders, and remove the temporary files '''
+        try:
+            frames = [pd.read_pickle(fn) for fn in self._chunks]
+            if self._rows or not frames:
+                frames.append(self._rows_to_dataframe(self._rows))
+            self._rows = []
+            time_df = pd.concat(frames, ignore_index=True).infer_objects()
+            del frames
+            last_values = pd.DataFrame.from_dict(
+                {b_id: values for b_id, (_, values) in self.attributes.items()},
+                orient='index', columns=self.static_props)
+            last_values = last_values.sort_index()
+            return _build_boulders(last_values, time_df, self.props_use,
+                                   encoding=self.encoding)
+        finally:
+            self._rows = []
+            self._tmp_dir.cleanup()
+
+@profiling.profiled()
+def stream_reduce(snapshot_files, max_memory=256, tmp_dir=None,
+                  encoding='samples', after=None):
+    ''' Reduce snapshot files one snapshot at a time
+
+    This is equivalent to boulders_yaml_to_dataframe(), but never holds more
+    than one file and max_memory MB of buffered samples in memory while the
+    files are read. Building the output then takes a few times its memory,
+    see StreamingReducer.
+
+    Parameters
+    ==========
+    snapshot_files : list of str
+        A list of snapshot filenames written by scrape_boulders.py, in date
+        order.
+    max_memory : float (default: 256)
+        Approximate memory used by buffered time series samples, in MB.
+    tmp_dir : str or None (default: None)
+        Directory in which temporary files are created.
+    encoding : str (default: 'samples')
+        Encoding of the time series, one of timeseries.ENCODINGS.
+    after : datetime.datetime or None (default: None)
+        If not None, only reduce the snapshots dated after this date.
+
+    Returns
+    =======
+    boulders_df : pandas.DataFrame
+        A dataframe containing all the boulders properties, including time
+        resolved values of sentsCount, likesCount, and likesRatio.
+    '''
+    chunk_rows = max(1, int(max_memory * 2**20 / _BUFFERED_ROW_SIZE))
+    reducer = StreamingReducer(chunk_rows=chunk_rows, tmp_dir=tmp_dir,
+                               encoding=encoding)
+    for fn in tqdm.tqdm(snapshot_files, desc='Reducing snapshots'):
+        reducer.add_file(fn, after=after)
+    return reducer.result()
+
+def boulders_snapshots_to_dataframe(yaml_data, props_use=BOULDER_PROPS_USE,
+                                    encoding='samples'):
+    ''' Convert snapshots loaded from scrape_boulders.py to a dataframe
+
+    Parameters
+    ==========
+    yaml_data : dict
+        Data loaded from yaml files written by scrape_boulders.py.
+    props_use : dict (default: BOULDER_PROPS_USE)
+        Description of the properties to extract.
+    encoding : str (default: 'samples')
+        Encoding of the time series, one of timeseries.ENCODINGS.
+
+    Returns
+    =======
+    boulders_df : pandas.DataFrame
+        A dataframe containing all the boulders properties, including time
+        resolved values of sentsCount, likesCount, and likesRatio.
+    '''
+    long_df = snapshots_to_long_dataframe(
+        yaml_data, discard=props_use['discard'])
+    return long_dataframe_to_boulders(
+        long_df, props_use=props_use, encoding=encoding)
+
+def boulders_yaml_to_dataframe(yaml_files, jobs=1, cache=None,
+                               encoding='samples', after=None):
+    ''' Convert snapshot files from scrape_boulders.py to a single dataframe
+
+    Parameters
+    ==========
+    yaml_files : list of str
+        A list of snapshot filenames written by scrape_boulders.py, in any
+        format supported by the snapshots module.
+    jobs : int (default: 1)
+        Number of processes used to parse the files.
+    cache : cache.SnapshotCache or None (default: None)
+        Cache of parsed files.
+    encoding : str (default: 'samples')
+        Encoding of the time series, one of timeseries.ENCODINGS.
+    after : datetime.datetime or None (default: None)
+        If not None, only reduce the snapshots dated after this date.
+
+    Returns
+    =======
+    boulders_df : pandas.DataFrame
+        A dataframe containing all the boulders properties, including time
+        resolved values of sentsCount, likesCount, and likesRatio.
+    '''
+    records = load_snapshot_records(
+        yaml_files, discard=BOULDER_PROPS_USE['discard'], jobs=jobs,
+        cache=cache, after=after)
+    long_df = records_to_long_dataframe(records)
+    return long_dataframe_to_boulders(long_df, encoding=encoding)
+
+def get_sample_dates(boulders):
+    ''' Get the dates of the snapshots from which boulders were reduced
+
+    These are kept in boulders.attrs when the time series are not encoded
+    as 'samples', and are the dates of the samples otherwise.
+
+    Returns
+    =======
+    dates : dict
+        Mapping between gyms and the sorted list of their snapshot dates.
+    '''
+    dates = boulders.attrs.get('dates')
+    if isinstance(dates, dict):
+        return {gym: list(d) for gym, d in dates.items()}
+    if dates is not None:
+        # reduced by earlier versions, with one grid for all gyms
+        return {gym: list(dates) for gym in boulders.gym.unique()}
+    dates = {}
+    for gym, time in zip(boulders.gym, boulders.time):
+        dates.setdefault(gym, set()).update(time.date)
+    return {gym: sorted(d) for gym, d in dates.items()}
+
+def get_watermarks(boulders):
+    ''' Get the date of the latest sample of each gym
+
+    Returns
+    =======
+    watermarks : dict
+        Mapping between gyms and the date of their latest sample. Gyms
+        without samples are not included.
+    '''
+    if 'dates' in boulders.attrs:
+        return {gym: max(d) for gym, d in get_sample_dates(boulders).items()
+                if len(d)}
+    watermarks = {}
+    for gym, time in zip(boulders.gym, boulders.time):
+        # time series are sorted by date
+        if len(time) and (gym not in watermarks
+                          or time.date.iat[-1] > watermarks[gym]):
+            watermarks[gym] = time.date.iat[-1]
+    return watermarks
+
+@profiling.profiled()
 def update_boulders(boulders, new_boulders):
+    ''' Merge newly reduced boulders into previously reduced boulders
+
+    The attributes of the boulders are replaced by their new values, and
+    the new samples are appended to their time series. The samples of a gym
+    that are not more recent than its latest previous sample were already
+    reduced, and are dropped: gyms are scraped independently, so new
+    boulders may be reduced from snapshots listed after the watermark of
+    the gym that lags the most. The cost only depends on the number of new
+    boulders, and on the size of their time series.
+
+    Parameters
+    ==========
+    boulders : pandas.DataFrame or None
+        Previously reduced boulders.
+    new_boulders : pandas.DataFrame
+        Boulders reduced from newer snapshots.
+    '''
     if boulders is None:
         return new_boulders  # nothing to update
-    for b_id, b in new_boulders.iterrows():
-        if b_id not in boulders.index:
-            boulders = boulders.append(b)
-        else:
-            old_b = boulders.loc[b_id]
-            time = pd.concat([old_b.time, b.time])
-            b.time = time
-            boulders.loc[b_id] = b
+    previous_boulders = conversion.upgrade_attributes(boulders)
+    watermarks = get_watermarks(previous_boulders)
+    new_time = {}
+    for b_id, gym, time in zip(new_boulders.index, new_boulders.gym,
+                               new_boulders.time):
+        if gym in watermarks:
+            time = time[time.date > watermarks[gym]].reset_index(drop=True)
+        if len(time) or b_id not in previous_boulders.index:
+            new_time[b_id] = time
+    new_boulders = new_boulders.loc[list(new_time)]
+    ids = previous_boulders.index.append(new_boulders.index.difference(
+        previous_boulders.index, sort=False))
+    columns = list(dict.fromkeys(
+        list(previous_boulders.columns) + list(new_boulders.columns)))
+    attributes = pd.concat([previous_boulders.drop(columns='time'),
+                            new_boulders.drop(columns='time')])
+    attributes = attributes[~attributes.index.duplicated(keep='last')]
+    time = dict(zip(previous_boulders.index, previous_boulders.time))
+    for b_id, t in new_time.items():
+        if b_id in time:
+            t = pd.concat([time[b_id], t], ignore_index=True)
+        time[b_id] = t
+    boulders = attributes.reindex(ids)
+    boulders['time'] = timeseries.frames_column([time[b_id] for b_id in ids])
+    boulders = boulders[columns]
+    if 'dates' in previous_boulders.attrs or 'dates' in new_boulders.attrs:
+        dates = get_sample_dates(previous_boulders)
+        for gym, new_dates in get_sample_dates(new_boulders).items():
+            dates[gym] = sorted(set(dates.get(gym, [])) | set(new_dates))
+        boulders.attrs['dates'] = dates
     return boulders
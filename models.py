@@ -2,42 +2,231 @@
 
 import warnings
 
+import numpy as np
+import pandas as pd
+
+# columns holding the fields of pictures, as stored with reduced boulders:
+# column -> (path in the ejson picture, dtype)
+PICTURE_COLUMNS = {
+    'pictureId': (('id',), object),
+    'pictureRatio': (('ratio',), np.float32),
+    'pictureWidth': (('width',), np.float32),
+    'pictureZoom': (('zoom',), object),
+    'pictureCropX': (('crop', 'x'), np.float32),
+    'pictureCropY': (('crop', 'y'), np.float32),
+    'pictureCropWidth': (('crop', 'width'), np.float32),
+    'pictureCropHeight': (('crop', 'height'), np.float32),
+    }
+
 class PictureCrop():
+    __slots__ = ('x', 'y', 'width', 'height', 'ejson_crop')
+
     def __init__(self, ejson_crop):
-        ejson_crop = ejson_crop.copy()
-        self.x = ejson_crop.pop('x')
-        self.y = ejson_crop.pop('y')
-        self.width = ejson_crop.pop('width')
-        self.height = ejson_crop.pop('height')
-        if ejson_crop:
+        self.x = ejson_crop['x']
+        self.y = ejson_crop['y']
+        self.width = ejson_crop['width']
+        self.height = ejson_crop['height']
+        if len(ejson_crop) > 4:
             warnings.warn('unparsed ejson_crop attributes')
-            self.ejson_crop = ejson_crop
+            self.ejson_crop = {k: v for k, v in ejson_crop.items()
+                               if k not in ('x', 'y', 'width', 'height')}
+
+    def to_ejson(self):
+        return {'x': self.x, 'y': self.y,
+                'width': self.width, 'height': self.height}
+
+    def __reduce__(self):
+        return (PictureCrop, (self.to_ejson(),))
+
+    def __setstate__(self, state):
+        # PictureCrop pickled by earlier versions, which had a __dict__
+        _set_legacy_state(self, state)
 
 class Picture():
+    ''' Picture of a boulder
+
+    The urls are formatted on first access, with the host at that time, and
+    then cached.
+
+    Pictures are pickled as their ejson representation, which does not
+    depend on the layout of this class.
+    '''
+    __slots__ = ('id', 'ratio', 'width', 'zoom_id', 'crop', 'ejson_picture',
+                 '_src', '_url', '_zoom')
+
     host = ''
 
     def __init__(self, ejson_picture):
-        ejson_picture = ejson_picture.copy()
-        self.id = ejson_picture.pop('id')
-        self.ratio = ejson_picture.pop('ratio')
-        self.width = ejson_picture.pop('width')
-        self.zoom_id = ejson_picture.pop('zoom')
-        self.crop = PictureCrop(ejson_picture.pop('crop'))
-        if ejson_picture:
+        self.id = ejson_picture['id']
+        self.ratio = ejson_picture['ratio']
+        self.width = ejson_picture['width']
+        self.zoom_id = ejson_picture['zoom']
+        self.crop = PictureCrop(ejson_picture['crop'])
+        if len(ejson_picture) > 5:
             warnings.warn('unparsed ejson_picture attributes')
-            self.ejson_picture = ejson_picture
+            self.ejson_picture = {
+                k: v for k, v in ejson_picture.items()
+                if k not in ('id', 'ratio', 'width', 'zoom', 'crop')}
+        self._src = None
+        self._url = None
+        self._zoom = None
+
+    def to_ejson(self):
+        return {'id': self.id, 'ratio': self.ratio, 'width': self.width,
+                'zoom': self.zoom_id, 'crop': self.crop.to_ejson()}
+
+    def __reduce__(self):
+        return (Picture, (self.to_ejson(),))
+
+    def __setstate__(self, state):
+        # Picture pickled by earlier versions, which had a __dict__
+        _set_legacy_state(self, state)
+        self._src = None
+        self._url = None
+        self._zoom = None
 
     @property
     def src(self):
-        return '{self.host}/800/bouldersPics/{self.id}.jpg'.format(**locals())
+        if self._src is None:
+            self._src = '{}/800/bouldersPics/{}.jpg'.format(self.host, self.id)
+        return self._src
 
     @property
     def url(self):
-        return '{self.host}/bouldersPics/{self.id}.jpg'.format(**locals())
+        if self._url is None:
+            self._url = '{}/bouldersPics/{}.jpg'.format(self.host, self.id)
+        return self._url
 
     @property
     def zoom(self):
-        return '{self.host}/bouldersZooms/{self.zoom_id}.jpg'.format(**locals())
+        if self._zoom is None:
+            self._zoom = get_picture_zoom_url(self.zoom_id)
+        return self._zoom
+
+def _set_legacy_state(obj, state):
+    if isinstance(state, tuple):
+        state = {**(state[0] or {}), **(state[1] or {})}
+    for key, value in state.items():
+        setattr(obj, key, value)
+
+class Pictures():
+    ''' Column of pictures, stored as one array per field
+
+    This is the bulk equivalent of a list of Picture: the pictures of all
+    boulders are built at once, and Picture objects are only created when
+    items are accessed.
+
+    Parameters
+    ==========
+    columns : dict
+        Mapping between the columns PICTURE_COLUMNS and arrays of their
+        values, with None or NaN for missing pictures or fields.
+    '''
+    __slots__ = ('columns', '_src', '_url', '_zoom')
+
+    def __init__(self, columns):
+        self.columns = {
+            column: np.asarray(columns[column], dtype=dtype)
+            for column, (_, dtype) in PICTURE_COLUMNS.items()}
+        self._src = None
+        self._url = None
+        self._zoom = None
+
+    @classmethod
+    def from_ejson(cls, ejson_pictures):
+        ''' Build pictures from ejson pictures, Picture objects, or None '''
+        pictures = [p.to_ejson() if isinstance(p, Picture) else p
+                    for p in ejson_pictures]
+        valid = [isinstance(p, dict) for p in pictures]
+        columns = {}
+        for column, ((key, *subkeys), dtype) in PICTURE_COLUMNS.items():
+            fields = [p.get(key) if is_valid else None
+                      for p, is_valid in zip(pictures, valid)]
+            for subkey in subkeys:
+                fields = [f.get(subkey) if isinstance(f, dict) else None
+                          for f in fields]
+            if dtype is not object:
+                fields = pd.to_numeric(
+                    pd.Series(fields, dtype=object), errors='coerce')
+            columns[column] = fields
+        return cls(columns)
+
+    @classmethod
+    def from_frame(cls, frame):
+        ''' Build pictures from the columns of reduced boulders '''
+        return cls({column: frame[column].to_numpy()
+                    for column in PICTURE_COLUMNS})
+
+    def __len__(self):
+        return len(self.columns['pictureId'])
+
+    def __getitem__(self, i):
+        ''' Get a Picture, or None if the picture is missing '''
+        ejson_picture = self._to_ejson(i)
+        if ejson_picture is None:
+            return None
+        return Picture(ejson_picture)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def _to_ejson(self, i):
+        if pd.isna(self.columns['pictureId'][i]):
+            return None
+        picture = {}
+        for column, (path, dtype) in PICTURE_COLUMNS.items():
+            value = self.columns[column][i]
+            if dtype is not object:
+                value = None if np.isnan(value) else value.item()
+            target = picture
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[path[-1]] = value
+        return picture
+
+    def to_ejson(self):
+        ''' Get the list of ejson pictures, eg to serialize them as JSON '''
+        return [self._to_ejson(i) for i in range(len(self))]
+
+    def to_frame(self, index=None):
+        ''' Get the columns of the pictures, as stored with reduced boulders '''
+        return pd.DataFrame(self.columns, index=index)
+
+    @property
+    def src(self):
+        if self._src is None:
+            self._src = _format_urls(
+                Picture.host + '/800/bouldersPics/',
+                self.columns['pictureId'])
+        return self._src
+
+    @property
+    def url(self):
+        if self._url is None:
+            self._url = _format_urls(
+                Picture.host + '/bouldersPics/', self.columns['pictureId'])
+        return self._url
+
+    @property
+    def zoom(self):
+        if self._zoom is None:
+            self._zoom = get_picture_zoom_urls(self.columns['pictureZoom'])
+        return self._zoom
+
+def get_picture_zoom_url(zoom_id):
+    return '{}/bouldersZooms/{}.jpg'.format(Picture.host, zoom_id)
+
+def _format_urls(prefix, ids, suffix='.jpg'):
+    ''' Format the urls prefix + id + suffix, or None for missing ids '''
+    ids = np.asarray(ids, dtype=object)
+    present = np.array([isinstance(v, str) for v in ids], dtype=bool)
+    urls = np.full(len(ids), None, dtype=object)
+    urls[present] = prefix + ids[present] + suffix
+    return urls
+
+def get_picture_zoom_urls(zoom_ids):
+    ''' Get the zoom urls of pictures, or None for missing zoom ids '''
+    return _format_urls(Picture.host + '/bouldersZooms/', zoom_ids)
 
 class BoulderPage():
     host = ''
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+import atexit
+import collections
+import cProfile
+import datetime
+import functools
+import json
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+
+# number of functions listed in the cProfile section of reports
+CPROFILE_TOP = 30
+
+class _NullSpan():
+    ''' Span used when profiling is disabled '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span():
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler._enter(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._exit()
+        return False
+
+def _to_json(value):
+    ''' Convert numpy scalars, eg counts, to python numbers '''
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError('{} is not JSON serializable'.format(type(value)))
+
+class Profiler():
+    ''' Record the time and peak memory of named spans, and counters
+
+    Spans are nested: a span entered while another one is open is named
+    '<parent>/<name>'. Spans with the same name are aggregated, so that a
+    span entered in a loop reports its number of calls and total time.
+
+    Spans are meant to be entered by a single thread.
+
+    Parameters
+    ==========
+    memory : bool (default: True)
+        If True, trace memory allocations with tracemalloc, and record the
+        peak memory of each span. This slows down allocations.
+    cprofile : bool (default: False)
+        If True, also run cProfile.
+    '''
+    def __init__(self, memory=True, cprofile=False):
+        self.memory = memory
+        self.spans = {}
+        self.counters = collections.Counter()
+        self._stack = []
+        self._cprofile = cProfile.Profile() if cprofile else None
+        self._started_at = None
+        self._start = None
+        self._peak = 0
+
+    def start(self):
+        self._started_at = datetime.datetime.now()
+        self._start = time.perf_counter()
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self._cprofile is not None:
+            self._cprofile.enable()
+
+    def stop(self):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        if self.memory and tracemalloc.is_tracing():
+            self._update_peak()
+            tracemalloc.stop()
+        self._stack = []
+
+    def span(self, name):
+        ''' Context manager recording a span '''
+        return _Span(self, name)
+
+    def _path(self, name):
+        if self._stack:
+            return self._stack[-1][0] + '/' + name
+        return name
+
+    def _update_peak(self):
+        ''' Attribute the peak memory since the last reset to open spans '''
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        self._peak = max(self._peak, peak)
+        if self._stack:
+            self._stack[-1][2] = max(self._stack[-1][2], peak)
+        return peak
+
+    def _enter(self, name):
+        if self.memory and tracemalloc.is_tracing():
+            self._update_peak()
+        self._stack.append([self._path(name), time.perf_counter(), 0])
+
+    def _exit(self):
+        if self.memory and tracemalloc.is_tracing():
+            self._update_peak()
+        path, start, peak = self._stack.pop()
+        if self._stack:
+            self._stack[-1][2] = max(self._stack[-1][2], peak)
+        self._record(path, time.perf_counter() - start, peak)
+
+    def _record(self, path, elapsed, peak=None):
+        span = self.spans.setdefault(
+            path, {'count': 0, 'time': 0., 'peak_memory': None})
+        span['count'] += 1
+        span['time'] += elapsed
+        if peak is not None and self.memory:
+            span['peak_memory'] = max(span['peak_memory'] or 0, peak)
+
+    def add_span(self, name, elapsed):
+        ''' Record a span measured elsewhere, eg between two callbacks '''
+        self._record(self._path(name), elapsed)
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def report(self):
+        ''' Get the report of the profiled run, as a JSON-serializable dict '''
+        report = {
+            'argv': sys.argv,
+            'started_at': (self._started_at.isoformat()
+                           if self._started_at is not None else None),
+            'duration': (time.perf_counter() - self._start
+                         if self._start is not None else None),
+            'peak_memory': self._peak if self.memory else None,
+            'spans': [dict(name=name, **span)
+                      for name, span in self.spans.items()],
+            'counters': dict(self.counters),
+            }
+        if self._cprofile is not None:
+            stats = pstats.Stats(self._cprofile)
+            functions = sorted(
+                stats.stats.items(), key=lambda item: item[1][3],
+                reverse=True)[:CPROFILE_TOP]
+            report['cprofile'] = [
+                {'function': '{}:{}({})'.format(*func),
+                 'calls': calls,
+                 'total_time': total_time,
+                 'cumulative_time': cumulative_time}
+                for func, (_, calls, total_time, cumulative_time, _)
+                in functions]
+        return report
+
+    def write(self, filename):
+        ''' Write the report to a JSON file
+
+        With cProfile, the full statistics are also dumped next to it, with
+        the .prof extension, eg for snakeviz or pstats.
+        '''
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2, default=_to_json)
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(os.path.splitext(filename)[0] + '.prof')
+
+# profiler of the running program, if profiling is enabled
+_profiler = None
+_report_filename = None
+
+def start(filename=None, memory=True, cprofile=False):
+    ''' Enable profiling
+
+    Parameters
+    ==========
+    filename : str or None (default: None)
+        If not None, the JSON report is written to this file by stop(), or
+        when the program exits.
+    memory, cprofile : bool
+        See Profiler.
+    '''
+    global _profiler, _report_filename
+    _profiler = Profiler(memory=memory, cprofile=cprofile)
+    _report_filename = filename
+    _profiler.start()
+    atexit.register(stop)
+    return _profiler
+
+def stop():
+    ''' Disable profiling, and write the report if a filename was given '''
+    global _profiler, _report_filename
+    atexit.unregister(stop)
+    profiler = _profiler
+    if profiler is None:
+        return None
+    _profiler = None
+    profiler.stop()
+    if _report_filename is not None:
+        profiler.write(_report_filename)
+        print('Profile written to:', _report_filename)
+    return profiler
+
+def is_enabled():
+    return _profiler is not None
+
+def span(name):
+    ''' Context manager recording a span, if profiling is enabled
+
+    For instance:
+
+        with profiling.span('load'):
+            boulders = pd.read_pickle(filename)
+    '''
+    if _profiler is None:
+        return _NULL_SPAN
+    return _profiler.span(name)
+
+def profiled(name=None):
+    ''' Decorator recording each call of a function as a span
+
+    The span is named after the function unless a name is given.
+    '''
+    def decorator(func):
+        span_name = name if name is not None else func.__name__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def add_span(name, elapsed):
+    if _profiler is not None:
+        _profiler.add_span(name, elapsed)
+
+def count(name, value=1):
+    if _profiler is not None:
+        _profiler.count(name, value)
+
+def add_arguments(parser):
+    ''' Add the profiling options to an argparse.ArgumentParser '''
+    parser.add_argument(
+        '--profile',
+        type=str,
+        metavar='REPORT',
+        help=('write the time and peak memory of each stage, and other '
+              'counters, to this JSON file'))
+    parser.add_argument(
+        '--cprofile',
+        action='store_true',
+        help=('with --profile, also run cProfile, list the slowest functions '
+              'in the report, and dump the full statistics next to it with '
+              'the .prof extension'))
+
+def start_from_args(args):
+    ''' Start profiling if it was requested on the command line '''
+    if args.profile is not None:
+        return start(args.profile, cprofile=args.cprofile)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pandas as pd
+
+# columns with an equality index
+INDEXED_COLUMNS = ['gym', 'holdsColor', 'grade', 'zone']
+
+# columns with an interval index
+INTERVAL_COLUMNS = ['addedAt', 'closedAt']
+
+# closing date of the boulders that are not closed
+_NEVER = np.datetime64('2262-01-01', 'ns')
+
+class BoulderIndex():
+    ''' Indexes on the attributes of reduced boulders
+
+    Each column of INDEXED_COLUMNS has an equality index, mapping each of
+    its values to the positions of the boulders with that value. The
+    boulders are also sorted by addedAt and closedAt, so that the boulders
+    added or closed in a date range, or open at a date, are found by binary
+    search.
+
+    A query starts from the positions matching its most selective
+    criterion, and only checks the other criteria on these positions.
+
+    Parameters
+    ==========
+    attributes : pandas.DataFrame
+        Attributes of the boulders, with an 'id' column or indexed by id,
+        and the columns INDEXED_COLUMNS and INTERVAL_COLUMNS.
+    '''
+    def __init__(self, attributes):
+        if 'id' in attributes:
+            ids = attributes.id
+        else:
+            ids = attributes.index
+        self.ids = np.asarray(ids, dtype=object)
+        self.codes = {}
+        self.uniques = {}
+        self.positions = {}
+        for column in INDEXED_COLUMNS:
+            codes, uniques = pd.factorize(attributes[column])
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+            self.codes[column] = codes
+            self.uniques[column] = {v: i for i, v in enumerate(uniques)}
+            self.positions[column] = [
+                order[bounds[i]:bounds[i + 1]] for i in range(len(uniques))]
+        self.dates = {}
+        self.sorted_dates = {}
+        self.date_order = {}
+        for column in INTERVAL_COLUMNS:
+            dates = pd.to_datetime(attributes[column]).to_numpy(
+                dtype='datetime64[ns]')
+            if column == 'closedAt':
+                dates = np.where(np.isnat(dates), _NEVER, dates)
+            order = np.argsort(dates, kind='stable')
+            self.dates[column] = dates
+            self.date_order[column] = order
+            self.sorted_dates[column] = dates[order]
+
+    @classmethod
+    def from_store(cls, boulder_store, gyms=None):
+        ''' Build the indexes of a store.BoulderStore
+
+        Only the indexed columns of the attributes are read.
+        '''
+        attributes = boulder_store.read_attributes(
+            columns=INDEXED_COLUMNS + INTERVAL_COLUMNS, gyms=gyms)
+        return cls(attributes)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def gyms(self):
+        return sorted(self.uniques['gym'])
+
+    def _equal(self, column, codes):
+        ''' Positions of the boulders whose column has one of codes '''
+        if not len(codes):
+            return np.array([], dtype=np.int64)
+        return np.concatenate([self.positions[column][c] for c in codes])
+
+    def _get_codes(self, column, values):
+        return np.array([self.uniques[column][v] for v in values
+                         if v in self.uniques[column]], dtype=np.int64)
+
+    def _date_bounds(self, column, start=None, end=None):
+        ''' Bounds in the sorted dates such that start <= column <= end '''
+        sorted_dates = self.sorted_dates[column]
+        i = 0
+        j = len(sorted_dates)
+        if start is not None:
+            i = np.searchsorted(sorted_dates, start, side='left')
+        if end is not None:
+            j = np.searchsorted(sorted_dates, end, side='right')
+        return i, max(i, j)
+
+    def query(self, gym=None, holdsColor=None, grade=None, zone=None,
+              open_at=None, added=None, closed=None):
+        ''' Find the boulders matching all the given criteria
+
+        Parameters
+        ==========
+        gym, holdsColor, grade, zone : value, list of values, or None
+            If not None, select the boulders whose column is equal to the
+            value, or to any of the values of a list.
+        open_at : datetime.datetime or None (default: None)
+            If not None, select the boulders such that
+            addedAt <= open_at < closedAt. Boulders without closedAt are
+            open.
+        added, closed : tuple of datetime.datetime or None (default: None)
+            If not None, select the boulders added, or closed, between two
+            dates (included). Either date can be None.
+
+        Returns
+        =======
+        ids : numpy.ndarray
+            The ids of the matching boulders, in index order.
+        '''
+        # equality criteria: column -> codes
+        equal = {}
+        for column, values in zip(INDEXED_COLUMNS,
+                                  (gym, holdsColor, grade, zone)):
+            if values is None:
+                continue
+            if not isinstance(values, (list, tuple, set, np.ndarray)):
+                values = [values]
+            equal[column] = self._get_codes(column, values)
+        # date criteria: column -> (start, end), both included
+        ranges = []
+        for column, bounds in (('addedAt', added), ('closedAt', closed)):
+            if bounds is not None:
+                ranges.append((column, *(
+                    None if d is None else np.datetime64(pd.Timestamp(d), 'ns')
+                    for d in bounds)))
+        if open_at is not None:
+            open_at = np.datetime64(pd.Timestamp(open_at), 'ns')
+            ranges.append(('addedAt', None, open_at))
+            ranges.append(('closedAt', open_at + np.timedelta64(1, 'ns'),
+                           None))
+
+        # start from the smallest set of candidates
+        candidates = [(len(self.ids), None)]
+        for column, codes in equal.items():
+            size = sum(len(self.positions[column][c]) for c in codes)
+            candidates.append((size, ('equal', column)))
+        for i, (column, start, end) in enumerate(ranges):
+            lo, hi = self._date_bounds(column, start, end)
+            candidates.append((hi - lo, ('range', i)))
+        _, best = min(candidates, key=lambda c: c[0])
+        if best is None:
+            positions = np.arange(len(self.ids))
+        elif best[0] == 'equal':
+            positions = self._equal(best[1], equal.pop(best[1]))
+        else:
+            column, start, end = ranges.pop(best[1])
+            lo, hi = self._date_bounds(column, start, end)
+            positions = self.date_order[column][lo:hi]
+
+        # check the other criteria on the candidates
+        mask = np.ones(len(positions), dtype=bool)
+        for column, codes in equal.items():
+            mask &= np.isin(self.codes[column][positions], codes)
+        for column, start, end in ranges:
+            dates = self.dates[column][positions]
+            if start is not None:
+                mask &= dates >= start
+            if end is not None:
+                mask &= dates <= end
+        return self.ids[np.sort(positions[mask])]
+
+    def get_gyms(self, ids):
+        ''' Get the gyms of boulders, eg to prune the partitions to read '''
+        positions = pd.Index(self.ids).get_indexer(ids)
+        gyms = list(self.uniques['gym'])
+        return sorted({gyms[c] for c in self.codes['gym'][positions]
+                       if c >= 0})
@@ -4,15 +4,18 @@ import datetime
 import glob
 import os
 import pickle
-import re
 import sys
 import warnings
 
-from dateutil.parser import parse as parse_date
-import numpy as np
 import pandas as pd
 
+import cache
 import manage_data
+import profiling
+import rollup
+import snapshots
+import store
+import timeseries
 
 def get_previous_reduced_file(output_dir):
     try:
@@ -29,21 +32,39 @@ def get_previous_reduced_file(output_dir):
     return latest_reduced_file
 
 
-def list_files_to_reduce(input_dir, previous_boulders):
-    input_files = sorted(glob.glob(os.path.join(input_dir, '*.yml')))
-
+def get_latest_reduced_date(previous_boulders):
     if previous_boulders is None:
-        return input_files
+        return None
+    if 'dates' in previous_boulders.attrs:
+        dates = manage_data.get_sample_dates(previous_boulders).values()
+        return max(max(d) for d in dates if d)
+    # time series are sorted by date
+    return max([t.date.iat[-1] for t in previous_boulders.time if len(t)])
+
+
+def get_reduced_watermark(watermarks):
+    ''' Get the date after which snapshots are reduced
+
+    Gyms are scraped independently, so the watermark of the gym that lags
+    the most is used. The samples of other gyms that were already reduced
+    are dropped when the new boulders are merged.
 
-    latest_reduced_date = max([t.date.max() for t in previous_boulders.time])
+    Parameters
+    ==========
+    watermarks : dict
+        Mapping between gyms and the date of their latest reduced sample.
+    '''
+    if not watermarks:
+        return None
+    return min(watermarks.values())
 
-    input_files = np.array(input_files)
-    date_in_filename_re = re.compile('\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{6}')
-    input_files_dates = [parse_date(date_in_filename_re.findall(fn)[0])
-                         for fn in input_files]
-    input_files_dates = np.array(input_files_dates)
-    input_files_to_reduce = input_files[input_files_dates > latest_reduced_date]
-    return list(input_files_to_reduce)
+
+def list_files_to_reduce(input_dir, latest_reduced_date):
+    manifest = snapshots.SnapshotManifest(input_dir)
+    if not manifest.exists():
+        warnings.warn('found no snapshot manifest, building it')
+        manifest.rebuild()
+    return manifest.list_files(after=latest_reduced_date)
 
 
 class Output():
@@ -72,34 +93,166 @@ if __name__ == '__main__':
     parser.add_argument(
         'input_dir',
         type=str,
-        help='directory containing scrape_boulder.py yaml outputs')
+        help='directory containing scrape_boulder.py outputs')
     parser.add_argument(
         'output_dir',
         type=str,
         help='directory where results are saved')
+    parser.add_argument(
+        '--format',
+        type=str,
+        choices=['pickle', 'parquet'],
+        default='pickle',
+        help=('format of the reduced data: a pickled dataframe, or a '
+              'columnar parquet store (default: pickle)'))
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help=('only append new samples and changed boulders to the parquet '
+              'store; implies --format parquet'))
+    parser.add_argument(
+        '--compact-every',
+        type=int,
+        default=24,
+        help=('with --incremental, compact the parquet store when it holds '
+              'more than this number of delta segments (default: 24)'))
+    parser.add_argument(
+        '--jobs', '-j',
+        type=int,
+        default=1,
+        help='number of processes used to parse input files (default: 1)')
+    parser.add_argument(
+        '--cache-dir',
+        type=str,
+        help=('directory where parsed input files are cached, so that they '
+              'are not parsed again by later runs'))
+    parser.add_argument(
+        '--cache-size',
+        type=int,
+        default=1024,
+        help='maximum size of the cache, in MB (default: 1024)')
+    parser.add_argument(
+        '--streaming',
+        action='store_true',
+        help=('reduce input files one snapshot at a time, to bound the '
+              'memory use on large archives'))
+    parser.add_argument(
+        '--max-memory',
+        type=float,
+        default=256,
+        help=('with --streaming, approximate memory used to buffer samples '
+              'before they are written to temporary files, in MB '
+              '(default: 256)'))
+    parser.add_argument(
+        '--encoding',
+        type=str,
+        choices=timeseries.ENCODINGS,
+        default='samples',
+        help=('encoding of the time series: keep every sample, or only the '
+              'samples at which a value changes (default: samples)'))
+    parser.add_argument(
+        '--rollups',
+        action='store_true',
+        help=('also update the tables of statistics aggregated by gym, '
+              'color, grade, zone, route setter and time, in '
+              'output_dir/rollups'))
+    parser.add_argument(
+        '--rebuild-manifest',
+        action='store_true',
+        help=('rebuild the manifest of the snapshots of input_dir from the '
+              'files, eg if some were added, removed, or written without '
+              'updating it'))
+    profiling.add_arguments(parser)
     args = parser.parse_args()
+    if args.incremental:
+        args.format = 'parquet'
+    profiling.start_from_args(args)
 
     output = Output(args)
 
-    try:
-        previous_boulders = pd.read_pickle(
-            get_previous_reduced_file(args.output_dir))
-    except FileNotFoundError:
-        previous_boulders = None
-        warnings.warn('found no previously reduced data')
-    except EOFError:
-        previous_boulders = None
-        warnings.warn('invalid previous boulders data')
+    if args.format == 'parquet':
+        boulder_store = store.BoulderStore(args.output_dir)
+        with profiling.span('latest_date'):
+            latest_reduced_date = get_reduced_watermark(
+                boulder_store.watermarks())
+        if latest_reduced_date is None:
+            warnings.warn('found no previously reduced data')
+    else:
+        try:
+            with profiling.span('read_previous'):
+                previous_boulders = pd.read_pickle(
+                    get_previous_reduced_file(args.output_dir))
+        except FileNotFoundError:
+            previous_boulders = None
+            warnings.warn('found no previously reduced data')
+        except EOFError:
+            previous_boulders = None
+            warnings.warn('invalid previous boulders data')
+        with profiling.span('latest_date'):
+            latest_reduced_date = None
+            if previous_boulders is not None:
+                latest_reduced_date = get_reduced_watermark(
+                    manage_data.get_watermarks(previous_boulders))
 
-    files_to_reduce = list_files_to_reduce(args.input_dir, previous_boulders)
+    if args.rebuild_manifest:
+        with profiling.span('rebuild_manifest'):
+            n_snapshots = snapshots.SnapshotManifest(args.input_dir).rebuild()
+        print('Listed {} snapshots in the manifest'.format(n_snapshots))
+    with profiling.span('list_files'):
+        files_to_reduce = list_files_to_reduce(
+            args.input_dir, latest_reduced_date)
+    profiling.count('files_to_reduce', len(files_to_reduce))
     if not files_to_reduce:
         print('No new files to reduce')
         sys.exit(0)
-    new_boulders = manage_data.boulders_yaml_to_dataframe(files_to_reduce)
+    if args.streaming:
+        new_boulders = manage_data.stream_reduce(
+            files_to_reduce, max_memory=args.max_memory,
+            encoding=args.encoding, after=latest_reduced_date)
+    else:
+        snapshot_cache = None
+        if args.cache_dir is not None:
+            snapshot_cache = cache.SnapshotCache(
+                args.cache_dir, max_size=args.cache_size * 2**20)
+        new_boulders = manage_data.boulders_yaml_to_dataframe(
+            files_to_reduce, jobs=args.jobs, cache=snapshot_cache,
+            encoding=args.encoding, after=latest_reduced_date)
+        if snapshot_cache is not None:
+            print('Snapshot', snapshot_cache.stats)
+
+    if args.rollups:
+        rollups = rollup.Rollups(os.path.join(args.output_dir, 'rollups'))
+        with profiling.span('rollups'):
+            n_samples = rollups.update(new_boulders)
+        print('Aggregated {} samples'.format(n_samples))
+
+    if args.incremental:
+        with profiling.span('append'):
+            n_samples = boulder_store.append(
+                new_boulders, encoding=args.encoding)
+        print('Appended {} samples'.format(n_samples))
+        if boulder_store.count_segments() > args.compact_every:
+            print('Compacting store')
+            with profiling.span('compact'):
+                boulder_store.compact()
+        sys.exit(0)
+
+    if args.format == 'parquet':
+        # only load the gyms that are updated
+        previous_boulders = None
+        if latest_reduced_date is not None:
+            with profiling.span('read_previous'):
+                previous_boulders = boulder_store.read_boulders(
+                    gyms=sorted(set(new_boulders.gym.dropna())), expand=True)
+        boulders = manage_data.update_boulders(previous_boulders, new_boulders)
+        with profiling.span('write'):
+            boulder_store.write(boulders, encoding=args.encoding)
+        sys.exit(0)
 
     boulders = manage_data.update_boulders(previous_boulders, new_boulders)
 
-    pd.to_pickle(boulders, output.filename)
+    with profiling.span('write'):
+        pd.to_pickle(boulders, output.filename)
 
     if os.path.exists(output.filename_latest):
         os.unlink(output.filename_latest)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+import os
+
+import numpy as np
+import pandas as pd
+
+import store
+import timeseries
+
+# columns by which the statistics are aggregated, besides the time bucket
+GROUP_COLUMNS = ['gym', 'holdsColor', 'grade', 'zone', 'routeSetter']
+
+# aggregated statistics:
+# - samples: number of scraped samples
+# - boulders: number of distinct boulders scraped
+# - sents, likes: number of new sents and likes
+METRICS = ['samples', 'boulders', 'sents', 'likes']
+
+FREQUENCIES = ['hour', 'day', 'week']
+
+# separator of the route setters of a boulder in the routeSetter column
+ROUTE_SETTER_SEPARATOR = '|'
+
+def get_buckets(dates, freq):
+    ''' Get the start of the time buckets containing dates
+
+    Parameters
+    ==========
+    dates : pandas.Series of datetime
+    freq : str
+        One of FREQUENCIES. Weeks start on Monday.
+    '''
+    if freq == 'hour':
+        return dates.dt.floor('H')
+    if freq == 'day':
+        return dates.dt.floor('D')
+    if freq == 'week':
+        return dates.dt.to_period('W-SUN').dt.start_time
+    raise ValueError('unknown rollup frequency: {}'.format(freq))
+
+class Rollups():
+    ''' Aggregate tables of boulders statistics, updated incrementally
+
+    For each frequency of FREQUENCIES, a table holds the METRICS of the
+    boulders grouped by GROUP_COLUMNS and time bucket. The route setters of
+    a boulder are joined by ROUTE_SETTER_SEPARATOR; when statistics are
+    grouped or selected by route setter, a boulder with several setters is
+    counted for each of them.
+
+    The date and counts of the last sample of each boulder are kept, so
+    that update() only aggregates the new samples, and computes the new
+    sents and likes from the previous sample. The first sample of a boulder
+    only sets the baseline of its counts.
+
+    The tables are stored as parquet files in path:
+
+    - <freq>.parquet, containing the table of each frequency;
+    - state.parquet, containing the last sample of each boulder.
+
+    Parameters
+    ==========
+    path : str
+        Directory of the tables.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._tables = {}
+
+    @property
+    def state_filename(self):
+        return os.path.join(self.path, 'state.parquet')
+
+    def _table_filename(self, freq):
+        return os.path.join(self.path, '{}.parquet'.format(freq))
+
+    def _read_state(self):
+        try:
+            state = pd.read_parquet(self.state_filename)
+        except FileNotFoundError:
+            state = pd.DataFrame(
+                columns=['id', 'date', 'sentsCount', 'likesCount'])
+            state['date'] = pd.to_datetime(state.date)
+        return state.set_index('id')
+
+    def read(self, freq):
+        ''' Read the table of a frequency '''
+        if freq not in self._tables:
+            try:
+                self._tables[freq] = pd.read_parquet(self._table_filename(freq))
+            except FileNotFoundError:
+                self._tables[freq] = pd.DataFrame(
+                    columns=GROUP_COLUMNS + ['bucket'] + METRICS)
+        return self._tables[freq]
+
+    def update(self, boulders):
+        ''' Aggregate the samples of boulders that are not in the tables yet
+
+        Parameters
+        ==========
+        boulders : pandas.DataFrame
+            Reduced boulders, as returned by
+            manage_data.boulders_yaml_to_dataframe().
+
+        Returns
+        =======
+        n_samples : int
+            Number of aggregated samples.
+        '''
+        attributes, time_series = store.split_boulders(boulders)
+        if 'dates' in boulders.attrs:
+            time_series = timeseries.resample_gyms(
+                time_series, attributes.set_index('id').gym,
+                boulders.attrs['dates'])
+        state = self._read_state()
+
+        time_series = time_series.sort_values(['id', 'date'], kind='mergesort')
+        last_date = state.date.reindex(time_series.id).to_numpy()
+        time_series = time_series[
+            pd.isna(last_date) | (time_series.date.to_numpy() > last_date)]
+        if time_series.empty:
+            return 0
+        time_series = time_series.reset_index(drop=True)
+        for column in ('sentsCount', 'likesCount'):
+            time_series[column] = pd.to_numeric(
+                time_series[column], errors='coerce')
+
+        # previous sample of each sample, from the state for the first one
+        previous = time_series.groupby('id')[
+            ['date', 'sentsCount', 'likesCount']].shift()
+        first = previous.date.isna().to_numpy()
+        previous_state = state.reindex(time_series.id[first])
+        dates = previous.date.to_numpy(dtype='datetime64[ns]')
+        dates[first] = previous_state.date.to_numpy(dtype='datetime64[ns]')
+        previous['date'] = dates
+        for column in ('sentsCount', 'likesCount'):
+            values = previous[column].to_numpy(dtype=np.float64)
+            values[first] = pd.to_numeric(
+                previous_state[column]).to_numpy(dtype=np.float64)
+            previous[column] = values
+
+        samples = pd.DataFrame({
+            'id': time_series.id,
+            'samples': 1,
+            'sents': time_series.sentsCount - previous.sentsCount,
+            'likes': time_series.likesCount - previous.likesCount,
+            })
+        for column in ('sents', 'likes'):
+            samples[column] = samples[column].fillna(0).astype(np.int64)
+        groups = attributes.set_index('id')[GROUP_COLUMNS].copy()
+        groups['routeSetter'] = [
+            ROUTE_SETTER_SEPARATOR.join(sorted(map(str, s)))
+            if isinstance(s, (list, tuple, np.ndarray)) and len(s) else None
+            for s in groups.routeSetter]
+        groups = groups.reindex(samples.id).reset_index(drop=True)
+        samples = pd.concat([samples.drop(columns='id'), groups], axis=1)
+
+        os.makedirs(self.path, exist_ok=True)
+        for freq in FREQUENCIES:
+            buckets = get_buckets(time_series.date, freq)
+            previous_buckets = get_buckets(previous.date, freq)
+            freq_samples = samples.assign(
+                bucket=buckets,
+                boulders=(buckets != previous_buckets).astype(np.int64))
+            table = self.read(freq)
+            if len(table):
+                table = pd.concat([table, freq_samples], ignore_index=True)
+            else:
+                table = freq_samples
+            table = table.groupby(
+                GROUP_COLUMNS + ['bucket'], dropna=False, sort=True,
+                )[METRICS].sum().reset_index()
+            store._write_parquet(table, self._table_filename(freq))
+            self._tables[freq] = table
+
+        last = time_series.groupby('id').last()[
+            ['date', 'sentsCount', 'likesCount']]
+        state = pd.concat([state[~state.index.isin(last.index)], last])
+        store._write_parquet(state.rename_axis('id').reset_index(),
+                             self.state_filename)
+        return len(time_series)
+
+    def query(self, freq='day', by=(), where=None, start=None, end=None):
+        ''' Aggregate the statistics of boulders by time bucket
+
+        For instance, the median number of sents per day of blue boulders in
+        the zone 3 is:
+
+            rollups.query('day', where={'holdsColor': 4, 'zone': 3}).sents.median()
+
+        Parameters
+        ==========
+        freq : str (default: 'day')
+            One of FREQUENCIES.
+        by : list of str (default: ())
+            Columns of GROUP_COLUMNS by which statistics are also grouped.
+        where : dict or None (default: None)
+            Values of GROUP_COLUMNS to select. A list selects any of its
+            values.
+        start, end : datetime.datetime or None (default: None)
+            If not None, only select buckets such that start <= bucket <= end.
+
+        Returns
+        =======
+        statistics : pandas.DataFrame
+            The METRICS of each bucket and group, and the number of sents
+            per boulder.
+        '''
+        table = self.read(freq)
+        if 'routeSetter' in by or 'routeSetter' in (where or {}):
+            table = table.assign(routeSetter=table.routeSetter.str.split(
+                ROUTE_SETTER_SEPARATOR)).explode('routeSetter')
+        mask = np.ones(len(table), dtype=bool)
+        for column, value in (where or {}).items():
+            if isinstance(value, (list, tuple, set)):
+                mask &= table[column].isin(value).to_numpy()
+            else:
+                mask &= (table[column] == value).to_numpy()
+        if start is not None:
+            mask &= (table.bucket >= pd.Timestamp(start)).to_numpy()
+        if end is not None:
+            mask &= (table.bucket <= pd.Timestamp(end)).to_numpy()
+        statistics = table[mask].groupby(
+            ['bucket'] + list(by), dropna=False)[METRICS].sum().reset_index()
+        statistics['sentsPerBoulder'] = (
+            statistics.sents / statistics.boulders.replace(0, np.nan))
+        return statistics
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import random
+import threading
+import time
+
+import yaml
+
+import scrape_boulders
+import snapshots
+
+class MultiGymClient(scrape_boulders.BouldersClient):
+    ''' Scrape the boulders of several gyms through a single websocket
+
+    Each gym is done when its subscription is ready, or when give_up() is
+    called, eg after its timeout. on_gym_done(gym, ready) is then called
+    once for that gym, and the connection is closed once all gyms are done.
+    '''
+    def __init__(self, url, gyms, on_gym_done=None, **kwargs):
+        super().__init__(url, None, **kwargs)
+        self.gyms = gyms
+        self.on_gym_done = on_gym_done
+        self.sub_gyms = {}
+        self.ready_gyms = set()
+        self.done_gyms = set()
+        self.lock = threading.Lock()
+
+    def on_open(self):
+        super().on_open()
+        for gym in self.gyms:
+            self.sub_gyms[self.subscribe_gym(gym)] = gym
+
+    def on_ready(self, subs):
+        for sub in subs:
+            if sub in self.sub_gyms:
+                self._gym_done(self.sub_gyms[sub], True)
+
+    def give_up(self, gym):
+        ''' Stop waiting for the subscription of a gym '''
+        self._gym_done(gym, False)
+
+    def _gym_done(self, gym, ready):
+        # called from the websocket thread, and from timers
+        with self.lock:
+            if gym in self.done_gyms:
+                return
+            self.done_gyms.add(gym)
+            if ready:
+                self.ready_gyms.add(gym)
+            all_done = len(self.done_gyms) == len(self.gyms)
+        if self.on_gym_done is not None:
+            self.on_gym_done(gym, ready)
+        if all_done:
+            self._record_subscription()
+            self.close()
+
+    def get_gym_boulders(self, gym):
+        boulders = self.collections.get('boulders', {})
+        return {b_id: b for b_id, b in boulders.items() if b.get('gym') == gym}
+
+class Target():
+    ''' A gym to scrape periodically, and its scraping statistics
+
+    A scrape that lasts longer than timeout seconds fails. The timeout
+    defaults to the interval, so that a server that never sends the
+    subscription does not hold a connection past the next run.
+    '''
+    def __init__(self, url, gym, interval, timeout=None):
+        self.url = url
+        self.gym = gym
+        self.interval = interval
+        self.timeout = timeout if timeout is not None else interval
+        self.next_run = None
+        self.runs = 0
+        self.successes = 0
+        self.failures = 0
+        self.total_latency = 0
+        self.last_latency = None
+        self.last_error = None
+        self.max_lag = 0
+
+    def schedule_next(self, now, jitter):
+        if self.next_run is None:
+            self.next_run = now
+        else:
+            self.max_lag = max(self.max_lag, now - self.next_run)
+            self.next_run = max(self.next_run + self.interval, now)
+        self.next_run += random.uniform(0, jitter)
+
+    def record(self, success, latency, error=None):
+        self.runs += 1
+        if success:
+            self.successes += 1
+        else:
+            self.failures += 1
+        if error is not None:
+            self.last_error = str(error)
+        self.total_latency += latency
+        self.last_latency = latency
+
+    @property
+    def stats(self):
+        return {
+            'url': self.url,
+            'gym': self.gym,
+            'runs': self.runs,
+            'successes': self.successes,
+            'failures': self.failures,
+            'mean_latency': (self.total_latency / self.runs
+                             if self.runs else None),
+            'last_latency': self.last_latency,
+            'last_error': self.last_error,
+            'max_lag': self.max_lag,
+            }
+
+def load_targets(filename, default_timeout=None):
+    ''' Load scraping targets from a yaml file
+
+    The file contains a list of targets, eg:
+
+        - url: wss://example.com/websocket
+          gym: some/gym
+          interval: 300
+          timeout: 60  # optional
+
+    Each gym of a server must only be listed once.
+
+    Returns
+    =======
+    targets : list of Target
+    '''
+    with open(filename) as f:
+        targets_data = yaml.safe_load(f)
+    targets = [Target(t['url'], t['gym'], t['interval'],
+                      timeout=t.get('timeout', default_timeout))
+               for t in targets_data]
+    counts = collections.Counter((t.url, t.gym) for t in targets)
+    duplicates = ['{} on {}'.format(gym, url)
+                  for (url, gym), n in counts.items() if n > 1]
+    if duplicates:
+        raise ValueError('duplicate targets in {}: {}'.format(
+            filename, ', '.join(duplicates)))
+    return targets
+
+class Scheduler():
+    ''' Scrape targets periodically over a bounded pool of connections
+
+    Targets that are due at the same time on the same server are scraped
+    through a single websocket. A server is never scraped by two
+    connections at once, and no more than max_connections servers are
+    scraped at once: late targets wait until a connection is available.
+
+    Parameters
+    ==========
+    targets : list of Target
+        The targets to scrape.
+    output_dir : str
+        Directory where the snapshots are saved.
+    fmt : str (default: 'yaml')
+        Snapshot format, one of snapshots.SNAPSHOT_FORMATS.
+    max_connections : int (default: 4)
+        Maximum number of simultaneous connections.
+    jitter : float (default: 10)
+        Maximum random delay added to each run, in seconds.
+    heartbeat_interval : float or None (default: 30)
+        Ping the servers after this time without messages, and close the
+        connections that do not answer, see ddp_client.DDPClient.
+    '''
+    def __init__(self, targets, output_dir, fmt='yaml', max_connections=4,
+                 jitter=10, heartbeat_interval=30):
+        self.targets = targets
+        self.output_dir = output_dir
+        self.fmt = fmt
+        self.max_connections = max_connections
+        self.jitter = jitter
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = 0.5
+        self.errors = 0
+
+    def scrape(self, url, targets):
+        ''' Scrape targets from a given server through a single websocket
+
+        Each target is recorded when its gym is done: its snapshot is
+        written as soon as its subscription is ready, and it fails when its
+        own timeout is reached first.
+        '''
+        targets = {t.gym: t for t in targets}
+        start = time.monotonic()
+
+        def on_gym_done(gym, ready):
+            latency = time.monotonic() - start
+            error = None
+            if ready:
+                try:
+                    self.write_snapshot(gym, client.get_gym_boulders(gym))
+                except Exception as e:
+                    error = e
+                    print('Error while writing {}: {}'.format(gym, e))
+            else:
+                error = 'not ready'
+            targets[gym].record(error is None, latency, error=error)
+
+        client = MultiGymClient(
+            url, list(targets), on_gym_done=on_gym_done,
+            heartbeat_interval=self.heartbeat_interval)
+        timers = [threading.Timer(t.timeout, client.give_up, args=(t.gym,))
+                  for t in targets.values()]
+        for timer in timers:
+            timer.start()
+        try:
+            client.run_forever()
+        finally:
+            for timer in timers:
+                timer.cancel()
+            # the connection closed before these gyms were ready
+            for gym in targets:
+                client.give_up(gym)
+
+    def write_snapshot(self, gym, boulders):
+        output = scrape_boulders.Output(argparse.Namespace(
+            output=None, output_dir=self.output_dir, gym=gym,
+            append=False, overwrite=False, format=self.fmt))
+        snapshots.write_snapshot(
+            output.filename, output.write_mode, output.timestamp, boulders)
+
+    def run(self, stats_interval=None, stats_file=None):
+        ''' Run the scheduler until interrupted '''
+        now = time.monotonic()
+        for target in self.targets:
+            target.schedule_next(now, self.jitter)
+        last_stats = now
+        in_flight = {}
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_connections) as pool:
+            try:
+                while True:
+                    for url, future in list(in_flight.items()):
+                        if future.done():
+                            del in_flight[url]
+                            self.check_result(url, future)
+                    now = time.monotonic()
+                    due = collections.OrderedDict()
+                    for target in sorted(self.targets, key=lambda t: t.next_run):
+                        if target.next_run <= now:
+                            due.setdefault(target.url, []).append(target)
+                    for url, targets in due.items():
+                        if url in in_flight:
+                            continue
+                        if len(in_flight) >= self.max_connections:
+                            break
+                        for target in targets:
+                            target.schedule_next(now, self.jitter)
+                        in_flight[url] = pool.submit(self.scrape, url, targets)
+                    if stats_interval and now - last_stats > stats_interval:
+                        self.report_stats(stats_file)
+                        last_stats = now
+                    time.sleep(self.poll_interval)
+            finally:
+                self.report_stats(stats_file)
+
+    def check_result(self, url, future):
+        ''' Log and count the errors raised by a finished scrape '''
+        try:
+            future.result()
+        except Exception as e:
+            self.errors += 1
+            print('Error while scraping {}: {}'.format(url, e))
+
+    def report_stats(self, stats_file=None):
+        stats = [t.stats for t in self.targets]
+        for s in stats:
+            latency = s['mean_latency']
+            latency = '{:.2f}'.format(latency) if latency is not None else '-'
+            print('{gym}: {successes}/{runs} ok, mean latency {latency} s, '
+                  'max lag {max_lag:.1f} s'.format(latency=latency, **s))
+        if self.errors:
+            print('{} scrapes failed with an error'.format(self.errors))
+        if stats_file is not None:
+            with open(stats_file, 'w') as f:
+                json.dump(stats, f, indent=2)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Scrape boulders data from several gyms periodically.')
+    parser.add_argument(
+        'targets',
+        type=str,
+        help='yaml file containing the list of (url, gym, interval) targets')
+    parser.add_argument(
+        '--output-dir',
+        type=str,
+        default='.',
+        help='directory where results are saved')
+    parser.add_argument(
+        '--format',
+        type=str,
+        choices=['yaml', 'jsonl'],
+        default='yaml',
+        help='format of the results (default: yaml)')
+    parser.add_argument(
+        '--max-connections',
+        type=int,
+        default=4,
+        help='maximum number of simultaneous connections (default: 4)')
+    parser.add_argument(
+        '--jitter',
+        type=float,
+        default=10,
+        help='maximum random delay added to each run, in seconds (default: 10)')
+    parser.add_argument(
+        '--timeout',
+        type=int,
+        help=('default scraping timeout of the targets, in seconds '
+              '(default: the interval of each target)'))
+    parser.add_argument(
+        '--heartbeat-interval',
+        type=float,
+        default=30,
+        help=('ping the servers after this time without messages, and close '
+              'the connections that do not answer, in seconds (default: 30)'))
+    parser.add_argument(
+        '--stats-interval',
+        type=float,
+        default=3600,
+        help='time between two statistics reports, in seconds (default: 3600)')
+    parser.add_argument(
+        '--stats-file',
+        type=str,
+        help='json file where statistics are saved')
+    args = parser.parse_args()
+
+    targets = load_targets(args.targets, default_timeout=args.timeout)
+    scheduler = Scheduler(
+        targets, args.output_dir, fmt=args.format,
+        max_connections=args.max_connections, jitter=args.jitter,
+        heartbeat_interval=args.heartbeat_interval)
+    scheduler.run(stats_interval=args.stats_interval,
+                  stats_file=args.stats_file)
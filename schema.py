@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+''' Boulder fields shared by the scraper and the reducer '''
+
+# fields kept as static attributes of the reduced boulders
+ATTRIBUTE_FIELDS = (
+    'addedAt',
+    'boulderNum',
+    'closedAt',
+    'comment',
+    'createdAt',
+    'girly',
+    'grade',
+    'gym',
+    'holdsColor',
+    'label',
+    'picture',
+    'routeSetter',
+    'routeTypes',
+    'updatedAt',
+    'zone',
+    )
+
+# fields kept as time series of the reduced boulders
+TIME_SERIES_FIELDS = (
+    'likesCount',
+    'likesRatio',
+    'sentsCount',
+    )
+
+# per-user fields, which grow with the boulders popularity and are not used
+DISCARDED_FIELDS = (
+    'dislikesList',
+    'likesList',
+    'projectsList',
+    'sentsList',
+    )
+
+def get_projection(discard=DISCARDED_FIELDS):
+    ''' Get a mongo-style projection excluding the discarded fields '''
+    return {field: 0 for field in discard}
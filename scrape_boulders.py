@@ -3,38 +3,236 @@
 import datetime
 import os
 import multiprocessing as mp
+import random
+import threading
 import time
 
-import yaml
-
-from ddp_client import DDPClient
+from ddp_client import DDPClient, JsonDecoder
+import profiling
+import schema
+import snapshots
 
 VERBOSE = False
 
 class BouldersClient(DDPClient):
-    def __init__(self, url, gym):
-        super().__init__(url)
+    ''' Scrape the boulders of a gym
+
+    Parameters
+    ==========
+    url : str
+        Websocket url.
+    gym : str
+        Gym name.
+    discard_fields : iterable of str (default: schema.DISCARDED_FIELDS)
+        Fields that are stripped from the documents as they are received,
+        unless a decoder is passed.
+    server_projection : bool (default: False)
+        If True, also ask the server not to send the discarded fields.
+    '''
+    def __init__(self, url, gym, discard_fields=schema.DISCARDED_FIELDS,
+                 server_projection=False, **kwargs):
+        kwargs.setdefault('decoder', JsonDecoder(skip_fields=discard_fields))
+        super().__init__(url, **kwargs)
         self.gym = gym
         self.waiting_subs = set()
+        self.subscription_options = {}
+        self._subscribe_time = None
+        if server_projection:
+            self.subscription_options['fields'] = schema.get_projection(
+                discard_fields)
 
     def on_ready(self, subs):
         for sub in subs:
             self.waiting_subs.remove(sub)
         if not self.waiting_subs:
+            self._record_subscription()
             self.close()
 
-    def on_open(self):
-        super().on_open()
+    def _record_subscription(self):
+        ''' Record the time between the subscription and its ready message '''
+        if self._subscribe_time is not None:
+            profiling.add_span('subscription',
+                               time.perf_counter() - self._subscribe_time)
+            self._subscribe_time = None
 
+    def subscribe_gym(self, gym):
+        if self._subscribe_time is None:
+            self._subscribe_time = time.perf_counter()
         id_ = self.sub(
-            '_boulders.list', [{'gym': self.gym, 'isClosed': None}, {}, 10000])
+            '_boulders.list',
+            [{'gym': gym, 'isClosed': None}, self.subscription_options, 10000])
         self.waiting_subs.add(id_)
+        return id_
+
+    def on_open(self):
+        super().on_open()
+        if self.gym is not None:
+            self.subscribe_gym(self.gym)
 
     def on_message(self, msg):
         msg = super().on_message(msg)
         if VERBOSE:
             print(msg)
 
+class BouldersWatchClient(BouldersClient):
+    ''' Stay subscribed to the boulders, and record their changes
+
+    A checkpoint of the collection is written once the subscription is
+    ready, and added, changed or removed events received after that are
+    written to the delta log.
+    '''
+    def __init__(self, url, gym, delta_log, **kwargs):
+        super().__init__(url, gym, **kwargs)
+        self.delta_log = delta_log
+        self.ready = False
+
+    @property
+    def boulders(self):
+        return self.collections.setdefault('boulders', {})
+
+    def on_ready(self, subs):
+        for sub in subs:
+            self.waiting_subs.discard(sub)
+        if not self.waiting_subs and not self.ready:
+            self.ready = True
+            self._record_subscription()
+            self.delta_log.checkpoint(self.boulders)
+
+    def on_added(self, collection, id_, fields):
+        super().on_added(collection, id_, fields)
+        if self.ready and collection == 'boulders':
+            self.delta_log.record('added', id_, fields=fields)
+            self.delta_log.tick(self.boulders)
+
+    def on_changed(self, collection, id_, fields, cleared):
+        super().on_changed(collection, id_, fields, cleared)
+        if self.ready and collection == 'boulders':
+            self.delta_log.record(
+                'changed', id_, fields=fields, cleared=cleared)
+            self.delta_log.tick(self.boulders)
+
+    def on_removed(self, collection, id_):
+        super().on_removed(collection, id_)
+        if self.ready and collection == 'boulders':
+            self.delta_log.record('removed', id_)
+            self.delta_log.tick(self.boulders)
+
+class LiveBouldersClient(BouldersClient):
+    ''' Stay subscribed to the boulders of a gym, across reconnections
+
+    The collections are updated by the websocket thread, and the boulders
+    of the last ready subscription can be copied from other threads with
+    snapshot(). run() reconnects with an exponential backoff when the
+    connection closes or fails, and subscribes again. DDP cannot resume a
+    session, so the server sends the whole subscription again: it is
+    received into new collections, and snapshots are taken from the
+    previous ones until it is ready.
+
+    Parameters
+    ==========
+    url : str
+        Websocket url.
+    gym : str
+        Gym name.
+    heartbeat_interval : float or None (default: 30)
+        Ping the server after this time without messages, in seconds, see
+        DDPClient.
+    heartbeat_timeout : float (default: 15)
+        Reconnect when the server does not answer a ping within this time,
+        in seconds.
+    min_backoff, max_backoff : float (default: 1, 300)
+        Bounds of the time waited before reconnecting, in seconds. It
+        doubles after each failed connection, and is reset once a
+        subscription is ready.
+    '''
+    def __init__(self, url, gym, heartbeat_interval=30, heartbeat_timeout=15,
+                 min_backoff=1, max_backoff=300, **kwargs):
+        super().__init__(url, gym, heartbeat_interval=heartbeat_interval,
+                         heartbeat_timeout=heartbeat_timeout, **kwargs)
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.lock = threading.Lock()
+        self.ready = False
+        self.synced = False
+        self.replica = None
+        self.reconnects = 0
+        self._ready_event = threading.Event()
+        self._stopped = threading.Event()
+
+    def on_open(self):
+        with self.lock:
+            self.collections = {}
+        self.waiting_subs = set()
+        self._subscribe_time = None
+        super().on_open()
+
+    def on_ready(self, subs):
+        for sub in subs:
+            self.waiting_subs.discard(sub)
+        if not self.waiting_subs and not self.synced:
+            self._record_subscription()
+            with self.lock:
+                self.replica = self.collections
+            self.synced = True
+            self.ready = True
+            self._ready_event.set()
+
+    def on_added(self, collection, id_, fields):
+        with self.lock:
+            super().on_added(collection, id_, fields)
+
+    def on_changed(self, collection, id_, fields, cleared):
+        with self.lock:
+            super().on_changed(collection, id_, fields, cleared)
+
+    def on_removed(self, collection, id_):
+        with self.lock:
+            super().on_removed(collection, id_)
+
+    def wait_ready(self, timeout=None):
+        ''' Wait for the first subscription to be ready
+
+        Returns
+        =======
+        ready : bool
+            False if the timeout was reached.
+        '''
+        return self._ready_event.wait(timeout)
+
+    def snapshot(self):
+        ''' Copy the boulders of the last ready subscription, or None '''
+        with self.lock:
+            if self.replica is None:
+                return None
+            boulders = self.replica.get('boulders', {})
+            return {b_id: dict(b) for b_id, b in boulders.items()}
+
+    def run(self):
+        ''' Stay connected until stop() is called '''
+        backoff = self.min_backoff
+        while not self._stopped.is_set():
+            self.synced = False
+            self.run_forever()
+            if self._stopped.is_set():
+                break
+            if self.synced:
+                backoff = self.min_backoff
+            self.synced = False
+            self.reconnects += 1
+            profiling.count('reconnects')
+            # jitter, so that clients disconnected together do not all
+            # reconnect at the same time
+            delay = backoff * random.uniform(0.5, 1)
+            if VERBOSE:
+                print('Reconnecting in {:.1f}s'.format(delay))
+            if self._stopped.wait(delay):
+                break
+            backoff = min(2 * backoff, self.max_backoff)
+
+    def stop(self):
+        self._stopped.set()
+        self.close()
+
 class Output():
     def __init__(self, args):
         self.args = args
@@ -49,10 +247,11 @@ class Output():
                 self.args.output_dir,
                 self.args.gym.replace('/', '+'))
             os.makedirs(self.args.output_dir, exist_ok=True)
+            extension = snapshots.SNAPSHOT_FORMATS[self.args.format].extension
             if self.args.append:
-                filename += '.yml'
+                filename += extension
             else:
-                filename += '_{}.yml'.format(self.timestamp)
+                filename += '_{}{}'.format(self.timestamp, extension)
         return filename
 
     @property
@@ -69,16 +268,95 @@ class Output():
         else:
             return 'w'
 
+def get_client_kwargs(args):
+    ''' Get the BouldersClient keyword arguments set by the command line '''
+    discard_fields = () if args.keep_all_fields else schema.DISCARDED_FIELDS
+    return {'discard_fields': discard_fields,
+            'server_projection': args.server_projection}
+
 def worker(args):
-    client = BouldersClient(args.url, args.gym)
-    client.run_forever()
+    profiling.start_from_args(args)
+    client_kwargs = get_client_kwargs(args)
+    with profiling.span('scrape'):
+        if args.record_messages is not None:
+            with open(args.record_messages, 'a') as record:
+                client = BouldersClient(
+                    args.url, args.gym, record=record, **client_kwargs)
+                client.run_forever()
+        else:
+            client = BouldersClient(args.url, args.gym, **client_kwargs)
+            client.run_forever()
     data = client.collections['boulders']
+    profiling.count('boulders', len(data))
 
     output = Output(args)
-    with open(output.filename, output.write_mode) as f:
-        yaml.dump({output.timestamp: data}, f,
-                  default_flow_style=False, allow_unicode=True)
+    with profiling.span('write_snapshot'):
+        snapshots.write_snapshot(
+            output.filename, output.write_mode, output.timestamp, data)
     print('Output written to:', output.filename)
+    # the worker runs in its own process, which does not run atexit handlers
+    profiling.stop()
+
+def watch_worker(args):
+    profiling.start_from_args(args)
+    output = Output(args)
+    delta_log = snapshots.DeltaLogWriter(
+        output.filename, output.write_mode,
+        checkpoint_interval=args.checkpoint_interval,
+        flush_interval=args.flush_interval)
+    client = BouldersWatchClient(
+        args.url, args.gym, delta_log, **get_client_kwargs(args))
+    print('Recording changes to:', output.filename)
+    try:
+        with profiling.span('watch'):
+            client.run_forever()
+    finally:
+        delta_log.close()
+        profiling.stop()
+
+def persistent_worker(args):
+    ''' Write a snapshot every args.repeat seconds from a live subscription '''
+    profiling.start_from_args(args)
+    record = None
+    if args.record_messages is not None:
+        record = open(args.record_messages, 'a')
+    client = LiveBouldersClient(
+        args.url, args.gym, record=record,
+        heartbeat_interval=args.heartbeat_interval,
+        max_backoff=args.max_backoff,
+        **get_client_kwargs(args))
+    thread = threading.Thread(target=client.run, daemon=True)
+    thread.start()
+    try:
+        with profiling.span('subscription_ready'):
+            if not client.wait_ready(args.timeout):
+                if args.exit_on_timeout:
+                    raise TimeoutError('client reached timeout')
+                print('client reached timeout')
+        while True:
+            start_time = time.time()
+            with profiling.span('snapshot'):
+                data = client.snapshot()
+            if data is None:
+                print('Subscription not ready, skipping snapshot')
+            else:
+                if not client.synced:
+                    print('Disconnected, writing the last received boulders')
+                profiling.count('snapshots')
+                output = Output(args)
+                with profiling.span('write_snapshot'):
+                    snapshots.write_snapshot(
+                        output.filename, output.write_mode, output.timestamp,
+                        data)
+                print('Output written to:', output.filename)
+            elapsed = time.time() - start_time
+            time.sleep(max(0, args.repeat - elapsed))
+    finally:
+        client.stop()
+        thread.join(5)
+        if record is not None:
+            record.close()
+        profiling.stop()
 
 def scrape_boulders(args):
     p = mp.Process(target=worker, args=(args,))
@@ -119,12 +397,20 @@ if __name__ == '__main__':
     parser.add_argument(
         '--output', '-o',
         type=str,
-        help='yaml file where the results are saved')
+        help=('file where the results are saved; its extension sets the '
+              'format'))
     parser.add_argument(
         '--output-dir',
         type=str,
         default='.',
         help='directory where results are saved if --output is not specified')
+    parser.add_argument(
+        '--format',
+        type=str,
+        choices=list(snapshots.SNAPSHOT_FORMATS.keys()),
+        default='yaml',
+        help=('format of the results if --output is not specified '
+              '(default: yaml)'))
     parser.add_argument(
         '--overwrite',
         action='store_true',
@@ -147,10 +433,73 @@ if __name__ == '__main__':
         action='store_false',
         help=("don't exit on timeout (but still terminate current scraping); "
               "useful for with --repeat"))
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help=('stay subscribed and record changes as they happen, instead '
+              'of scraping full snapshots; implies --format deltas'))
+    parser.add_argument(
+        '--checkpoint-interval',
+        type=float,
+        default=3600,
+        help=('with --watch, minimum time between two full checkpoints, in '
+              'seconds (default: 3600)'))
+    parser.add_argument(
+        '--flush-interval',
+        type=float,
+        default=60,
+        help=('with --watch, maximum time during which changes are buffered '
+              'before being written, in seconds (default: 60)'))
+    parser.add_argument(
+        '--persistent',
+        action='store_true',
+        help=('with --repeat, stay subscribed and write snapshots of the '
+              'local copy of the boulders, instead of scraping them again; '
+              'the client reconnects when the connection is lost, and '
+              '--timeout only applies to the first subscription'))
+    parser.add_argument(
+        '--heartbeat-interval',
+        type=float,
+        default=30,
+        help=('with --persistent, ping the server after this time without '
+              'messages, and reconnect if it does not answer, in seconds '
+              '(default: 30)'))
+    parser.add_argument(
+        '--max-backoff',
+        type=float,
+        default=300,
+        help=('with --persistent, maximum time waited before reconnecting, '
+              'in seconds (default: 300)'))
+    parser.add_argument(
+        '--record-messages',
+        type=str,
+        help=('file to which the raw DDP messages received during the scrape '
+              'are appended, eg for benchmarks.py ddp-decode'))
+    parser.add_argument(
+        '--keep-all-fields',
+        action='store_true',
+        help=('keep the per-user fields (likesList, sentsList, etc.) that are '
+              'not used by the reducer'))
+    parser.add_argument(
+        '--server-projection',
+        action='store_true',
+        help=('ask the server not to send the fields that are not used by '
+              'the reducer, if it supports it'))
+    profiling.add_arguments(parser)
     args = parser.parse_args()
+    if args.watch:
+        args.format = 'deltas'
+    elif args.format == 'deltas':
+        parser.error('--format deltas requires --watch')
+    if args.persistent and not args.repeat:
+        parser.error('--persistent requires --repeat')
 
     print('Scraping:', args.url, args.gym)
-    if args.repeat:
+    if args.watch:
+        watch_worker(args)
+    elif args.persistent:
+        persistent_worker(args)
+    elif args.repeat:
         scrape_boulders_loop(args)
     else:
         scrape_boulders(args)
@@ -0,0 +1,549 @@
+#!/usr/bin/env python3
+
+import copy
+import datetime
+import gzip
+import io
+import json
+import os
+import time
+import zlib
+
+import yaml
+
+# use the C-accelerated loader when libyaml is available
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+class YamlSnapshotFormat():
+    ''' Snapshots stored as a yaml mapping between dates and boulders
+
+    All snapshots of a file are parsed at once, as the whole file is a single
+    yaml document.
+    '''
+    name = 'yaml'
+    extension = '.yml'
+
+    def write(self, filename, mode, timestamp, boulders):
+        with open(filename, mode) as f:
+            yaml.dump({timestamp: boulders}, f,
+                      default_flow_style=False, allow_unicode=True)
+
+    def read(self, filename):
+        with open(filename, 'rb') as f:
+            yield from self.read_stream(f)
+
+    def read_stream(self, stream, state=None):
+        data = yaml.load(stream, Loader=YamlLoader)
+        for timestamp, boulders in (data or {}).items():
+            yield timestamp, boulders
+
+class JsonlSnapshotFormat():
+    ''' Snapshots stored as compressed json lines
+
+    Each snapshot is written as a separate gzip member containing a single
+    line {"date": <timestamp>, "boulders": <boulders>}. Appending a snapshot
+    never rewrites the file, and snapshots are read back one at a time.
+    '''
+    name = 'jsonl'
+    extension = '.jsonl.gz'
+
+    def write(self, filename, mode, timestamp, boulders):
+        record = {'date': timestamp, 'boulders': boulders}
+        with gzip.open(filename, mode + 't', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False))
+            f.write('\n')
+
+    def read(self, filename):
+        with open(filename, 'rb') as f:
+            yield from self.read_stream(f)
+
+    def read_stream(self, stream, state=None):
+        with gzip.open(stream, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record['date'], record['boulders']
+
+def apply_delta(boulders, record):
+    ''' Apply a delta record to a boulders collection, in place '''
+    if record['type'] == 'added':
+        boulders[record['id']] = copy.deepcopy(record['fields'])
+    elif record['type'] == 'changed':
+        document = boulders[record['id']]
+        document.update(copy.deepcopy(record['fields']))
+        for key in record['cleared']:
+            document.pop(key, None)
+    elif record['type'] == 'removed':
+        boulders.pop(record['id'], None)
+
+class DeltaSnapshotFormat():
+    ''' Changes of the boulders collection stored as compressed json lines
+
+    The file contains checkpoints of the whole collection, and the DDP
+    added, changed and removed events received in between. Events are
+    written in batches, each batch being a gzip member ending with a flush
+    record:
+
+        {"date": ..., "type": "checkpoint", "boulders": {...}}
+        {"date": ..., "type": "added", "id": ..., "fields": {...}}
+        {"date": ..., "type": "changed", "id": ..., "fields": {...},
+         "cleared": [...]}
+        {"date": ..., "type": "removed", "id": ...}
+        {"date": ..., "type": "flush"}
+
+    When read, the collection is rebuilt at each checkpoint and flush.
+    '''
+    name = 'deltas'
+    extension = '.deltas.jsonl.gz'
+
+    def write(self, filename, mode, timestamp, boulders):
+        record = {'date': timestamp, 'type': 'checkpoint', 'boulders': boulders}
+        with gzip.open(filename, mode + 't', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False))
+            f.write('\n')
+
+    def read_records(self, filename):
+        with gzip.open(filename, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def read(self, filename):
+        with open(filename, 'rb') as f:
+            yield from self.read_stream(f)
+
+    def read_stream(self, stream, state=None):
+        ''' Read the snapshots of a binary stream
+
+        Parameters
+        ==========
+        stream : file object
+            The content of a delta file, or of its end.
+        state : dict or None (default: None)
+            The boulders collection that the records of the stream apply
+            to is kept in state['boulders'], so that the end of a file can
+            be read after its beginning.
+        '''
+        if state is None:
+            state = {}
+        with gzip.open(stream, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record['type'] == 'checkpoint':
+                    state['boulders'] = record['boulders']
+                elif state.get('boulders') is None:
+                    continue  # no checkpoint to apply the delta to
+                elif record['type'] == 'flush':
+                    pass
+                else:
+                    apply_delta(state['boulders'], record)
+                    continue
+                yield record['date'], copy.deepcopy(state['boulders'])
+
+    def replay(self, filename, date):
+        ''' Rebuild the boulders collection at a given date
+
+        Parameters
+        ==========
+        filename : str
+            A delta file written by scrape_boulders.py --watch.
+        date : str
+            The date at which to rebuild the collection, in ISO format.
+
+        Returns
+        =======
+        boulders : dict or None
+            The boulders collection at this date, or None if there is no
+            checkpoint before this date.
+        '''
+        boulders = None
+        for record in self.read_records(filename):
+            if record['date'] > date:
+                break
+            if record['type'] == 'checkpoint':
+                boulders = record['boulders']
+            elif boulders is not None:
+                apply_delta(boulders, record)
+        return boulders
+
+class DeltaLogWriter():
+    ''' Write changes of the boulders collection to a delta file
+
+    Parameters
+    ==========
+    filename : str
+        The output file, with the DeltaSnapshotFormat extension.
+    mode : str (default: 'w')
+        'w' to overwrite the file, 'a' to append to it.
+    checkpoint_interval : float (default: 3600)
+        Minimum time between two checkpoints, in seconds.
+    flush_interval : float (default: 60)
+        Maximum time during which events are buffered, in seconds.
+    manifest : bool (default: True)
+        If True, record each checkpoint and flush, which are read back as
+        snapshots, in the SnapshotManifest of the directory of the file.
+    '''
+
+    def __init__(self, filename, mode='w', checkpoint_interval=3600,
+                 flush_interval=60, manifest=True):
+        self.filename = filename
+        self.manifest = None
+        if manifest:
+            self.manifest = SnapshotManifest(
+                os.path.dirname(filename) or '.')
+        self.mode = mode
+        self.checkpoint_interval = checkpoint_interval
+        self.flush_interval = flush_interval
+        self._lines = []
+        self._last_checkpoint = None
+        self._last_flush = time.monotonic()
+
+    def _write_lines(self, lines):
+        with gzip.open(self.filename, self.mode + 't', encoding='utf-8') as f:
+            f.write(''.join(lines))
+        self.mode = 'a'
+
+    def _line(self, record):
+        record['date'] = datetime.datetime.now().isoformat()
+        # serialized right away, as documents are later modified in place
+        return json.dumps(record, ensure_ascii=False) + '\n'
+
+    def _add_to_manifest(self, date):
+        if self.manifest is not None:
+            self.manifest.add(self.filename, date)
+
+    def checkpoint(self, boulders):
+        ''' Write a checkpoint of the whole collection '''
+        self.flush()
+        record = {'type': 'checkpoint', 'boulders': boulders}
+        self._write_lines([self._line(record)])
+        self._add_to_manifest(record['date'])
+        self._last_checkpoint = time.monotonic()
+
+    def record(self, type_, id_, fields=None, cleared=None):
+        ''' Buffer an added, changed, or removed event '''
+        record = {'type': type_, 'id': id_}
+        if type_ in ('added', 'changed'):
+            record['fields'] = fields
+        if type_ == 'changed':
+            record['cleared'] = cleared
+        self._lines.append(self._line(record))
+
+    def flush(self):
+        ''' Write buffered events as a new batch '''
+        if self._lines:
+            record = {'type': 'flush'}
+            self._lines.append(self._line(record))
+            self._write_lines(self._lines)
+            self._lines = []
+            self._add_to_manifest(record['date'])
+        self._last_flush = time.monotonic()
+
+    def tick(self, boulders):
+        ''' Flush or checkpoint if their interval has elapsed '''
+        now = time.monotonic()
+        if (self._last_checkpoint is None
+                or now - self._last_checkpoint > self.checkpoint_interval):
+            self.checkpoint(boulders)
+        elif now - self._last_flush > self.flush_interval:
+            self.flush()
+
+    def close(self):
+        self.flush()
+
+SNAPSHOT_FORMATS = {
+    fmt.name: fmt for fmt in (
+        YamlSnapshotFormat(), JsonlSnapshotFormat(), DeltaSnapshotFormat())}
+
+# name of the manifest of the snapshots written to a directory
+MANIFEST_FILENAME = 'manifest.jsonl'
+
+def _read_lines_backwards(filename, block_size=1 << 16):
+    ''' Yield the lines of a file, starting from the last one '''
+    with open(filename, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        remainder = b''
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
+            f.seek(position)
+            lines = (f.read(size) + remainder).split(b'\n')
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line.strip():
+                    yield line.decode('utf-8')
+        if remainder.strip():
+            yield remainder.decode('utf-8')
+
+class SnapshotManifest():
+    ''' Manifest of the snapshots written to a directory
+
+    Each snapshot written by write_snapshot() or DeltaLogWriter is recorded
+    as a json line {"file": <basename>, "date": <snapshot timestamp>,
+    "written": <time of the write>} appended to the manifest, so that the
+    snapshots of a file written with --append are also listed.
+
+    As lines are appended in write order, and a snapshot is always written
+    after its date, the snapshots newer than a date are found by reading the
+    manifest backwards, until a snapshot written before that date. The cost
+    of listing new snapshots thus only depends on their number, and not on
+    the size of the archive.
+
+    Parameters
+    ==========
+    directory : str
+        The directory containing the snapshot files.
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+
+    @property
+    def filename(self):
+        return os.path.join(self.directory, MANIFEST_FILENAME)
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def add(self, filename, date, written=None):
+        ''' Record a snapshot written to a file of the directory '''
+        if written is None:
+            written = datetime.datetime.now().isoformat()
+        entry = {'file': os.path.basename(filename), 'date': date,
+                 'written': written}
+        # a single write of a short line, so that concurrent scrapers can
+        # append to the manifest
+        with open(self.filename, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    def entries(self, after=None):
+        ''' Get the snapshots of the manifest
+
+        Parameters
+        ==========
+        after : datetime.datetime or None (default: None)
+            If not None, only get the snapshots dated after this date.
+
+        Returns
+        =======
+        entries : list of dict
+            The manifest entries, in write order.
+        '''
+        if not self.exists():
+            return []
+        if after is None:
+            with open(self.filename) as f:
+                return [json.loads(line) for line in f if line.strip()]
+        entries = []
+        for line in _read_lines_backwards(self.filename):
+            entry = json.loads(line)
+            if datetime.datetime.fromisoformat(entry['written']) <= after:
+                break
+            if datetime.datetime.fromisoformat(entry['date']) > after:
+                entries.append(entry)
+        return entries[::-1]
+
+    def list_files(self, after=None):
+        ''' List the files containing snapshots dated after a date
+
+        Returns
+        =======
+        filenames : list of str
+            The paths of the files, sorted by name. Files listed in the
+            manifest that no longer exist are skipped.
+        '''
+        files = sorted({entry['file'] for entry in self.entries(after)})
+        files = [os.path.join(self.directory, fn) for fn in files]
+        return [fn for fn in files if os.path.exists(fn)]
+
+    def rebuild(self):
+        ''' Rebuild the manifest from the snapshot files of the directory
+
+        Every file is parsed to list the dates of its snapshots. The write
+        time of these snapshots is taken as the modification time of their
+        file.
+
+        Returns
+        =======
+        n_snapshots : int
+            Number of snapshots in the manifest.
+        '''
+        entries = []
+        for fn in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, fn)
+            if not is_snapshot_file(fn) or not os.path.isfile(path):
+                continue
+            written = datetime.datetime.fromtimestamp(os.path.getmtime(path))
+            for date, _ in read_snapshots(path):
+                if isinstance(date, datetime.datetime):
+                    date = date.isoformat()
+                entries.append({'file': fn, 'date': date, 'written': max(
+                    written, datetime.datetime.fromisoformat(date))})
+        entries.sort(key=lambda entry: entry['written'])
+        for entry in entries:
+            entry['written'] = entry['written'].isoformat()
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + '\n')
+        os.replace(tmp_filename, self.filename)
+        return len(entries)
+
+def get_snapshot_format(filename):
+    ''' Get the snapshot format of a file from its extension '''
+    formats = sorted(SNAPSHOT_FORMATS.values(),
+                     key=lambda fmt: len(fmt.extension), reverse=True)
+    for fmt in formats:
+        if filename.endswith(fmt.extension):
+            return fmt
+    raise ValueError('unknown snapshot format: {}'.format(filename))
+
+def is_snapshot_file(filename):
+    return any(filename.endswith(fmt.extension)
+               for fmt in SNAPSHOT_FORMATS.values())
+
+def write_snapshot(filename, mode, timestamp, boulders, manifest=True):
+    ''' Write a snapshot to a file, in the format given by its extension
+
+    Parameters
+    ==========
+    filename : str
+        The output file.
+    mode : str
+        'w' to overwrite the file, 'a' to append to it.
+    timestamp : str
+        Date of the snapshot.
+    boulders : dict
+        The scraped boulders collection.
+    manifest : bool (default: True)
+        If True, record the snapshot in the SnapshotManifest of the
+        directory of the file.
+    '''
+    get_snapshot_format(filename).write(filename, mode, timestamp, boulders)
+    if manifest:
+        SnapshotManifest(os.path.dirname(filename) or '.').add(
+            filename, timestamp)
+
+def read_snapshots(filename):
+    ''' Read the snapshots of a file, in the format given by its extension
+
+    Parameters
+    ==========
+    filename : str
+        A file written by scrape_boulders.py.
+
+    Yields
+    ======
+    timestamp : str
+        Date of the snapshot.
+    boulders : dict
+        The scraped boulders collection.
+    '''
+    yield from get_snapshot_format(filename).read(filename)
+
+class SnapshotFileReader():
+    ''' Read the snapshots appended to a file since the previous read
+
+    The offset of the data already read is kept, so that each read only
+    parses the snapshots appended since. A snapshot that is still being
+    written is read once it is complete, and a file that was overwritten
+    with a smaller one is read again from the start.
+
+    Parameters
+    ==========
+    filename : str
+        A file written by scrape_boulders.py.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.format = get_snapshot_format(filename)
+        self.offset = 0
+        self.state = {}
+
+    def read(self):
+        ''' Read the new snapshots
+
+        Returns
+        =======
+        snapshots : list of (str, dict)
+            The date and the boulders collection of the new snapshots.
+        '''
+        size = os.path.getsize(self.filename)
+        if size == self.offset:
+            return []
+        if size < self.offset:
+            self.offset = 0
+            self.state = {}
+        with open(self.filename, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+        state = copy.deepcopy(self.state)
+        try:
+            snapshots = list(self.format.read_stream(io.BytesIO(data), state))
+        except (EOFError, OSError, ValueError, zlib.error, yaml.YAMLError):
+            return []  # the file is being written, retry later
+        self.offset += len(data)
+        self.state = state
+        return snapshots
+
+def convert_snapshots(input_filename, output_filename):
+    ''' Convert a snapshot file to the format given by the output extension
+
+    Returns
+    =======
+    n_snapshots : int
+        Number of converted snapshots.
+    '''
+    fmt = get_snapshot_format(output_filename)
+    mode = 'w'
+    n_snapshots = 0
+    for timestamp, boulders in read_snapshots(input_filename):
+        fmt.write(output_filename, mode, timestamp, boulders)
+        mode = 'a'
+        n_snapshots += 1
+    return n_snapshots
+
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Convert snapshot files written by scrape_boulders.py.')
+    parser.add_argument(
+        'input',
+        type=str,
+        nargs='+',
+        help='snapshot files to convert')
+    parser.add_argument(
+        '--format',
+        type=str,
+        choices=list(SNAPSHOT_FORMATS.keys()),
+        default='jsonl',
+        help='output format (default: jsonl)')
+    parser.add_argument(
+        '--output-dir',
+        type=str,
+        help=('directory where converted files are saved '
+              '(default: next to the input files)'))
+    parser.add_argument(
+        '--overwrite',
+        action='store_true',
+        help='overwrite the output files if they exist')
+    args = parser.parse_args()
+
+    output_fmt = SNAPSHOT_FORMATS[args.format]
+    for input_filename in args.input:
+        input_fmt = get_snapshot_format(input_filename)
+        output_filename = input_filename[:-len(input_fmt.extension)]
+        output_filename += output_fmt.extension
+        if args.output_dir is not None:
+            os.makedirs(args.output_dir, exist_ok=True)
+            output_filename = os.path.join(
+                args.output_dir, os.path.basename(output_filename))
+        if os.path.exists(output_filename) and not args.overwrite:
+            raise ValueError('output file exists: {}'.format(output_filename))
+        n_snapshots = convert_snapshots(input_filename, output_filename)
+        print('Converted {} snapshots to: {}'.format(
+            n_snapshots, output_filename))
@@ -0,0 +1,632 @@
+#!/usr/bin/env python3
+
+import datetime
+import glob
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet
+
+import conversion
+import timeseries
+
+TIME_SERIES_COLUMNS = ['id', 'date', 'likesCount', 'likesRatio', 'sentsCount']
+_NO_DATES = np.array([], dtype='datetime64[ns]')
+
+def _gym_to_dirname(gym):
+    return 'gym={}'.format(str(gym).replace('/', '+'))
+
+def _dirname_to_gym(dirname):
+    return dirname[len('gym='):].replace('+', '/')
+
+def _month_to_dirname(month):
+    return 'month={}'.format(pd.Period(month, freq='M'))
+
+def _dirname_to_month(dirname):
+    return pd.Period(dirname[len('month='):], freq='M')
+
+def _write_parquet(df, filename):
+    ''' Atomically write a dataframe to a parquet file '''
+    df.to_parquet(filename + '.tmp', index=False)
+    os.replace(filename + '.tmp', filename)
+
+def _read_attributes_file(filename, columns=None, filters=None):
+    ''' Read a parquet file of attributes, upgrading earlier versions
+
+    Files written by earlier versions have a 'picture' column instead of
+    conversion.PICTURE_COLUMNS, which is read instead when any of these
+    columns is requested.
+    '''
+    read_columns = columns
+    if (columns is not None
+            and any(c in conversion.PICTURE_COLUMNS for c in columns)
+            and 'picture' in pyarrow.parquet.read_schema(filename).names):
+        read_columns = [c for c in columns
+                        if c not in conversion.PICTURE_COLUMNS] + ['picture']
+    attributes = pd.read_parquet(
+        filename, columns=read_columns, filters=filters)
+    attributes = conversion.upgrade_attributes(attributes)
+    if columns is not None:
+        attributes = attributes[columns]
+    return attributes
+
+def _canonical(value):
+    ''' Convert a value read from or written to parquet to a comparable form '''
+    if isinstance(value, dict):
+        return {k: _canonical(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, (datetime.datetime, np.datetime64)):
+        value = pd.Timestamp(value)
+        return None if pd.isna(value) else value.isoformat()
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+def _changed_rows(old, new):
+    ''' Select the rows of new that are absent from old or differ from it
+
+    Both dataframes must have an 'id' column, unless old is empty.
+    '''
+    if old.empty:
+        return new
+    old = old.set_index('id', drop=False)
+    columns = [c for c in new.columns if c in old.columns]
+    changed = []
+    for i, (b_id, row) in enumerate(zip(new.id, new[columns].itertuples(
+            index=False, name=None))):
+        if b_id not in old.index:
+            changed.append(i)
+            continue
+        old_row = old.loc[b_id, columns]
+        if _canonical(list(row)) != _canonical(list(old_row)):
+            changed.append(i)
+    return new.iloc[changed]
+
+def _apply_filters(df, filters):
+    ''' Apply filters in the pandas.read_parquet() format to a dataframe '''
+    ops = {
+        '==': lambda c, v: c == v,
+        '=': lambda c, v: c == v,
+        '!=': lambda c, v: c != v,
+        '<': lambda c, v: c < v,
+        '<=': lambda c, v: c <= v,
+        '>': lambda c, v: c > v,
+        '>=': lambda c, v: c >= v,
+        'in': lambda c, v: c.isin(v),
+        'not in': lambda c, v: ~c.isin(v),
+        }
+    mask = np.ones(len(df), dtype=bool)
+    for column, op, value in filters:
+        mask &= ops[op](df[column], value).to_numpy(dtype=bool)
+    return df[mask]
+
+class BoulderStore():
+    ''' Columnar storage of reduced boulders
+
+    The data are stored as parquet files in two tables:
+
+    - attributes/gym=<gym>/attributes.parquet, containing the static
+      attributes of the boulders, with one row per boulder;
+    - time/gym=<gym>/month=<YYYY-MM>/*.parquet, containing the time series of
+      all boulders in long format (id, date, likesCount, likesRatio,
+      sentsCount).
+
+    Data added with append() are written to small delta-<n>.parquet segments
+    next to these files, until they are merged by compact(). The date of the
+    latest sample of each gym (the watermark) is kept in meta.json.
+
+    The time series of a gym can be stored with the 'changes' encoding of
+    the timeseries module, which only keeps the samples at which a value
+    changes. The dates of all the samples are then kept in
+    dates/gym=<gym>/*.parquet, so that the time series can be expanded when
+    they are read. Each month is encoded on its own, so that the months
+    between two dates are enough to expand the time series between them.
+    Gyms written by earlier versions were encoded as a whole, and are listed
+    in the 'whole_encodings' item of meta.json.
+
+    Parameters
+    ==========
+    path : str
+        Root directory of the store.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    @property
+    def attributes_dir(self):
+        return os.path.join(self.path, 'attributes')
+
+    @property
+    def time_dir(self):
+        return os.path.join(self.path, 'time')
+
+    @property
+    def dates_dir(self):
+        return os.path.join(self.path, 'dates')
+
+    @property
+    def meta_filename(self):
+        return os.path.join(self.path, 'meta.json')
+
+    def exists(self):
+        return os.path.isdir(self.attributes_dir)
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_filename) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            meta = {'watermarks': {}, 'segment': 0}
+        meta.setdefault('encodings', {})
+        if 'whole_encodings' not in meta:
+            meta['whole_encodings'] = [
+                gym for gym, encoding in meta['encodings'].items()
+                if encoding != 'samples']
+        return meta
+
+    def _write_meta(self, meta):
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.meta_filename + '.tmp', 'w') as f:
+            json.dump(meta, f, indent=2, sort_keys=True)
+        os.replace(self.meta_filename + '.tmp', self.meta_filename)
+
+    def _list_attributes_files(self, gym):
+        ''' List the attributes files of a gym, base file first '''
+        return sorted(glob.glob(os.path.join(
+            self.attributes_dir, _gym_to_dirname(gym), '*.parquet')))
+
+    def _list_dates_files(self, gym):
+        return sorted(glob.glob(os.path.join(
+            self.dates_dir, _gym_to_dirname(gym), '*.parquet')))
+
+    def get_encoding(self, gym):
+        ''' Get the encoding of the time series of a gym '''
+        return self._read_meta()['encodings'].get(gym, 'samples')
+
+    def list_gyms(self):
+        gym_dirs = sorted(glob.glob(os.path.join(self.attributes_dir, 'gym=*')))
+        return [_dirname_to_gym(os.path.basename(d)) for d in gym_dirs]
+
+    def _list_time_files(self, gyms=None, start=None, end=None):
+        ''' List the time series files, pruning partitions by gym and month '''
+        if gyms is None:
+            gyms = self.list_gyms()
+        start_month = pd.Period(start, freq='M') if start is not None else None
+        end_month = pd.Period(end, freq='M') if end is not None else None
+        files = []
+        for gym in gyms:
+            month_dirs = sorted(glob.glob(os.path.join(
+                self.time_dir, _gym_to_dirname(gym), 'month=*')))
+            for month_dir in month_dirs:
+                month = _dirname_to_month(os.path.basename(month_dir))
+                if start_month is not None and month < start_month:
+                    continue
+                if end_month is not None and month > end_month:
+                    continue
+                files += sorted(glob.glob(os.path.join(month_dir, '*.parquet')))
+        return files
+
+    # writers -----------------------------------------------------------------
+
+    def write(self, boulders, encoding='samples'):
+        ''' Write reduced boulders, replacing the data of their gyms
+
+        Parameters
+        ==========
+        boulders : pandas.DataFrame
+            Reduced boulders, as returned by
+            manage_data.boulders_yaml_to_dataframe().
+        encoding : str (default: 'samples')
+            Encoding of the stored time series, one of timeseries.ENCODINGS.
+        '''
+        attributes, time_series = split_boulders(boulders)
+        dates = _get_sample_dates(boulders, attributes, time_series)
+        meta = self._read_meta()
+        for gym, gym_attributes in attributes.groupby('gym'):
+            gym_dir = _gym_to_dirname(gym)
+            for d in (self.attributes_dir, self.time_dir, self.dates_dir):
+                if os.path.exists(os.path.join(d, gym_dir)):
+                    shutil.rmtree(os.path.join(d, gym_dir))
+            self._write_attributes(gym, gym_attributes, 'attributes')
+            gym_time_series = time_series[
+                time_series.id.isin(gym_attributes.id)]
+            if len(gym_time_series):
+                meta['watermarks'][gym] = gym_time_series.date.max().isoformat()
+            if encoding != 'samples':
+                gym_dates = dates.get(gym, _NO_DATES)
+                self._write_dates(gym, gym_dates[
+                    (gym_dates >= gym_time_series.date.min())
+                    & (gym_dates <= gym_time_series.date.max())], 'part-0')
+            self._write_time_series(gym, gym_time_series, 'part-0', encoding)
+            meta['encodings'][gym] = encoding
+            if gym in meta['whole_encodings']:
+                meta['whole_encodings'].remove(gym)
+        self._write_meta(meta)
+
+    def append(self, boulders, encoding='samples'):
+        ''' Append reduced boulders to the store
+
+        Only the samples more recent than the watermark of their gym, and the
+        attributes of new or changed boulders, are written to a new delta
+        segment.
+
+        Parameters
+        ==========
+        boulders : pandas.DataFrame
+            Reduced boulders, as returned by
+            manage_data.boulders_yaml_to_dataframe().
+        encoding : str (default: 'samples')
+            Encoding of the time series of gyms that are not in the store
+            yet. Other gyms keep their encoding.
+
+        Returns
+        =======
+        n_samples : int
+            Number of appended samples.
+        '''
+        attributes, time_series = split_boulders(boulders)
+        dates = _get_sample_dates(boulders, attributes, time_series)
+        meta = self._read_meta()
+        segment = 'delta-{:06d}'.format(meta['segment'] + 1)
+        n_samples = 0
+        for gym, gym_attributes in attributes.groupby('gym'):
+            gym_encoding = meta['encodings'].setdefault(gym, encoding)
+            changed_attributes = _changed_rows(
+                self._read_gym_attributes(gym), gym_attributes)
+            if len(changed_attributes):
+                self._write_attributes(gym, changed_attributes, segment)
+            gym_time_series = time_series[
+                time_series.id.isin(gym_attributes.id)]
+            watermark = meta['watermarks'].get(gym)
+            if watermark is not None:
+                gym_time_series = gym_time_series[
+                    gym_time_series.date > pd.Timestamp(watermark)]
+            if len(gym_time_series):
+                n_samples += len(gym_time_series)
+                if gym_encoding != 'samples':
+                    gym_dates = dates.get(gym, _NO_DATES)
+                    self._write_dates(gym, gym_dates[
+                        (gym_dates >= gym_time_series.date.min())
+                        & (gym_dates <= gym_time_series.date.max())], segment)
+                meta['watermarks'][gym] = gym_time_series.date.max().isoformat()
+                self._write_time_series(
+                    gym, gym_time_series, segment, gym_encoding)
+        meta['segment'] += 1
+        self._write_meta(meta)
+        return n_samples
+
+    def count_segments(self):
+        ''' Count the delta segments that are not yet compacted '''
+        return len(glob.glob(os.path.join(self.path, '*', '**', 'delta-*.parquet'),
+                             recursive=True))
+
+    def compact(self, gyms=None):
+        ''' Merge the delta segments into the base files
+
+        Parameters
+        ==========
+        gyms : list of str or None (default: None)
+            Gyms to compact. If None, compact all gyms.
+        '''
+        if gyms is None:
+            gyms = self.list_gyms()
+        for gym in gyms:
+            encoding = self.get_encoding(gym)
+            files = self._list_dates_files(gym)
+            if _has_delta(files):
+                self._write_dates(gym, self._read_dates(gym), 'part-0')
+                for fn in files:
+                    if os.path.basename(fn) != 'part-0.parquet':
+                        os.remove(fn)
+            files = self._list_attributes_files(gym)
+            if _has_delta(files):
+                self._write_attributes(
+                    gym, self._read_gym_attributes(gym), 'attributes')
+                for fn in files:
+                    if os.path.basename(fn) != 'attributes.parquet':
+                        os.remove(fn)
+            month_dirs = glob.glob(os.path.join(
+                self.time_dir, _gym_to_dirname(gym), 'month=*'))
+            for month_dir in month_dirs:
+                files = sorted(glob.glob(os.path.join(month_dir, '*.parquet')))
+                if not _has_delta(files):
+                    continue
+                month_time_series = pd.concat(
+                    [pd.read_parquet(fn) for fn in files], ignore_index=True)
+                month_time_series = month_time_series.sort_values(
+                    ['date', 'id'], kind='mergesort')
+                month_time_series = timeseries.encode(
+                    month_time_series, encoding)
+                _write_parquet(
+                    month_time_series,
+                    os.path.join(month_dir, 'part-0.parquet'))
+                for fn in files:
+                    if os.path.basename(fn) != 'part-0.parquet':
+                        os.remove(fn)
+
+    def _write_attributes(self, gym, attributes, part_name):
+        gym_dir = os.path.join(self.attributes_dir, _gym_to_dirname(gym))
+        os.makedirs(gym_dir, exist_ok=True)
+        _write_parquet(attributes, os.path.join(gym_dir, part_name + '.parquet'))
+
+    def _write_dates(self, gym, dates, part_name):
+        gym_dir = os.path.join(self.dates_dir, _gym_to_dirname(gym))
+        os.makedirs(gym_dir, exist_ok=True)
+        _write_parquet(pd.DataFrame({'date': dates}),
+                       os.path.join(gym_dir, part_name + '.parquet'))
+
+    def _write_time_series(self, gym, time_series, part_name,
+                           encoding='samples'):
+        months = time_series.date.dt.to_period('M')
+        for month, month_time_series in time_series.groupby(months):
+            month_dir = os.path.join(
+                self.time_dir, _gym_to_dirname(gym), _month_to_dirname(month))
+            os.makedirs(month_dir, exist_ok=True)
+            month_time_series = month_time_series.sort_values(['date', 'id'])
+            month_time_series = timeseries.encode(month_time_series, encoding)
+            _write_parquet(
+                month_time_series,
+                os.path.join(month_dir, part_name + '.parquet'))
+
+    # readers -----------------------------------------------------------------
+
+    def _read_dates(self, gym):
+        ''' Read the dates of the samples of a gym '''
+        frames = [pd.read_parquet(fn) for fn in self._list_dates_files(gym)]
+        if not frames:
+            return np.array([], dtype='datetime64[ns]')
+        return np.unique(pd.concat(frames).date.to_numpy())
+
+    def _read_gym_attributes(self, gym, columns=None, filters=None):
+        ''' Read the attributes of a gym, merging the delta segments
+
+        Filters are pushed down to parquet when there is no delta segment,
+        and are applied after merging the segments otherwise.
+        '''
+        files = self._list_attributes_files(gym)
+        if not files:
+            return pd.DataFrame(columns=columns)
+        if len(files) == 1:
+            return _read_attributes_file(
+                files[0], columns=columns, filters=filters)
+        read_columns = columns
+        if columns is not None and filters is not None:
+            read_columns = list(dict.fromkeys(
+                list(columns) + [f[0] for f in filters]))
+        attributes = pd.concat(
+            [_read_attributes_file(fn, columns=read_columns) for fn in files],
+            ignore_index=True)
+        attributes = attributes.drop_duplicates('id', keep='last')
+        if filters is not None:
+            attributes = _apply_filters(attributes, filters)
+        if columns is not None:
+            attributes = attributes[columns]
+        return attributes.reset_index(drop=True)
+
+    def read_attributes(self, columns=None, gyms=None, filters=None):
+        ''' Read the static attributes of boulders
+
+        Parameters
+        ==========
+        columns : list of str or None (default: None)
+            Columns to load. If None, load all columns.
+        gyms : list of str or None (default: None)
+            Gyms to load. If None, load all gyms.
+        filters : list or None (default: None)
+            Row filters passed to pandas.read_parquet().
+
+        Returns
+        =======
+        attributes : pandas.DataFrame
+            Static attributes, indexed by boulder id.
+        '''
+        if gyms is None:
+            gyms = self.list_gyms()
+        if columns is not None and 'id' not in columns:
+            columns = ['id'] + list(columns)
+        frames = [
+            self._read_gym_attributes(gym, columns=columns, filters=filters)
+            for gym in gyms]
+        frames = [f for f in frames if len(f.columns)]
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        attributes = pd.concat(frames, ignore_index=True)
+        return attributes.set_index(attributes.id)
+
+    def read_time_series(self, columns=None, gyms=None, ids=None,
+                         start=None, end=None, expand=False):
+        ''' Read boulders time series in long format
+
+        Parameters
+        ==========
+        columns : list of str or None (default: None)
+            Columns to load. If None, load all columns. The 'id' and 'date'
+            columns are always loaded.
+        gyms : list of str or None (default: None)
+            Gyms to load. If None, load all gyms.
+        ids : list of str or None (default: None)
+            Boulders to load. If None, load all boulders.
+        start, end : datetime.datetime or None (default: None)
+            If not None, only load samples such that start <= date <= end.
+        expand : bool (default: False)
+            If True, expand the time series of gyms stored with the
+            'changes' encoding to the dates of all their samples, see
+            timeseries.resample(). Otherwise, they are returned as stored,
+            with one sample per change, and the first and last samples of
+            each boulder in each month.
+
+        Returns
+        =======
+        time_series : pandas.DataFrame
+            Time series in long format, sorted by date.
+        '''
+        if columns is not None:
+            columns = list(dict.fromkeys(['id', 'date'] + list(columns)))
+        if ids is not None and len(ids) == 0:
+            return pd.DataFrame(columns=columns or TIME_SERIES_COLUMNS)
+        if gyms is None:
+            gyms = self.list_gyms()
+        filters = []
+        if start is not None:
+            filters.append(('date', '>=', pd.Timestamp(start)))
+        if end is not None:
+            filters.append(('date', '<=', pd.Timestamp(end)))
+        if ids is not None:
+            filters.append(('id', 'in', list(ids)))
+        meta = self._read_meta()
+        frames = []
+        for gym in gyms:
+            if expand and meta['encodings'].get(gym, 'samples') != 'samples':
+                frames.append(self._read_expanded_time_series(
+                    gym, columns, ids, start, end,
+                    by_month=gym not in meta['whole_encodings']))
+                continue
+            for fn in self._list_time_files(gyms=[gym], start=start, end=end):
+                frames.append(pd.read_parquet(
+                    fn, columns=columns, filters=filters or None))
+        frames = [f for f in frames if len(f.columns)]
+        if not frames:
+            return pd.DataFrame(columns=columns or TIME_SERIES_COLUMNS)
+        time_series = pd.concat(frames, ignore_index=True)
+        return time_series.sort_values('date', kind='mergesort',
+                                       ignore_index=True)
+
+    def _read_expanded_time_series(self, gym, columns, ids, start, end,
+                                   by_month=True):
+        filters = [('id', 'in', list(ids))] if ids is not None else None
+        if by_month:
+            # the months of start and end hold the samples needed to expand
+            # the time series between them
+            files = self._list_time_files(gyms=[gym], start=start, end=end)
+        else:
+            # the samples before start and after end are needed to expand
+            # the time series between them
+            files = self._list_time_files(gyms=[gym])
+        frames = [pd.read_parquet(fn, columns=columns, filters=filters)
+                  for fn in files]
+        if not frames:
+            return pd.DataFrame(columns=columns or TIME_SERIES_COLUMNS)
+        time_series = timeseries.resample(
+            pd.concat(frames, ignore_index=True), self._read_dates(gym))
+        if start is not None:
+            time_series = time_series[time_series.date >= pd.Timestamp(start)]
+        if end is not None:
+            time_series = time_series[time_series.date <= pd.Timestamp(end)]
+        return time_series
+
+    def read_boulders(self, columns=None, gyms=None, filters=None,
+                      start=None, end=None, expand=False):
+        ''' Read reduced boulders in the format of manage_data
+
+        Parameters
+        ==========
+        columns : list of str or None (default: None)
+            Attribute columns to load. If None, load all columns.
+        gyms : list of str or None (default: None)
+            Gyms to load. If None, load all gyms.
+        filters : list or None (default: None)
+            Filters on attributes, passed to pandas.read_parquet().
+        start, end : datetime.datetime or None (default: None)
+            If not None, only load samples such that start <= date <= end.
+        expand : bool (default: False)
+            If True, expand time series stored with the 'changes' encoding.
+
+        Returns
+        =======
+        boulders : pandas.DataFrame
+            A dataframe containing the boulders attributes, and their time
+            series in a 'time' column.
+        '''
+        attributes = self.read_attributes(
+            columns=columns, gyms=gyms, filters=filters)
+        ids = list(attributes.index) if filters is not None else None
+        time_series = self.read_time_series(
+            gyms=gyms, ids=ids, start=start, end=end, expand=expand)
+        return join_boulders(attributes, time_series)
+
+    def watermarks(self, gyms=None):
+        ''' Get the date of the most recent sample of each gym
+
+        Returns
+        =======
+        watermarks : dict
+            Mapping between gyms and the date of their latest sample.
+        '''
+        watermarks = self._read_meta()['watermarks']
+        return {k: pd.Timestamp(v) for k, v in watermarks.items()
+                if gyms is None or k in gyms}
+
+    def latest_date(self, gyms=None):
+        ''' Get the date of the most recent sample, or None if empty '''
+        watermarks = self.watermarks(gyms)
+        if not watermarks:
+            return None
+        return max(watermarks.values())
+
+def _has_delta(files):
+    ''' Whether some of the files of a table are delta segments '''
+    return any(os.path.basename(fn).startswith('delta-') for fn in files)
+
+def _get_sample_dates(boulders, attributes, time_series):
+    ''' Get the dates of the samples of each gym, before encoding '''
+    dates = boulders.attrs.get('dates')
+    if dates is None:
+        dates = timeseries.get_gym_dates(
+            time_series, attributes.set_index('id').gym)
+    elif not isinstance(dates, dict):
+        # reduced by earlier versions, with one grid for all gyms
+        dates = {gym: dates for gym in attributes.gym.unique()}
+    return {gym: np.unique(pd.to_datetime(np.asarray(d)).to_numpy())
+            for gym, d in dates.items()}
+
+def split_boulders(boulders):
+    ''' Split reduced boulders into attributes and long time series tables
+
+    Parameters
+    ==========
+    boulders : pandas.DataFrame
+        Reduced boulders, as returned by
+        manage_data.boulders_yaml_to_dataframe().
+
+    Returns
+    =======
+    attributes : pandas.DataFrame
+        Static attributes, with one row per boulder.
+    time_series : pandas.DataFrame
+        Time series in long format, with columns TIME_SERIES_COLUMNS.
+    '''
+    attributes = boulders.drop(columns='time').reset_index(drop=True)
+    attributes = conversion.upgrade_attributes(attributes)
+    frames = []
+    for b_id, time in zip(boulders.id, boulders.time):
+        time = time.copy()
+        time['id'] = b_id
+        frames.append(time)
+    if frames:
+        time_series = pd.concat(frames, ignore_index=True)
+    else:
+        time_series = pd.DataFrame(columns=TIME_SERIES_COLUMNS)
+    time_series = time_series.reindex(columns=TIME_SERIES_COLUMNS)
+    time_series['date'] = pd.to_datetime(time_series.date)
+    return attributes, time_series
+
+def join_boulders(attributes, time_series):
+    ''' Join attributes and long time series into reduced boulders
+
+    This is the reverse of split_boulders().
+    '''
+    boulders = attributes.copy()
+    time_columns = [c for c in time_series.columns if c != 'id']
+    empty_time = pd.DataFrame(columns=time_columns)
+    time = {b_id: t.drop(columns='id').reset_index(drop=True)
+            for b_id, t in time_series.groupby('id', sort=False)}
+    boulders['time'] = timeseries.frames_column(
+        [time.get(b_id, empty_time) for b_id in boulders.index])
+    return boulders
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+import datetime
+import os
+import random
+
+import snapshots
+
+class SyntheticGym():
+    ''' Deterministic simulation of the boulders of a gym
+
+    The gym keeps a fixed number of open boulders. Each day, a fraction of
+    them, given by churn, is closed and replaced by new boulders. A closed
+    boulder is listed with its closedAt date in the next snapshot, and then
+    disappears. Open boulders get sents and likes at random.
+
+    Parameters
+    ==========
+    gym : str
+        Gym name.
+    n_boulders : int
+        Number of open boulders.
+    start : datetime.datetime
+        Date of the first snapshot.
+    churn : float (default: 0.02)
+        Fraction of the boulders replaced each day.
+    sents_per_day : float (default: 2)
+        Mean number of sents of a boulder per day.
+    seed : int (default: 0)
+        Seed of the random number generator, which is combined with the gym
+        name so that gyms differ.
+    '''
+    def __init__(self, gym, n_boulders, start, churn=0.02, sents_per_day=2,
+                 seed=0):
+        self.gym = gym
+        self.n_boulders = n_boulders
+        self.churn = churn
+        self.sents_per_day = sents_per_day
+        self.date = start
+        self.rnd = random.Random('{}:{}'.format(seed, gym))
+        self.boulders = {}
+        self.closed = {}
+        self._n_added = 0
+        self._to_close = 0.
+        # boulders have been open for up to their expected lifetime
+        lifetime = 1 / churn if churn > 0 else 90
+        for _ in range(n_boulders):
+            self._add_boulder(
+                start - datetime.timedelta(days=self.rnd.uniform(0, lifetime)))
+
+    @staticmethod
+    def _ejson_date(date):
+        return {'$date': int(date.timestamp() * 1e3)}
+
+    def _add_boulder(self, added_at):
+        i = self._n_added
+        self._n_added += 1
+        b_id = '{}-{:06d}'.format(self.gym.replace('/', '-'), i)
+        picture_id = '{}-picture{:06d}'.format(self.gym.replace('/', '-'), i)
+        self.boulders[b_id] = {
+            'addedAt': self._ejson_date(added_at),
+            'boulderNum': i,
+            'closedAt': None,
+            'comment': '',
+            'createdAt': self._ejson_date(
+                added_at - datetime.timedelta(days=1)),
+            'girly': False,
+            'grade': self.rnd.randint(1, 9),
+            'gym': self.gym,
+            'holdsColor': self.rnd.randint(2, 7),
+            'label': self.rnd.randint(0, 9),
+            'picture': {
+                'id': picture_id, 'ratio': 1., 'width': 800,
+                'zoom': picture_id + '-zoom',
+                'crop': {'x': 0, 'y': 0, 'width': 800, 'height': 800},
+                },
+            'routeSetter': ['setter{}'.format(self.rnd.randint(0, 9))],
+            'routeTypes': [],
+            'updatedAt': self._ejson_date(added_at),
+            'zone': self.rnd.randint(1, 5),
+            'likesCount': 0,
+            'likesRatio': 0.,
+            'sentsCount': 0,
+            'likesList': [],
+            'sentsList': [],
+            }
+
+    def advance(self, date):
+        ''' Simulate the gym until date '''
+        days = (date - self.date).total_seconds() / 86400
+        self.date = date
+        self.closed = {}
+        self._to_close += self.churn * self.n_boulders * days
+        n_close = min(int(self._to_close), len(self.boulders))
+        self._to_close -= n_close
+        for b_id in self.rnd.sample(sorted(self.boulders), n_close):
+            b = self.boulders.pop(b_id)
+            b['closedAt'] = b['updatedAt'] = self._ejson_date(date)
+            self.closed[b_id] = b
+            self._add_boulder(date)
+        p_sent = min(1., self.sents_per_day * days)
+        for b in self.boulders.values():
+            if self.rnd.random() < p_sent:
+                b['sentsCount'] += 1
+                b['likesCount'] += self.rnd.randint(0, 1)
+                b['likesRatio'] = b['likesCount'] / b['sentsCount']
+
+    def snapshot(self):
+        ''' Get the boulders collection, as scraped by scrape_boulders.py '''
+        boulders = {b_id: dict(b) for b_id, b in self.closed.items()}
+        boulders.update((b_id, dict(b)) for b_id, b in self.boulders.items())
+        return boulders
+
+def make_gym_snapshots(n_gyms, n_boulders, n_snapshots, interval=3600,
+                       churn=0.02, start=datetime.datetime(2019, 1, 1),
+                       seed=0):
+    ''' Generate synthetic scrapes of several gyms
+
+    Each gym is scraped every interval seconds, a few seconds after the
+    previous gym, as by one scrape_boulders.py --repeat per gym.
+
+    Parameters
+    ==========
+    n_gyms : int
+        Number of gyms, named 'synthetic/gym<i>'.
+    n_boulders : int
+        Number of open boulders in each gym.
+    n_snapshots : int
+        Number of snapshots of each gym.
+    interval : float (default: 3600)
+        Time between two snapshots of a gym, in seconds.
+    churn : float (default: 0.02)
+        Fraction of the boulders replaced each day, see SyntheticGym.
+    start : datetime.datetime (default: 2019-01-01)
+        Date of the first snapshot.
+    seed : int (default: 0)
+        Seed of the random number generator.
+
+    Yields
+    ======
+    gym : str
+        Gym name.
+    timestamp : str
+        Date of the snapshot.
+    boulders : dict
+        The scraped boulders collection.
+    '''
+    gyms = [SyntheticGym('synthetic/gym{}'.format(i), n_boulders,
+                         start + datetime.timedelta(seconds=10 * i),
+                         churn=churn, seed=seed)
+            for i in range(n_gyms)]
+    for i in range(n_snapshots):
+        for gym in gyms:
+            if i > 0:
+                gym.advance(gym.date + datetime.timedelta(seconds=interval))
+            yield gym.gym, gym.date.isoformat(), gym.snapshot()
+
+def get_snapshot_filename(output_dir, gym, timestamp, fmt='yaml'):
+    ''' Get the name of a snapshot file, as written by scrape_boulders.py '''
+    return os.path.join(output_dir, '{}_{}{}'.format(
+        gym.replace('/', '+'), timestamp,
+        snapshots.SNAPSHOT_FORMATS[fmt].extension))
+
+def write_gym_snapshots(output_dir, n_gyms, n_boulders, n_snapshots,
+                        fmt='yaml', **kwargs):
+    ''' Write synthetic scrapes of several gyms, one file per snapshot
+
+    The snapshots are recorded in the snapshots.SnapshotManifest of
+    output_dir. Keyword arguments are passed to make_gym_snapshots().
+
+    Returns
+    =======
+    filenames : list of str
+        The written files, in date order.
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    filenames = []
+    for gym, timestamp, boulders in make_gym_snapshots(
+            n_gyms, n_boulders, n_snapshots, **kwargs):
+        fn = get_snapshot_filename(output_dir, gym, timestamp, fmt=fmt)
+        snapshots.write_snapshot(fn, 'w', timestamp, boulders)
+        filenames.append(fn)
+    return filenames
+
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(
+        description=('Write synthetic boulders snapshots, in the format of '
+                     'scrape_boulders.py.'))
+    parser.add_argument(
+        'output_dir',
+        type=str,
+        help='directory where the snapshots are written')
+    parser.add_argument(
+        '--gyms',
+        type=int,
+        default=1,
+        help='number of gyms (default: 1)')
+    parser.add_argument(
+        '--boulders',
+        type=int,
+        default=300,
+        help='number of open boulders in each gym (default: 300)')
+    parser.add_argument(
+        '--snapshots',
+        type=int,
+        default=100,
+        help='number of snapshots of each gym (default: 100)')
+    parser.add_argument(
+        '--interval',
+        type=float,
+        default=3600,
+        help='time between two snapshots of a gym, in seconds (default: 3600)')
+    parser.add_argument(
+        '--churn',
+        type=float,
+        default=0.02,
+        help='fraction of the boulders replaced each day (default: 0.02)')
+    parser.add_argument(
+        '--start',
+        type=datetime.datetime.fromisoformat,
+        default=datetime.datetime(2019, 1, 1),
+        help='date of the first snapshot (default: 2019-01-01)')
+    parser.add_argument(
+        '--format',
+        type=str,
+        choices=[f for f in snapshots.SNAPSHOT_FORMATS if f != 'deltas'],
+        default='yaml',
+        help='format of the snapshots (default: yaml)')
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='seed of the random number generator (default: 0)')
+    args = parser.parse_args()
+
+    filenames = write_gym_snapshots(
+        args.output_dir, args.gyms, args.boulders, args.snapshots,
+        fmt=args.format, interval=args.interval, churn=args.churn,
+        start=args.start, seed=args.seed)
+    print('Wrote {} snapshots to: {}'.format(len(filenames), args.output_dir))
@@ -0,0 +1,68 @@
+import datetime
+import os
+
+import cache
+import manage_data
+import snapshots
+
+from test_reduce import assert_boulders_equal, write_snapshots
+
+def test_cache_hits_until_file_changes(tmp_path):
+    fn = tmp_path / 'gym.yml'
+    fn.write_text('a: 1\n')
+    snapshot_cache = cache.SnapshotCache(str(tmp_path / 'cache'))
+    assert snapshot_cache.get(str(fn)) is None
+    snapshot_cache.put(str(fn), ['records'])
+    assert snapshot_cache.get(str(fn)) == ['records']
+    assert snapshot_cache.get(str(fn), options=('likesList',)) is None
+
+    # same content, new mtime: the content hash is checked
+    stat = os.stat(fn)
+    os.utime(fn, (stat.st_atime, stat.st_mtime + 10))
+    assert snapshot_cache.get(str(fn)) == ['records']
+    # same size, new content
+    fn.write_text('a: 2\n')
+    os.utime(fn, (stat.st_atime, stat.st_mtime + 20))
+    assert snapshot_cache.get(str(fn)) is None
+    snapshot_cache.put(str(fn), ['new records'])
+    # appended file
+    with fn.open('a') as f:
+        f.write('b: 3\n')
+    assert snapshot_cache.get(str(fn)) is None
+    assert (snapshot_cache.hits, snapshot_cache.misses) == (2, 4)
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    snapshot_cache = cache.SnapshotCache(str(tmp_path / 'cache'))
+    filenames = []
+    for i in range(3):
+        fn = tmp_path / 'gym{}.yml'.format(i)
+        fn.write_text('a: {}\n'.format(i))
+        filenames.append(str(fn))
+        snapshot_cache.put(str(fn), [i] * 1000)
+        entry = snapshot_cache._entry_filename(str(fn), None)
+        os.utime(entry, (i, i))
+    snapshot_cache.get(filenames[0])  # marks it as recently used
+    entry_size = os.path.getsize(entry)
+    snapshot_cache.max_size = 2 * entry_size
+    snapshot_cache.evict()
+    assert snapshot_cache.get(filenames[0]) == [0] * 1000
+    assert snapshot_cache.get(filenames[1]) is None
+    assert snapshot_cache.get(filenames[2]) == [2] * 1000
+
+def test_cached_reduce_sees_appended_snapshots(tmp_path):
+    filenames = write_snapshots(tmp_path, n_snapshots=4)
+    snapshot_cache = cache.SnapshotCache(str(tmp_path / 'cache'))
+    manage_data.boulders_yaml_to_dataframe(filenames, cache=snapshot_cache)
+    fn = filenames[0]
+    date_str, boulders = list(snapshots.read_snapshots(fn))[-1]
+    date = datetime.datetime.fromisoformat(date_str)
+    for fields in boulders.values():
+        fields['sentsCount'] += 1
+    snapshots.write_snapshot(
+        fn, 'a', (date + datetime.timedelta(hours=1)).isoformat(), boulders,
+        manifest=False)
+    cached = manage_data.boulders_yaml_to_dataframe(
+        filenames, cache=snapshot_cache)
+    assert snapshot_cache.misses == len(filenames) + 1
+    assert_boulders_equal(
+        cached, manage_data.boulders_yaml_to_dataframe(filenames))
@@ -0,0 +1,24 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+import conversion
+import manage_data
+import synthetic
+
+def test_to_bool_missing_values_are_false():
+    values = pd.Series([True, False, None, np.nan], dtype=object)
+    converted, failures = conversion.to_bool(values)
+    assert list(converted) == [True, False, False, False]
+    assert failures == 0
+
+def test_reduce_boulders_without_girly_field():
+    gym = synthetic.SyntheticGym(
+        'synthetic/gym0', 3, datetime.datetime(2019, 1, 1))
+    boulders = gym.snapshot()
+    for boulder in boulders.values():
+        del boulder['girly']
+    reduced = manage_data.boulders_snapshots_to_dataframe(
+        {gym.date.isoformat(): boulders})
+    assert list(reduced.girly) == [False] * 3
@@ -0,0 +1,91 @@
+import copy
+import datetime
+import gzip
+
+import bokeh.document
+import bokeh.document.events
+import pytest
+
+import dashboard
+import snapshots
+import synthetic
+
+def make_gym(n_boulders=5):
+    return synthetic.SyntheticGym(
+        'synthetic/gym0', n_boulders, datetime.datetime(2019, 1, 1),
+        churn=0, sents_per_day=0)
+
+def advance(gym, hours=6):
+    gym.advance(gym.date + datetime.timedelta(hours=hours))
+    return gym.date.isoformat(), copy.deepcopy(gym.snapshot())
+
+@pytest.mark.parametrize('fmt', sorted(snapshots.SNAPSHOT_FORMATS))
+def test_snapshot_file_reader_reads_appended_snapshots(tmp_path, fmt):
+    gym = make_gym()
+    fn = str(tmp_path / ('gym' + snapshots.SNAPSHOT_FORMATS[fmt].extension))
+    reader = snapshots.SnapshotFileReader(fn)
+    written = []
+    for mode in ['w', 'a']:
+        written.append(advance(gym))
+        snapshots.write_snapshot(fn, mode, *written[-1], manifest=False)
+    assert reader.read() == written
+    assert reader.read() == []
+    written.append(advance(gym))
+    snapshots.write_snapshot(fn, 'a', *written[-1], manifest=False)
+    assert reader.read() == written[2:]
+    assert list(snapshots.read_snapshots(fn)) == written
+
+def test_snapshot_file_reader_waits_for_complete_snapshots(tmp_path):
+    gym = make_gym()
+    fn = str(tmp_path / 'gym.jsonl.gz')
+    date_str, boulders = advance(gym)
+    snapshots.write_snapshot(fn, 'w', date_str, boulders, manifest=False)
+    reader = snapshots.SnapshotFileReader(fn)
+    assert len(reader.read()) == 1
+    member = open(fn, 'rb').read()
+    with open(fn, 'ab') as f:
+        f.write(member[:len(member) // 2])
+    assert reader.read() == []
+    with open(fn, 'ab') as f:
+        f.write(member[len(member) // 2:])
+    assert reader.read() == [(date_str, boulders)]
+
+def get_patches(events, source, column):
+    hints = [event.hint for event in events]
+    return [hint.patches[column] for hint in hints
+            if isinstance(hint, bokeh.document.events.ColumnsPatchedEvent)
+            and hint.column_source is source and column in hint.patches]
+
+def test_dashboard_streams_new_samples():
+    gym = make_gym()
+    live = dashboard.LiveBoulders()
+    live.add_snapshot(*advance(gym))
+    live.add_snapshot(*advance(gym))
+    doc = bokeh.document.Document()
+    d = dashboard.Dashboard(doc, live, 'gym')
+    assert len(d.source.data['boulderAge']) == 5
+    events = []
+    doc.on_change(events.append)
+
+    # the values of the boulders do not change, but their lines are extended
+    live.add_snapshot(*advance(gym))
+    d.update()
+    assert len(d.segments.data['x0']) == 5
+    assert get_patches(events, d.source, 'visible') == []
+    live.add_snapshot(*advance(gym))
+    d.update()
+    assert len(d.segments.data['x0']) == 10
+    assert all(d.segments.data['visible'])
+
+    # only the rows of the closed boulder are hidden
+    date_str, boulders = advance(gym)
+    b_id = sorted(boulders)[0]
+    boulders[b_id]['closedAt'] = {'$date': 1546300800000}
+    live.add_snapshot(date_str, boulders)
+    d.update()
+    row = d.rows[b_id]
+    assert get_patches(events, d.source, 'visible') == [[(row, False)]]
+    assert not d.source.data['visible'][row]
+    assert [d.segments.data['visible'][r] for r in d.segment_rows[b_id]] == [
+        False] * 3
+    assert sum(d.segments.data['visible']) == 12
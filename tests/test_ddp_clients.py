@@ -0,0 +1,86 @@
+import asyncio
+import datetime
+
+import ejson
+import pytest
+
+import async_ddp_client
+import fake_ddp_server
+import schema
+import scrape_boulders
+import synthetic
+
+from test_scheduler import SilentServer
+
+def make_boulders():
+    boulders = {}
+    for gym in ['synthetic/gym0', 'synthetic/gym1']:
+        boulders.update(synthetic.SyntheticGym(
+            gym, 5, datetime.datetime(2019, 1, 1)).snapshot())
+    return boulders
+
+def gym_boulders(boulders, gym):
+    return {b_id: fields for b_id, fields in boulders.items()
+            if fields['gym'] == gym}
+
+def test_async_client_scrapes_a_gym():
+    boulders = make_boulders()
+
+    async def main():
+        server = fake_ddp_server.FakeDDPServer(boulders)
+        await server.start()
+        try:
+            return await async_ddp_client.scrape_gym(
+                server.url, 'synthetic/gym1')
+        finally:
+            await server.stop()
+    scraped = asyncio.run(main())
+    # ejson decodes dates
+    assert scraped == ejson.loads(ejson.dumps(
+        gym_boulders(boulders, 'synthetic/gym1')))
+
+def test_async_client_methods_and_errors():
+
+    async def main():
+        server = fake_ddp_server.FakeDDPServer({})
+        await server.start()
+        try:
+            async with async_ddp_client.AsyncDDPClient(server.url) as client:
+                result = await client.method('echo', [1, 'a'])
+                assert await result == [1, 'a']
+                _, ready = await client.sub('unknown', [])
+                with pytest.raises(async_ddp_client.DDPError):
+                    await ready
+        finally:
+            await server.stop()
+    asyncio.run(main())
+
+def test_async_client_fails_pending_requests_on_close():
+
+    async def main():
+        server = SilentServer({})
+        await server.start()
+        try:
+            async with async_ddp_client.AsyncDDPClient(server.url) as client:
+                _, ready = await client.sub('_boulders.list', [])
+                await client.ws.close()
+                with pytest.raises(async_ddp_client.DDPError):
+                    await ready
+        finally:
+            await server.stop()
+    asyncio.run(main())
+
+def test_boulders_client_scrapes_a_gym():
+    boulders = make_boulders()
+    server = fake_ddp_server.FakeDDPServer(boulders)
+    url = server.start_thread()
+    try:
+        client = scrape_boulders.BouldersClient(url, 'synthetic/gym0')
+        # the client closes the connection once the subscription is ready
+        client.run_forever()
+    finally:
+        server.stop_thread()
+    assert client.collections['boulders'] == {
+        b_id: {k: v for k, v in fields.items()
+               if k not in schema.DISCARDED_FIELDS}
+        for b_id, fields in gym_boulders(boulders, 'synthetic/gym0').items()}
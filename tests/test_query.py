@@ -0,0 +1,22 @@
+import pandas as pd
+
+import query
+import view_boulders
+
+def make_attributes():
+    return pd.DataFrame({
+        'gym': ['gym0'] * 4,
+        'holdsColor': [2, 3, 4, 5],
+        'grade': [1, 2, 3, 4],
+        'zone': [1, 1, 2, 2],
+        'addedAt': pd.to_datetime(
+            ['2019-01-01', '2019-01-01', None, '2019-01-01']),
+        'closedAt': pd.to_datetime(
+            ['2019-02-01', None, None, '2019-01-10']),
+        }, index=pd.Index(['a', 'b', 'c', 'd'], name='id'))
+
+def test_open_boulders():
+    index = query.BoulderIndex(make_attributes())
+    date = pd.Timestamp('2019-01-15')
+    # boulders without closedAt are open, boulders without addedAt are not
+    assert list(view_boulders.query_open_boulders(index, date)) == ['a', 'b']
@@ -0,0 +1,135 @@
+import copy
+import datetime
+
+import pandas as pd
+
+import manage_data
+import reduce_boulders
+import snapshots
+import store
+import synthetic
+
+def write_snapshots(tmp_path, n_snapshots=12):
+    return synthetic.write_gym_snapshots(
+        str(tmp_path / 'snapshots'), 2, 20, n_snapshots, fmt='jsonl',
+        interval=6 * 3600)
+
+def assert_boulders_equal(boulders, expected):
+    attributes, time_series = store.split_boulders(boulders.sort_index())
+    expected_attributes, expected_time_series = store.split_boulders(
+        expected.sort_index())
+    pd.testing.assert_frame_equal(attributes, expected_attributes)
+    pd.testing.assert_frame_equal(
+        time_series.sort_values(['id', 'date'], ignore_index=True),
+        expected_time_series.sort_values(['id', 'date'], ignore_index=True))
+
+def test_incremental_reduce_equals_full_reduce(tmp_path):
+    filenames = write_snapshots(tmp_path)
+    snapshot_dir = str(tmp_path / 'snapshots')
+    full = manage_data.boulders_yaml_to_dataframe(filenames)
+
+    previous = manage_data.boulders_yaml_to_dataframe(filenames[:10])
+    latest_date = reduce_boulders.get_latest_reduced_date(previous)
+    new_files = reduce_boulders.list_files_to_reduce(snapshot_dir, latest_date)
+    new = manage_data.boulders_yaml_to_dataframe(new_files, after=latest_date)
+    updated = manage_data.update_boulders(previous, new)
+
+    assert_boulders_equal(updated, full)
+
+def test_incremental_reduce_with_lagging_gym(tmp_path):
+    filenames = write_snapshots(tmp_path)
+    snapshot_dir = str(tmp_path / 'snapshots')
+    full = manage_data.boulders_yaml_to_dataframe(filenames)
+    # the snapshots of gym1 were not all reduced yet
+    lagging = [fn for fn in filenames if 'gym1' in fn]
+    reduced = [fn for fn in filenames if fn not in lagging[6:]]
+
+    previous = manage_data.boulders_yaml_to_dataframe(reduced)
+    watermark = reduce_boulders.get_reduced_watermark(
+        manage_data.get_watermarks(previous))
+    new_files = reduce_boulders.list_files_to_reduce(snapshot_dir, watermark)
+    new = manage_data.boulders_yaml_to_dataframe(new_files, after=watermark)
+    assert_boulders_equal(manage_data.update_boulders(previous, new), full)
+
+    boulder_store = store.BoulderStore(str(tmp_path / 'store'))
+    boulder_store.write(previous)
+    watermark = reduce_boulders.get_reduced_watermark(
+        boulder_store.watermarks())
+    new_files = reduce_boulders.list_files_to_reduce(snapshot_dir, watermark)
+    boulder_store.append(manage_data.boulders_yaml_to_dataframe(
+        new_files, after=watermark))
+    assert_boulders_equal(boulder_store.read_boulders(), full)
+
+def make_cleared_snapshots():
+    ''' Snapshots in which attributes of boulders are set, then cleared '''
+    gym = synthetic.SyntheticGym(
+        'synthetic/gym0', 5, datetime.datetime(2019, 1, 1), churn=0)
+    yaml_data = {}
+    for i in range(3):
+        if i:
+            gym.advance(gym.date + datetime.timedelta(hours=6))
+        yaml_data[gym.date.isoformat()] = copy.deepcopy(gym.snapshot())
+    first, second, last = (yaml_data[d] for d in sorted(yaml_data))
+    reopened, uncommented, missing = sorted(last)[:3]
+    # closed, then reopened
+    second[reopened]['closedAt'] = {'$date': 1546400000000}
+    last[reopened]['closedAt'] = None
+    # commented, then the comment is removed
+    first[uncommented]['comment'] = 'crimpy'
+    second[uncommented]['comment'] = 'crimpy'
+    del last[uncommented]['comment']
+    # missing from the last snapshot
+    del last[missing]
+    return yaml_data
+
+def baseline_reduce(yaml_data, props):
+    ''' The attributes and samples of boulders, as reduced by earlier versions
+
+    Attributes are taken from the last snapshot in which each boulder is
+    found, and are None when they are missing from it.
+    '''
+    attributes = {}
+    samples = []
+    for date_str in sorted(yaml_data):
+        for b_id, b in yaml_data[date_str].items():
+            attributes[b_id] = {prop: b.get(prop) for prop in props}
+            samples.append({
+                'id': b_id, 'date': pd.Timestamp(date_str),
+                'likesCount': b['likesCount'],
+                'likesRatio': b['likesRatio'],
+                'sentsCount': b['sentsCount']})
+    return attributes, pd.DataFrame(samples)
+
+def test_reduce_equals_baseline_reduction():
+    yaml_data = make_cleared_snapshots()
+    props = ['closedAt', 'comment', 'grade', 'gym', 'holdsColor', 'zone']
+    expected, expected_time_series = baseline_reduce(yaml_data, props)
+    boulders = manage_data.boulders_snapshots_to_dataframe(yaml_data)
+    assert sorted(boulders.index) == sorted(expected)
+    for b_id, b_expected in expected.items():
+        b = boulders.loc[b_id]
+        closed_at = b_expected['closedAt']
+        if closed_at is None:
+            assert pd.isna(b.closedAt)
+        else:
+            assert b.closedAt == pd.to_datetime(closed_at['$date'], unit='ms')
+        for prop in props[1:]:
+            assert b[prop] == b_expected[prop] or (
+                b_expected[prop] is None and pd.isna(b[prop])), (b_id, prop)
+    _, time_series = store.split_boulders(boulders)
+    pd.testing.assert_frame_equal(
+        time_series.sort_values(['id', 'date'], ignore_index=True),
+        expected_time_series.sort_values(['id', 'date'], ignore_index=True),
+        check_dtype=False)
+
+def test_streaming_reduce_equals_batch_reduce(tmp_path):
+    yaml_data = make_cleared_snapshots()
+    filenames = []
+    for i, (date_str, boulders) in enumerate(sorted(yaml_data.items())):
+        fn = str(tmp_path / 'snapshot{}.jsonl.gz'.format(i))
+        snapshots.write_snapshot(fn, 'w', date_str, boulders)
+        filenames.append(fn)
+    expected = manage_data.boulders_yaml_to_dataframe(filenames)
+    # files in reverse date order
+    boulders = manage_data.stream_reduce(filenames[::-1])
+    assert_boulders_equal(boulders, expected)
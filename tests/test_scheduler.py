@@ -0,0 +1,71 @@
+import datetime
+import time
+
+import pytest
+
+import fake_ddp_server
+import schedule_scrapes
+import schema
+import snapshots
+import synthetic
+
+class SilentServer(fake_ddp_server.FakeDDPServer):
+    ''' A server that never sends the boulders subscription '''
+    async def _publish(self, ws, id_, name, params):
+        pass
+
+def test_scrape_times_out_after_interval(tmp_path):
+    server = SilentServer({})
+    url = server.start_thread()
+    try:
+        target = schedule_scrapes.Target(url, 'some/gym', 1)
+        scheduler = schedule_scrapes.Scheduler(
+            [target], str(tmp_path), heartbeat_interval=None)
+        start = time.monotonic()
+        scheduler.scrape(url, [target])
+        assert time.monotonic() - start < 5
+    finally:
+        server.stop_thread()
+    assert target.timeout == 1
+    assert (target.runs, target.failures) == (1, 1)
+    assert target.last_error == 'not ready'
+
+def test_load_targets_rejects_duplicates(tmp_path):
+    filename = tmp_path / 'targets.yml'
+    filename.write_text(
+        '- {url: ws://a/websocket, gym: some/gym, interval: 300}\n'
+        '- {url: ws://b/websocket, gym: some/gym, interval: 300}\n')
+    targets = schedule_scrapes.load_targets(str(filename), default_timeout=60)
+    assert [t.timeout for t in targets] == [60, 60]
+    with filename.open('a') as f:
+        f.write('- {url: ws://a/websocket, gym: some/gym, interval: 600}\n')
+    with pytest.raises(ValueError, match='some/gym on ws://a/websocket'):
+        schedule_scrapes.load_targets(str(filename))
+
+def test_scrape_writes_a_snapshot_per_gym(tmp_path):
+    boulders = {}
+    for gym in ['synthetic/gym0', 'synthetic/gym1']:
+        boulders.update(synthetic.SyntheticGym(
+            gym, 5, datetime.datetime(2019, 1, 1)).snapshot())
+    server = fake_ddp_server.FakeDDPServer(boulders)
+    url = server.start_thread()
+    try:
+        targets = [schedule_scrapes.Target(url, gym, 10)
+                   for gym in ['synthetic/gym0', 'synthetic/gym1']]
+        scheduler = schedule_scrapes.Scheduler(
+            targets, str(tmp_path), fmt='jsonl', heartbeat_interval=None)
+        scheduler.scrape(url, targets)
+    finally:
+        server.stop_thread()
+    assert [(t.runs, t.successes) for t in targets] == [(1, 1), (1, 1)]
+    manifest = snapshots.SnapshotManifest(str(tmp_path))
+    filenames = manifest.list_files()
+    assert len(filenames) == 2
+    scraped = {}
+    for filename in filenames:
+        (_, gym_boulders), = snapshots.read_snapshots(filename)
+        scraped.update(gym_boulders)
+    assert scraped == {
+        b_id: {k: v for k, v in fields.items()
+               if k not in schema.DISCARDED_FIELDS}
+        for b_id, fields in boulders.items()}
@@ -0,0 +1,153 @@
+import copy
+import datetime
+import os
+import threading
+import time
+
+import pytest
+
+import fake_ddp_server
+import manage_data
+import reduce_boulders
+import schema
+import scrape_boulders
+import snapshots
+import synthetic
+
+from test_reduce import assert_boulders_equal
+
+def make_snapshots(n_snapshots=3):
+    gym = synthetic.SyntheticGym(
+        'synthetic/gym0', 10, datetime.datetime(2019, 1, 1), churn=0.2)
+    written = []
+    for _ in range(n_snapshots):
+        gym.advance(gym.date + datetime.timedelta(hours=6))
+        written.append((gym.date.isoformat(), copy.deepcopy(gym.snapshot())))
+    return written
+
+def get_filename(tmp_path, fmt):
+    return str(tmp_path / ('gym' + snapshots.SNAPSHOT_FORMATS[fmt].extension))
+
+@pytest.mark.parametrize('fmt', ['yaml', 'jsonl'])
+def test_write_read_round_trip(tmp_path, fmt):
+    written = make_snapshots()
+    fn = get_filename(tmp_path, fmt)
+    snapshots.write_snapshot(fn, 'w', *written[0], manifest=False)
+    for snapshot in written[1:]:
+        snapshots.write_snapshot(fn, 'a', *snapshot, manifest=False)
+    assert list(snapshots.read_snapshots(fn)) == written
+    snapshots.write_snapshot(fn, 'w', *written[-1], manifest=False)
+    assert list(snapshots.read_snapshots(fn)) == written[-1:]
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        snapshots.get_snapshot_format('gym.txt')
+    assert not snapshots.is_snapshot_file('gym.txt')
+    assert snapshots.is_snapshot_file('gym.deltas.jsonl.gz')
+
+def test_convert_snapshots(tmp_path):
+    written = make_snapshots()
+    yaml_fn = get_filename(tmp_path, 'yaml')
+    for mode, snapshot in zip(['w', 'a', 'a'], written):
+        snapshots.write_snapshot(yaml_fn, mode, *snapshot, manifest=False)
+    jsonl_fn = get_filename(tmp_path, 'jsonl')
+    assert snapshots.convert_snapshots(yaml_fn, jsonl_fn) == len(written)
+    assert list(snapshots.read_snapshots(jsonl_fn)) == written
+    assert_boulders_equal(
+        manage_data.boulders_yaml_to_dataframe([jsonl_fn]),
+        manage_data.boulders_yaml_to_dataframe([yaml_fn]))
+
+def wait_for(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, 'timed out'
+        time.sleep(0.01)
+
+def test_delta_log_replay(tmp_path):
+    fn = get_filename(tmp_path, 'deltas')
+    fmt = snapshots.SNAPSHOT_FORMATS['deltas']
+    boulders = {'a': {'grade': 1, 'zone': 2}, 'b': {'grade': 3}}
+    log = snapshots.DeltaLogWriter(fn, manifest=False)
+    log.checkpoint(boulders)
+    fields = {'grade': 4}
+    log.record('added', 'c', fields=fields)
+    fields['grade'] = 5  # events are written as they were recorded
+    log.record('changed', 'a', fields={'grade': 6}, cleared=['zone'])
+    log.record('removed', 'b')
+    log.close()
+    expected = {'a': {'grade': 6}, 'c': {'grade': 4}}
+
+    read = list(snapshots.read_snapshots(fn))
+    assert [b for _, b in read] == [boulders, expected]
+    assert fmt.replay(fn, '2000-01-01') is None
+    assert fmt.replay(fn, read[0][0]) == boulders
+    assert fmt.replay(fn, read[1][0]) == expected
+
+def test_watch_client_records_server_changes(tmp_path):
+    gym = synthetic.SyntheticGym(
+        'synthetic/gym0', 5, datetime.datetime(2019, 1, 1))
+    old = gym.snapshot()
+    server = fake_ddp_server.FakeDDPServer(copy.deepcopy(old))
+    url = server.start_thread()
+    fn = get_filename(tmp_path, 'deltas')
+    log = snapshots.DeltaLogWriter(fn, manifest=False)
+    client = scrape_boulders.BouldersWatchClient(url, gym.gym, log)
+    thread = threading.Thread(target=client.run_forever, daemon=True)
+    try:
+        thread.start()
+        wait_for(lambda: client.ready)
+        new = copy.deepcopy(old)
+        removed, changed, cleared = sorted(new)[:3]
+        del new[removed]
+        new[changed]['sentsCount'] += 1
+        del new[cleared]['comment']
+        new['added'] = dict(new[changed], boulderNum=99)
+        server.replace_boulders(copy.deepcopy(new))
+        # removed events are sent last
+        wait_for(lambda: removed not in client.boulders)
+    finally:
+        client.close()
+        thread.join()
+        server.stop_thread()
+    log.close()
+
+    def strip(boulders):
+        return {b_id: {k: v for k, v in fields.items()
+                       if k not in schema.DISCARDED_FIELDS}
+                for b_id, fields in boulders.items()}
+    read = list(snapshots.read_snapshots(fn))
+    assert [b for _, b in read] == [strip(old), strip(new)]
+
+def test_manifest_lists_files_with_new_snapshots(tmp_path):
+    manifest = snapshots.SnapshotManifest(str(tmp_path))
+    assert manifest.list_files() == []
+    for name in ['a.yml', 'b.yml', 'c.yml']:
+        (tmp_path / name).write_text('')
+    manifest.add('a.yml', '2019-01-01T00:00:00', '2019-01-01T00:01:00')
+    manifest.add('b.yml', '2019-01-02T00:00:00', '2019-01-02T00:01:00')
+    # appended to a file first written before the date
+    manifest.add('a.yml', '2019-01-03T00:00:00', '2019-01-03T00:01:00')
+    manifest.add('gone.yml', '2019-01-04T00:00:00', '2019-01-04T00:01:00')
+    after = datetime.datetime(2019, 1, 2, 12)
+    assert [e['date'] for e in manifest.entries(after)] == [
+        '2019-01-03T00:00:00', '2019-01-04T00:00:00']
+    assert manifest.list_files(after) == [str(tmp_path / 'a.yml')]
+    assert manifest.list_files() == [
+        str(tmp_path / 'a.yml'), str(tmp_path / 'b.yml')]
+
+def test_manifest_rebuild(tmp_path):
+    written = make_snapshots()
+    for mode, snapshot in zip(['w', 'a'], written):
+        snapshots.write_snapshot(
+            get_filename(tmp_path, 'jsonl'), mode, *snapshot)
+    snapshots.write_snapshot(get_filename(tmp_path, 'yaml'), 'w', *written[2])
+    manifest = snapshots.SnapshotManifest(str(tmp_path))
+    entries = manifest.entries()
+    assert [e['date'] for e in entries] == [date for date, _ in written]
+    os.remove(manifest.filename)
+    assert manifest.rebuild() == 3
+    assert sorted(e['date'] for e in manifest.entries()) == [
+        date for date, _ in written]
+    after = datetime.datetime.fromisoformat(written[1][0])
+    assert reduce_boulders.list_files_to_reduce(str(tmp_path), after) == [
+        get_filename(tmp_path, 'yaml')]
@@ -0,0 +1,93 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+import manage_data
+import store
+import synthetic
+
+from test_reduce import assert_boulders_equal
+
+def reduce_snapshots(tmp_path, n_snapshots=8):
+    filenames = synthetic.write_gym_snapshots(
+        str(tmp_path / 'snapshots'), 2, 20, n_snapshots, fmt='jsonl',
+        interval=6 * 3600, churn=0.2)
+    return filenames, manage_data.boulders_yaml_to_dataframe(filenames)
+
+@pytest.mark.parametrize('encoding', ['samples', 'changes'])
+def test_write_read_round_trip(tmp_path, encoding):
+    _, boulders = reduce_snapshots(tmp_path)
+    boulder_store = store.BoulderStore(str(tmp_path / 'store'))
+    boulder_store.write(boulders, encoding=encoding)
+    assert boulder_store.list_gyms() == ['synthetic/gym0', 'synthetic/gym1']
+    assert_boulders_equal(boulder_store.read_boulders(expand=True), boulders)
+
+@pytest.mark.parametrize('encoding', ['samples', 'changes'])
+def test_append_equals_write(tmp_path, encoding):
+    filenames, boulders = reduce_snapshots(tmp_path)
+    boulder_store = store.BoulderStore(str(tmp_path / 'store'))
+    boulder_store.write(manage_data.boulders_yaml_to_dataframe(
+        filenames[:6]), encoding=encoding)
+    for stop in (10, 16):
+        # the snapshots are reduced again, and only the new samples appended
+        boulder_store.append(manage_data.boulders_yaml_to_dataframe(
+            filenames[:stop]))
+    assert boulder_store.count_segments() > 0
+    assert_boulders_equal(boulder_store.read_boulders(expand=True), boulders)
+    boulder_store.compact()
+    assert_boulders_equal(boulder_store.read_boulders(expand=True), boulders)
+
+def test_read_filters(tmp_path):
+    filenames, boulders = reduce_snapshots(tmp_path)
+    boulder_store = store.BoulderStore(str(tmp_path / 'store'))
+    boulder_store.write(manage_data.boulders_yaml_to_dataframe(filenames[:6]))
+    boulder_store.append(boulders)
+    color = boulders.holdsColor.iloc[0]
+    attributes = boulder_store.read_attributes(
+        columns=['holdsColor'], filters=[('holdsColor', '==', color)])
+    assert sorted(attributes.index) == sorted(
+        boulders.index[boulders.holdsColor == color])
+    time_series = boulder_store.read_time_series(
+        ids=list(attributes.index), start=pd.Timestamp('2019-01-02'))
+    assert len(time_series)
+    assert set(time_series.id) <= set(attributes.index)
+    assert (time_series.date >= pd.Timestamp('2019-01-02')).all()
+
+def test_compact_single_delta(tmp_path):
+    _, boulders = reduce_snapshots(tmp_path)
+    boulder_store = store.BoulderStore(str(tmp_path / 'store'))
+    # every table of an empty store is written as a delta segment
+    boulder_store.append(boulders, encoding='changes')
+    assert boulder_store.count_segments() > 0
+    boulder_store.compact()
+    assert boulder_store.count_segments() == 0
+    assert_boulders_equal(boulder_store.read_boulders(expand=True), boulders)
+
+def test_expanded_read_between_dates(tmp_path):
+    # boulders that rarely change, scraped over a few months
+    gym = synthetic.SyntheticGym(
+        'synthetic/gym0', 20, datetime.datetime(2019, 1, 1),
+        sents_per_day=0.02)
+    yaml_data = {}
+    for i in range(40):
+        if i:
+            gym.advance(gym.date + datetime.timedelta(days=3))
+        yaml_data[gym.date.isoformat()] = gym.snapshot()
+    boulders = manage_data.boulders_snapshots_to_dataframe(yaml_data)
+    previous = manage_data.boulders_snapshots_to_dataframe(
+        {d: yaml_data[d] for d in sorted(yaml_data)[:25]})
+    boulder_store = store.BoulderStore(str(tmp_path / 'store'))
+    boulder_store.write(previous, encoding='changes')
+    boulder_store.append(boulders)
+    start, end = pd.Timestamp('2019-02-10'), pd.Timestamp('2019-03-20')
+    expected = boulder_store.read_time_series(expand=True)
+    expected = expected[(expected.date >= start) & (expected.date <= end)]
+    time_series = boulder_store.read_time_series(
+        start=start, end=end, expand=True)
+    pd.testing.assert_frame_equal(
+        time_series.sort_values(['id', 'date'], ignore_index=True),
+        expected.sort_values(['id', 'date'], ignore_index=True))
+    # only the months between start and end are read
+    assert len(boulder_store._list_time_files(start=start, end=end)) < len(
+        boulder_store._list_time_files())
@@ -0,0 +1,42 @@
+import tracemalloc
+
+import manage_data
+import synthetic
+
+def write_snapshots(tmp_path, n_snapshots):
+    return synthetic.write_gym_snapshots(
+        str(tmp_path / str(n_snapshots)), 1, 300, n_snapshots, fmt='jsonl',
+        interval=300)
+
+def get_scan_peak_memory(tmp_path, n_snapshots):
+    ''' Peak memory of StreamingReducer while it reads the snapshots '''
+    filenames = write_snapshots(tmp_path, n_snapshots)
+    reducer = manage_data.StreamingReducer(chunk_rows=1000)
+    tracemalloc.start()
+    try:
+        for fn in filenames:
+            reducer.add_file(fn)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        reducer.result()
+    return peak
+
+def test_streaming_peak_memory_does_not_grow_with_snapshots(tmp_path):
+    # samples are flushed to disk every chunk_rows rows, so the memory used
+    # while reading the snapshots only depends on the size of a snapshot
+    peak = get_scan_peak_memory(tmp_path, 20)
+    peak_4x = get_scan_peak_memory(tmp_path, 80)
+    assert peak_4x < 1.5 * peak
+
+def test_stream_reduce_peak_memory(tmp_path):
+    filenames = write_snapshots(tmp_path, 80)
+    tracemalloc.start()
+    try:
+        boulders = manage_data.stream_reduce(filenames, max_memory=0.5)
+        output, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(boulders) >= 300
+    # building the output loads all the samples, but not much more
+    assert peak < 4 * output
@@ -0,0 +1,53 @@
+import pandas as pd
+
+import timeseries
+
+def test_encode_changes_keeps_first_and_last_samples():
+    time_series = pd.DataFrame({
+        'id': ['a', 'a', 'b', 'b', 'b'],
+        'date': pd.to_datetime(['2019-01-01', '2019-01-02', '2019-01-01',
+                                '2019-01-02', '2019-01-03']),
+        'sentsCount': [1, 1, 2, 2, 2],
+        })
+    encoded = timeseries.encode_changes(time_series)
+    assert list(encoded.index) == [0, 1, 2, 4]
+
+def test_encode_changes_keeps_changes():
+    time_series = pd.DataFrame({
+        'id': ['a'] * 4,
+        'date': pd.date_range('2019-01-01', periods=4),
+        'sentsCount': [1, 2, 2, 2],
+        })
+    encoded = timeseries.encode_changes(time_series)
+    assert list(encoded.index) == [0, 1, 3]
+    resampled = timeseries.resample(encoded, time_series.date)
+    pd.testing.assert_frame_equal(resampled, time_series)
+
+def test_resample_gyms_uses_the_dates_of_each_gym():
+    time_series = pd.DataFrame({
+        'id': ['a', 'a', 'a', 'b', 'b'],
+        'date': pd.to_datetime(['2019-01-01 00:00', '2019-01-01 01:00',
+                                '2019-01-01 02:00', '2019-01-01 00:30',
+                                '2019-01-01 02:30']),
+        'sentsCount': [1, 1, 1, 2, 2],
+        })
+    gyms = pd.Series({'a': 'gym0', 'b': 'gym1'})
+    dates = timeseries.get_gym_dates(time_series, gyms)
+    assert [len(dates[gym]) for gym in ('gym0', 'gym1')] == [3, 2]
+    encoded = timeseries.encode_changes(time_series)
+    resampled = timeseries.resample_gyms(encoded, gyms, dates)
+    pd.testing.assert_frame_equal(
+        resampled, time_series.sort_values('date', ignore_index=True))
+
+def test_resample_fills_the_snapshots_a_boulder_is_missing_from():
+    dates = pd.date_range('2019-01-01', periods=3)
+    # the boulder is missing from the second snapshot
+    time_series = pd.DataFrame({
+        'id': ['a', 'a'],
+        'date': dates[[0, 2]],
+        'sentsCount': [1, 1],
+        })
+    encoded = timeseries.encode_changes(time_series)
+    resampled = timeseries.resample(encoded, dates)
+    assert list(resampled.date) == list(dates)
+    assert list(resampled.sentsCount) == [1, 1, 1]
@@ -0,0 +1,31 @@
+import datetime
+
+import numpy as np
+
+import manage_data
+import synthetic
+import timeseries
+import view_boulders
+
+def test_missing_counts_are_not_plotted():
+    gym = synthetic.SyntheticGym(
+        'synthetic/gym0', 3, datetime.datetime(2019, 1, 1))
+    yaml_data = {}
+    for i in range(3):
+        if i:
+            gym.advance(gym.date + datetime.timedelta(hours=6))
+        yaml_data[gym.date.isoformat()] = gym.snapshot()
+    date_str = sorted(yaml_data)[1]
+    b_id = sorted(yaml_data[date_str])[0]
+    yaml_data[date_str][b_id]['sentsCount'] = None
+    boulders = manage_data.boulders_snapshots_to_dataframe(yaml_data)
+    time_series = timeseries.TimeSeriesArray.from_frames(
+        boulders.index, boulders.time)
+    assert timeseries.MISSING_COUNT in time_series.view(b_id)['sentsCount']
+    time_series.add_boulder_age(boulders.addedAt)
+    boulders = manage_data.add_derived_attributes(boulders)
+    source = view_boulders.get_boulders_data_source(boulders, time_series)
+    sents_count = source.data['sentsCount'][list(boulders.index).index(b_id)]
+    assert np.isnan(sents_count[1])
+    assert not np.any(np.concatenate(source.data['sentsCount'])
+                      == timeseries.MISSING_COUNT)
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pandas as pd
+
+# value of counts that are missing in the scraped data
+MISSING_COUNT = -1
+
+# encodings of time series in long format:
+# - 'samples': every scraped sample is kept
+# - 'changes': only the samples at which a value changes are kept, as well
+#   as the first and last sample of each boulder
+ENCODINGS = ['samples', 'changes']
+
+def hide_missing(values):
+    ''' Replace missing counts by NaN, eg so that they are not plotted
+
+    Parameters
+    ==========
+    values : array-like
+        Samples of a column. Integer columns store missing counts as
+        MISSING_COUNT, other columns are returned unchanged.
+
+    Returns
+    =======
+    values : numpy.ndarray
+    '''
+    values = np.asarray(values)
+    if not np.issubdtype(values.dtype, np.integer):
+        return values
+    return np.where(values == MISSING_COUNT, np.nan, values)
+
+def encode_changes(time_series, columns=None):
+    ''' Keep only the samples at which a value changes
+
+    The first and last samples of each boulder are always kept, so that the
+    time range over which it was scraped is preserved. The snapshots from
+    which a boulder is missing in between are not recorded: the boulder is
+    assumed to keep its values, see resample().
+
+    Parameters
+    ==========
+    time_series : pandas.DataFrame
+        Time series in long format, with 'id' and 'date' columns.
+    columns : list of str or None (default: None)
+        Columns in which changes are detected. If None, use all columns
+        besides 'id' and 'date'.
+
+    Returns
+    =======
+    time_series : pandas.DataFrame
+        The kept samples, in their original order.
+    '''
+    if columns is None:
+        columns = [c for c in time_series.columns if c not in ('id', 'date')]
+    time_series = time_series.reset_index(drop=True)
+    if time_series.empty:
+        return time_series
+    by_boulder = time_series.sort_values(['id', 'date'], kind='mergesort')
+    ids = by_boulder.id.to_numpy()
+    new_id = ids[1:] != ids[:-1]
+    first = np.ones(len(by_boulder), dtype=bool)
+    first[1:] = new_id  # first sample of each boulder
+    last = np.ones(len(by_boulder), dtype=bool)
+    last[:-1] = new_id  # last sample of each boulder
+    keep = first | last
+    for column in columns:
+        values = by_boulder[column]
+        previous = values.shift()
+        changed = (values != previous) & ~(values.isna() & previous.isna())
+        keep |= changed.to_numpy(dtype=bool)
+    mask = np.zeros(len(time_series), dtype=bool)
+    mask[by_boulder.index.to_numpy()] = keep
+    return time_series[mask]
+
+def encode(time_series, encoding):
+    ''' Encode time series in long format
+
+    Parameters
+    ==========
+    time_series : pandas.DataFrame
+        Time series in long format, with every sample.
+    encoding : str
+        One of ENCODINGS.
+    '''
+    if encoding == 'samples':
+        return time_series
+    if encoding == 'changes':
+        return encode_changes(time_series)
+    raise ValueError('unknown time series encoding: {}'.format(encoding))
+
+def resample(time_series, dates):
+    ''' Resample change-encoded time series onto a grid of dates
+
+    Each boulder is sampled at the dates of the grid between its first and
+    last samples, with the values of its latest sample. Resampling onto the
+    dates of the scraped snapshots recovers the time series before
+    encode_changes(), except that a boulder missing from some snapshots
+    between its first and last samples is sampled at their dates too.
+
+    Parameters
+    ==========
+    time_series : pandas.DataFrame
+        Time series in long format, with 'id' and 'date' columns.
+    dates : array-like of datetime
+        The grid of dates.
+
+    Returns
+    =======
+    time_series : pandas.DataFrame
+        The resampled time series, sorted by date.
+    '''
+    columns = list(time_series.columns)
+    dates = np.unique(pd.to_datetime(np.asarray(dates)).to_numpy())
+    if time_series.empty or not len(dates):
+        return pd.DataFrame(columns=columns)
+    time_series = time_series.assign(date=pd.to_datetime(time_series.date))
+    span = time_series.groupby('id', sort=True).date.agg(['min', 'max'])
+    starts = dates.searchsorted(span['min'].to_numpy(), side='left')
+    stops = dates.searchsorted(span['max'].to_numpy(), side='right')
+    counts = np.maximum(stops - starts, 0)
+    offsets = np.cumsum(counts) - counts
+    grid_index = (np.arange(counts.sum())
+                  - np.repeat(offsets, counts) + np.repeat(starts, counts))
+    grid = pd.DataFrame({
+        'id': np.repeat(span.index.to_numpy(), counts),
+        'date': dates[grid_index],
+        })
+    resampled = pd.merge_asof(
+        grid.sort_values('date', kind='mergesort'),
+        time_series.sort_values('date', kind='mergesort'),
+        on='date', by='id', direction='backward')
+    return resampled[columns].reset_index(drop=True)
+
+def get_gym_dates(time_series, gyms):
+    ''' Get the dates of the samples of each gym
+
+    Gyms are scraped at different times, so each gym has its own grid of
+    sample dates.
+
+    Parameters
+    ==========
+    time_series : pandas.DataFrame
+        Time series in long format, with every sample.
+    gyms : pandas.Series
+        The gym of each boulder, indexed by id.
+
+    Returns
+    =======
+    dates : dict
+        Mapping between gyms and the sorted list of their sample dates.
+    '''
+    gym = time_series.id.map(gyms).to_numpy()
+    dates = pd.to_datetime(time_series.date)
+    return {g: list(pd.DatetimeIndex(d.unique()).sort_values())
+            for g, d in dates.groupby(gym)}
+
+def resample_gyms(time_series, gyms, dates):
+    ''' Resample change-encoded time series onto the grid of their gym
+
+    Parameters
+    ==========
+    time_series : pandas.DataFrame
+        Time series in long format, with 'id' and 'date' columns.
+    gyms : pandas.Series
+        The gym of each boulder, indexed by id.
+    dates : dict or array-like of datetime
+        Mapping between gyms and their grid of dates, see get_gym_dates().
+        Reduced boulders written by earlier versions have a single grid
+        for all gyms.
+
+    Returns
+    =======
+    time_series : pandas.DataFrame
+        The resampled time series, sorted by date.
+    '''
+    if not isinstance(dates, dict):
+        return resample(time_series, dates)
+    gym = time_series.id.map(gyms).to_numpy()
+    frames = [resample(t, dates.get(g, []))
+              for g, t in time_series.groupby(gym)]
+    if not frames:
+        return resample(time_series, [])
+    return pd.concat(frames, ignore_index=True).sort_values(
+        'date', kind='mergesort', ignore_index=True)
+
+def frames_column(frames):
+    ''' Get a column holding the time series of each boulder
+
+    Assigning a list of dataframes to a column would first stack them into
+    a single array when they have the same shape, which takes as much memory
+    as all of them.
+
+    Parameters
+    ==========
+    frames : list of pandas.DataFrame
+        The time series of each boulder.
+
+    Returns
+    =======
+    column : numpy.ndarray
+        An array of objects holding the dataframes.
+    '''
+    column = np.empty(len(frames), dtype=object)
+    for i, frame in enumerate(frames):
+        column[i] = frame
+    return column
+
+class TimeSeriesArray():
+    ''' Time series of many boulders, stored in contiguous arrays
+
+    The samples of all boulders are stored in one array per column, sorted
+    by boulder and date. The samples of the i-th boulder are found between
+    offsets[i] and offsets[i+1].
+
+    Parameters
+    ==========
+    ids : array-like of str
+        The boulder ids.
+    offsets : array-like of int
+        Start of the samples of each boulder, followed by the total number
+        of samples.
+    columns : dict of array-like
+        The samples of each column. Missing counts are stored as
+        MISSING_COUNT.
+    '''
+    dtypes = {
+        'date': 'datetime64[ns]',
+        'likesCount': np.int32,
+        'likesRatio': np.float32,
+        'sentsCount': np.int32,
+        }
+
+    def __init__(self, ids, offsets, columns):
+        self.ids = np.asarray(ids, dtype=object)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.columns = {}
+        for name, values in columns.items():
+            self.columns[name] = self._as_array(name, values)
+        self._index = {b_id: i for i, b_id in enumerate(self.ids)}
+
+    def _as_array(self, name, values):
+        dtype = self.dtypes.get(name)
+        if dtype is None:
+            return np.asarray(values)
+        if np.issubdtype(np.dtype(dtype), np.integer):
+            values = pd.to_numeric(pd.Series(values), errors='coerce')
+            values = values.fillna(MISSING_COUNT)
+        return np.asarray(values, dtype=dtype)
+
+    @classmethod
+    def from_long(cls, time_series, ids=None):
+        ''' Build from a long dataframe with an 'id' column
+
+        Parameters
+        ==========
+        time_series : pandas.DataFrame
+            Time series in long format, as returned by
+            store.BoulderStore.read_time_series().
+        ids : list of str or None (default: None)
+            The boulders to include, in this order. Boulders without samples
+            are included with an empty time series. If None, include the
+            boulders found in time_series, sorted by id.
+        '''
+        if ids is None:
+            ids = np.unique(time_series.id.to_numpy(dtype=object))
+        ids = list(ids)
+        position = pd.Series(np.arange(len(ids)), index=ids)
+        time_series = time_series[time_series.id.isin(position.index)]
+        position = position.reindex(time_series.id).to_numpy()
+        order = np.lexsort((time_series.date.to_numpy(), position))
+        time_series = time_series.iloc[order]
+        counts = np.bincount(position, minlength=len(ids))
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        columns = {c: time_series[c].to_numpy()
+                   for c in time_series.columns if c != 'id'}
+        return cls(ids, offsets, columns)
+
+    @classmethod
+    def from_frames(cls, ids, frames):
+        ''' Build from one dataframe per boulder
+
+        Parameters
+        ==========
+        ids : iterable of str
+            The boulder ids.
+        frames : iterable of pandas.DataFrame
+            The time series of each boulder, eg the 'time' column of the
+            dataframe returned by manage_data.boulders_yaml_to_dataframe().
+        '''
+        ids = list(ids)
+        frames = list(frames)
+        counts = [len(f) for f in frames]
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        names = list(frames[0].columns) if frames else list(cls.dtypes)
+        columns = {}
+        for name in names:
+            if frames:
+                columns[name] = np.concatenate(
+                    [f[name].to_numpy() for f in frames])
+            else:
+                columns[name] = []
+        return cls(ids, offsets, columns)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, b_id):
+        return b_id in self._index
+
+    @property
+    def counts(self):
+        ''' Number of samples of each boulder '''
+        return np.diff(self.offsets)
+
+    @property
+    def nbytes(self):
+        return (sum(a.nbytes for a in self.columns.values())
+                + self.offsets.nbytes + self.ids.nbytes)
+
+    def view(self, b_id):
+        ''' Get the samples of a boulder, without copying them
+
+        Returns
+        =======
+        columns : dict of numpy.ndarray
+            The samples of each column.
+        '''
+        i = self._index[b_id]
+        start, stop = self.offsets[i], self.offsets[i+1]
+        return {name: a[start:stop] for name, a in self.columns.items()}
+
+    def select(self, mask):
+        ''' Get the samples selected by a boolean mask
+
+        Returns
+        =======
+        time_series : TimeSeriesArray
+            A new container with the selected samples of all boulders.
+        '''
+        selected = np.concatenate([[0], np.cumsum(mask, dtype=np.int64)])
+        offsets = selected[self.offsets]
+        columns = {name: a[mask] for name, a in self.columns.items()}
+        return TimeSeriesArray(self.ids, offsets, columns)
+
+    def to_frame(self, b_id):
+        ''' Get the samples of a boulder as a dataframe '''
+        return pd.DataFrame(self.view(b_id))
+
+    def repeat(self, values):
+        ''' Repeat a per-boulder value for each sample of the boulder
+
+        Parameters
+        ==========
+        values : pandas.Series
+            Values indexed by boulder id.
+        '''
+        values = values.reindex(self.ids).to_numpy()
+        return np.repeat(values, self.counts)
+
+    def last(self, name):
+        ''' Get the last sample of each boulder for a column
+
+        Boulders without samples are not included.
+        '''
+        counts = self.counts
+        return pd.Series(self.columns[name][self.offsets[1:][counts > 0] - 1],
+                         index=self.ids[counts > 0])
+
+    def add_boulder_age(self, added_at):
+        ''' Add a 'boulderAge' column, in days since each boulder was added
+
+        Parameters
+        ==========
+        added_at : pandas.Series
+            The date at which each boulder was added, indexed by boulder id.
+        '''
+        added_at = self.repeat(pd.to_datetime(added_at))
+        age = self.columns['date'] - added_at.astype('datetime64[ns]')
+        age = age / np.timedelta64(1, 'D')
+        self.columns['boulderAge'] = age.astype(np.float32)
@@ -1,11 +1,21 @@
 #!/usr/bin/env python3
 
 import datetime
+import os
 
 import bokeh as bk
 import bokeh.plotting
 import pandas as pd
 
+import conversion
+import downsample
+import manage_data
+import models
+import profiling
+import query
+import store
+import timeseries
+
 class PlotData:
     holds_colors = {
         2: '#FFEB3B',
@@ -27,26 +37,32 @@ class PlotData:
 
     holds_colors_default_active = [2, 3, 4]
 
-    def get_thumbnail(pic):
-        try:
-            return pic.zoom
-        except AttributeError:
-            pass
+    def get_thumbnail(zoom_id):
+        if isinstance(zoom_id, str):
+            return models.get_picture_zoom_url(zoom_id)
+
+    # process functions with a bulk attribute are applied to whole columns
+    get_thumbnail.bulk = models.get_picture_zoom_urls
+
+    def to_datetime(date):
+        # bokeh cannot serialize NaT, eg the closedAt of open boulders
+        date = pd.to_datetime(date)
+        return None if pd.isna(date) else date
 
     data = [
         # data source (in boulder), data name, process function
         ('gym',  None, None),
         ('id',  None, None),
-        ('picture',  'thumbnail', get_thumbnail),
+        ('pictureZoom',  'thumbnail', get_thumbnail),
         ('zone',  None, None),
         ('holdsColor',  None, lambda c: PlotData.holds_colors[c]),
         ('grade',  None, lambda g: '{}'.format(g)),
         ('routeTypes',  None, None),
         ('routeSetter',  None, None),
-        ('createdAt',  None, pd.to_datetime),
-        ('addedAt',  None, pd.to_datetime),
-        ('updatedAt', None, pd.to_datetime),
-        ('closedAt', None, pd.to_datetime),
+        ('createdAt',  None, to_datetime),
+        ('addedAt',  None, to_datetime),
+        ('updatedAt', None, to_datetime),
+        ('closedAt', None, to_datetime),
         ('url', None, None),
         ('comment', None, None),
         ]
@@ -79,8 +95,8 @@ class PlotData:
         ('sentsCount', None),
         ]
 
-def get_boulder_data_source(boulder):
-    n = len(boulder.time.index)
+def get_boulder_data_source(boulder, time):
+    n = len(time['date'])
     boulder_data = boulder._asdict()
     source_data = {}
     plot_data = PlotData()
@@ -92,36 +108,130 @@ def get_boulder_data_source(boulder):
             key_dst = key_src
         source_data[key_dst] = [data]*n
     for key, func in plot_data.time_series:
-        data = boulder.time[key]
+        # missing counts are not plotted
+        data = timeseries.hide_missing(time[key])
         if func:
             data = [func(d) for d in data]
         source_data[key] = data
     source = bk.models.ColumnDataSource(data=source_data)
     return source
 
+def get_boulders_data_source(boulders, time_series,
+                             time_columns=('boulderAge', 'sentsCount')):
+    ''' Get a data source with one row per boulder, for a multi_line glyph
 
-if __name__ == '__main__':
+    Static attributes are stored once per boulder, and each time series as
+    one array per boulder.
 
-    import argparse
-    parser = argparse.ArgumentParser(
-        description='Create bokeh view of boulders sents')
-    parser.add_argument(
-        'input_pkl',
-        type=str,
-        help='pkl file containing the reduced boulders dataframe')
-    parser.add_argument(
-        'output_html',
-        type=str,
-        help='output plot html file')
-    args = parser.parse_args()
+    Parameters
+    ==========
+    boulders : pandas.DataFrame
+        The boulders attributes, indexed by id.
+    time_series : timeseries.TimeSeriesArray
+        The boulders time series.
+    time_columns : list of str (default: ('boulderAge', 'sentsCount'))
+        The time series to include.
+    '''
+    source_data = {}
+    for key_src, key_dst, func in PlotData.data:
+        if hasattr(func, 'bulk'):
+            data = list(func.bulk(boulders[key_src]))
+        elif func:
+            data = [func(d) for d in boulders[key_src]]
+        else:
+            data = list(boulders[key_src])
+        if key_dst is None:
+            key_dst = key_src
+        source_data[key_dst] = data
+    times = [time_series.view(b_id) for b_id in boulders.index]
+    for key, func in PlotData.time_series:
+        if key not in time_columns:
+            continue
+        data = [timeseries.hide_missing(time[key]) for time in times]
+        if func:
+            data = [[func(d) for d in values] for values in data]
+        source_data[key] = data
+    source_data['holdsColorId'] = list(boulders.holdsColor)
+    source_data['lineColor'] = [
+        PlotData.holds_colors.get(c, '#777777') for c in boulders.holdsColor]
+    return bk.models.ColumnDataSource(data=source_data)
 
-    boulders = pd.read_pickle(args.input_pkl)
+def plot_lines(p, boulders, time_series, checkbox_group):
+    ''' Plot each boulder with its own line and data source '''
+    lines = []
     for boulder in boulders.itertuples():
-        boulder_age = (boulder.time.date - boulder.addedAt).dt.total_seconds()
-        boulder_age /= 86400 # seconds to days
-        boulder.time['boulderAge'] = boulder_age
+        l = p.line(
+            'boulderAge',
+            'sentsCount',
+            line_color=PlotData.holds_colors.get(boulder.holdsColor, '#777777'),
+            source=get_boulder_data_source(
+                boulder, time_series.view(boulder.Index)),
+            tags=[boulder.holdsColor],
+            )
+        lines.append(l)
+
+    checkbox_callback = bk.models.callbacks.CustomJS(
+        args=dict(lines=lines),
+        code="""
+            for (let l of lines) {
+                let color = l.glyph.tags[0];
+                let visible = (cb_obj.active.indexOf(color - 2) >= 0)
+                l.visible = visible;
+                // console.log(l.id + " " + color + " " + visible);
+            }
+            """,
+        )
+    checkbox_group.js_on_change('active', checkbox_callback)
+
+def plot_multi_line(p, boulders, time_series, checkbox_group):
+    ''' Plot all boulders with a single multi_line glyph
+
+    Colors are shown or hidden by a filter on the shared data source, rather
+    than by toggling one line per boulder.
+    '''
+    source = get_boulders_data_source(boulders, time_series)
+    color_filter = bk.models.BooleanFilter(booleans=[True] * len(boulders))
+    p.multi_line(
+        'boulderAge',
+        'sentsCount',
+        line_color='lineColor',
+        source=source,
+        view=bk.models.CDSView(source=source, filters=[color_filter]),
+        )
+
+    checkbox_callback = bk.models.callbacks.CustomJS(
+        args=dict(source=source, color_filter=color_filter),
+        code="""
+            const active = cb_obj.active;
+            color_filter.booleans = source.data.holdsColorId.map(
+                (color) => active.indexOf(color - 2) >= 0);
+            source.change.emit();
+            """,
+        )
+    checkbox_group.js_on_change('active', checkbox_callback)
+
+def query_open_boulders(index, date):
+    ''' Get the ids of the boulders open at a date
 
+    Boulders without closedAt are still open. Boulders without addedAt are
+    left out, as their age, on the x axis, is unknown.
 
+    Parameters
+    ==========
+    index : query.BoulderIndex
+        The index of the boulders.
+    date : datetime.datetime
+        The date at which boulders are open.
+    '''
+    return index.query(open_at=date)
+
+RENDER_MODES = {
+    'lines': plot_lines,
+    'multi_line': plot_multi_line,
+    }
+
+def make_figure(title):
+    ''' Create the figure of boulders sents against their age '''
     plot_data = PlotData()
     hover_tool = bk.models.HoverTool(
         tooltips=plot_data.tooltips,
@@ -131,9 +241,8 @@ if __name__ == '__main__':
         callback=bk.models.OpenURL(url='@url'),
         )
 
-    bk.plotting.output_file(args.output_html)
     p = bk.plotting.figure(
-        title=list(set(boulders.gym))[0],
+        title=title,
         x_axis_label='Problem age [days]',
         y_axis_label='Number of sents',
         tools='pan,box_zoom,wheel_zoom,save,reset',
@@ -142,36 +251,144 @@ if __name__ == '__main__':
         )
     p.add_tools(hover_tool)
     p.add_tools(tap_tool)
+    return p
 
-    plot_boulders = boulders[boulders.closedAt > datetime.datetime.now()]
-    lines = []
-    for boulder in plot_boulders.itertuples():
-        l = p.line(
-            'boulderAge',
-            'sentsCount',
-            line_color=plot_data.holds_colors.get(boulder.holdsColor, '#777777'),
-            source=get_boulder_data_source(boulder),
-            tags=[boulder.holdsColor],
-            )
-        lines.append(l)
-
-    checkbox_group = bk.models.CheckboxGroup(
+def make_color_checkboxes(active=PlotData.holds_colors_default_active):
+    return bk.models.CheckboxGroup(
         labels=list(PlotData.holds_colors_names.values()),
-        active=PlotData.holds_colors_default_active,
+        active=active,
         width=100,
         )
-    checkbox_callback = bk.models.callbacks.CustomJS(
-        args=dict(lines=lines),
-        code="""
-            for (let l of lines) {
-                let color = l.glyph.tags[0];
-                let visible = (cb_obj.active.indexOf(color - 2) >= 0)
-                l.visible = visible;
-                // console.log(l.id + " " + color + " " + visible);
-            }
-            """,
-        )
-    checkbox_group.js_on_change('active', checkbox_callback)
 
-    l = bk.layouts.row(checkbox_group, p)
-    bk.plotting.save(l)
+def plot_boulders(boulders, time_series, title, mode='multi_line'):
+    ''' Plot the sents of boulders against their age
+
+    Parameters
+    ==========
+    boulders : pandas.DataFrame
+        The attributes of the boulders to plot, indexed by id.
+    time_series : timeseries.TimeSeriesArray
+        The boulders time series, with a 'boulderAge' column.
+    title : str
+        The plot title.
+    mode : str (default: 'multi_line')
+        How boulders are rendered, one of RENDER_MODES.
+
+    Returns
+    =======
+    layout : bokeh.layouts.LayoutDOM
+        The plot and its widgets.
+    '''
+    p = make_figure(title)
+    checkbox_group = make_color_checkboxes()
+    RENDER_MODES[mode](p, boulders, time_series, checkbox_group)
+    return bk.layouts.row(checkbox_group, p)
+
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Create bokeh view of boulders sents')
+    parser.add_argument(
+        'input',
+        type=str,
+        help=('pkl file containing the reduced boulders dataframe, '
+              'or directory containing the reduced boulders parquet store'))
+    parser.add_argument(
+        'output_html',
+        type=str,
+        help='output plot html file')
+    parser.add_argument(
+        '--mode',
+        type=str,
+        choices=list(RENDER_MODES),
+        default='multi_line',
+        help=('render all boulders with a single multi_line glyph, or each '
+              'boulder with its own line (default: multi_line)'))
+    parser.add_argument(
+        '--downsample',
+        type=str,
+        choices=['none'] + list(downsample.DOWNSAMPLING_METHODS),
+        default='lttb',
+        help=('method used to reduce the number of plotted points: '
+              'Largest-Triangle-Three-Buckets, or min/max of x buckets '
+              '(default: lttb)'))
+    parser.add_argument(
+        '--points-per-boulder',
+        type=int,
+        default=1000,
+        help='maximum number of plotted points per boulder (default: 1000)')
+    parser.add_argument(
+        '--points-per-plot',
+        type=int,
+        default=100000,
+        help='maximum number of plotted points (default: 100000)')
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.start_from_args(args)
+
+    now = datetime.datetime.now()
+    if os.path.isdir(args.input):
+        # only load the open boulders, and the attributes that are plotted
+        boulder_store = store.BoulderStore(args.input)
+        with profiling.span('index'):
+            index = query.BoulderIndex.from_store(boulder_store)
+            ids = list(query_open_boulders(index, now))
+            gyms = index.get_gyms(ids)
+        with profiling.span('read'):
+            derived = [p for p, _, _ in
+                       manage_data.BOULDER_PROPS_USE['derived_attributes']]
+            boulders = boulder_store.read_attributes(
+                columns=[key_src for key_src, _, _ in PlotData.data
+                         if key_src not in derived],
+                gyms=gyms,
+                filters=[('id', 'in', ids)],
+                ).reindex(ids)
+            # change-encoded series are expanded, so that sentsCount is
+            # plotted as steps rather than as slopes between changes
+            time_series = timeseries.TimeSeriesArray.from_long(
+                boulder_store.read_time_series(
+                    gyms=gyms, ids=ids, expand=True),
+                ids=boulders.index)
+    else:
+        with profiling.span('read'):
+            boulders = conversion.upgrade_attributes(
+                pd.read_pickle(args.input))
+        with profiling.span('index'):
+            index = query.BoulderIndex(boulders)
+            boulders = boulders.loc[query_open_boulders(index, now)]
+        with profiling.span('time_series'):
+            if 'dates' in boulders.attrs:
+                # expand change-encoded series, as for the parquet store
+                _, long_time_series = store.split_boulders(boulders)
+                time_series = timeseries.TimeSeriesArray.from_long(
+                    timeseries.resample_gyms(
+                        long_time_series, boulders.gym,
+                        boulders.attrs['dates']),
+                    ids=boulders.index)
+            else:
+                time_series = timeseries.TimeSeriesArray.from_frames(
+                    boulders.index, boulders.time)
+    title = index.gyms[0]
+    boulders = manage_data.add_derived_attributes(boulders)
+    profiling.count('boulders', len(boulders))
+    profiling.count('samples', time_series.offsets[-1])
+    with profiling.span('boulder_age'):
+        time_series.add_boulder_age(boulders.addedAt)
+    if args.downsample != 'none':
+        with profiling.span('downsample'):
+            time_series = downsample.downsample(
+                time_series, 'boulderAge', 'sentsCount',
+                method=args.downsample,
+                points_per_boulder=args.points_per_boulder,
+                points_per_plot=args.points_per_plot)
+        profiling.count('plotted_samples', time_series.offsets[-1])
+
+    bk.plotting.output_file(args.output_html)
+    with profiling.span('plot'):
+        l = plot_boulders(boulders, time_series, title, mode=args.mode)
+    with profiling.span('save'):
+        bk.plotting.save(l)
+    print('Saved {} ({:.2f} MB)'.format(
+        args.output_html, os.path.getsize(args.output_html) / 2**20))